@@ -1,31 +1,46 @@
 import os
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI
-from tortoise import Tortoise
-from fastapi.staticfiles import StaticFiles
-
-from app.core.exceptions import SettingNotFound
-from app.core.init_app import (
-    init_data,
-    make_middlewares,
-    register_exceptions,
-    register_routers,
-)
-
-try:
-    from app.settings.config import settings
-except ImportError:
-    raise SettingNotFound("Can not import settings")
+# 应用实例按需创建 (见模块末尾的 __getattr__)，路由 / 中间件 / 模型也只在 create_app 中导入:
+# 渲染服务等 spawn 出的子进程导入 app 包下的模块时不会连带构建整个 FastAPI 应用
+
 
 @asynccontextmanager
-async def lifespan(app: FastAPI):
+async def lifespan(app):
+    from tortoise import Tortoise
+
+    from app.core.executor import imaging_executor
+    from app.core.init_app import init_data
+    from app.core.render_service import create_service, render_client
+    from app.settings.config import settings
+    from app.utils.prefetch import prefetcher
+
     await init_data()
+    service = None
+    if settings.RENDER_SERVICE_ENABLED and settings.RENDER_SERVICE_AUTOSTART:
+        service = create_service()
+        service.start()
     yield
+    render_client.close()
+    if service is not None:
+        service.stop()
+    prefetcher.shutdown()
+    imaging_executor.shutdown()
     await Tortoise.close_connections()
 
 
-def create_app() -> FastAPI:
+def create_app():
+    from fastapi import FastAPI
+    from fastapi.staticfiles import StaticFiles
+
+    from app.core.exceptions import SettingNotFound
+    from app.core.init_app import make_middlewares, register_exceptions, register_routers
+
+    try:
+        from app.settings.config import settings
+    except ImportError:
+        raise SettingNotFound("Can not import settings")
+
     app = FastAPI(
         title=settings.APP_TITLE,
         description=settings.APP_DESCRIPTION,
@@ -42,4 +57,9 @@ def create_app() -> FastAPI:
     return app
 
 
-app = create_app()
+def __getattr__(name):
+    # uvicorn "app:app" 与 `from app import app` 首次访问时创建，之后复用同一个实例
+    if name == "app":
+        globals()["app"] = app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,8 +1,12 @@
 # app/api/v1/image.py
-from fastapi import APIRouter, UploadFile, File, Form
-from typing import List
+from fastapi import APIRouter, Depends, UploadFile, File, Form, Query, Header, WebSocket
+from typing import List, Optional
 from app.controllers.image import ImageController
-from app.schemas.image import Image360Out, PerspectiveRequest, AnnotationCreate, AnnotationOut
+from app.controllers.viewer import ViewerSession
+from app.settings import settings
+from app.schemas.image import (Image360Out, PerspectiveRequest, PerspectiveView, BatchViewRequest, AnnotationCreate,
+                               AnnotationOut, AnnotationProjected, AnnotationBatchCreate, AnnotationBatchOut, AnnotationOverlapsOut,
+                               BoundaryOptions, ViewSpec)
 
 router = APIRouter()
 
@@ -14,14 +18,138 @@ async def upload_image(
     # 注意：文件上传时，如果需要带额外参数，FastAPI 推荐使用 Form 表单格式
     return await ImageController.upload_image(project_id, file)
 
+@router.post("/{image_id}/replace", response_model=Image360Out, summary="替换全景图源文件")
+async def replace_image(image_id: int, file: UploadFile = File(..., description="全景图文件")):
+    return await ImageController.replace_image(image_id, file)
+
+@router.delete("/{image_id}", summary="删除全景图")
+async def delete_image(image_id: int):
+    return await ImageController.delete_image(image_id)
+
 @router.get("/list", response_model=List[Image360Out], summary="获取某项目下的所有图片")
 async def get_images(project_id: int):
     return await ImageController.get_images_by_project(project_id)
 
 @router.post("/crop", summary="获取透视切片 (核心算法)")
 async def get_perspective_crop(req: PerspectiveRequest):
-    return await ImageController.get_perspective_crop(req.image_id, req.u, req.v, req.fov)
+    return await ImageController.get_perspective_crop(req.image_id, req.u, req.v, req.fov, req.annotations)
+
+@router.get("/{image_id}/view", summary="获取透视切片二进制图像 (支持 ETag 缓存)")
+async def get_perspective_view(
+    image_id: int,
+    theta: float = Query(0.0, description="视角中心经度 (弧度)"),
+    phi: float = Query(0.0, ge=-1.5708, le=1.5708, description="视角中心纬度 (弧度)"),
+    fov: float = Query(90.0, gt=0, lt=180, description="水平视场角 (角度)"),
+    w: int = Query(512, ge=16, le=4096, description="输出宽度"),
+    h: int = Query(512, ge=16, le=4096, description="输出高度"),
+    fmt: str = Query("jpg", pattern="^(jpg|webp)$", description="输出格式"),
+    quality: int = Query(90, ge=1, le=100, description="编码质量"),
+    mode: str = Query(settings.PANO_RENDER_MODE, pattern="^(erp|cube)$", description="采样路径: ERP 或立方体贴图"),
+    progressive: bool = Query(False, description="先推送低分辨率预览，再推送完整结果 (multipart/x-mixed-replace)"),
+    if_none_match: Optional[str] = Header(None),
+):
+    view = PerspectiveView(theta=theta, phi=phi, fov=fov, w=w, h=h, fmt=fmt, quality=quality, mode=mode,
+                           progressive=progressive)
+    return await ImageController.get_perspective_view(image_id, view, if_none_match)
+
+@router.websocket("/{image_id}/ws")
+async def viewer_session(websocket: WebSocket, image_id: int):
+    # 实时浏览会话: 客户端推送位姿，服务端只渲染最新位姿并回推二进制帧
+    await ViewerSession.serve(websocket, image_id)
+
+@router.post("/{image_id}/views", summary="批量多视角透视切片 (zip / multipart)")
+async def get_perspective_views(image_id: int, req: BatchViewRequest):
+    return await ImageController.get_perspective_views(image_id, req)
+
+@router.post("/{image_id}/cubemap", summary="生成立方体贴图衍生文件")
+async def generate_cubemap(image_id: int):
+    return await ImageController.generate_cubemap(image_id)
+
+@router.get("/metrics", summary="图像子系统运行指标")
+async def get_metrics():
+    return await ImageController.get_metrics()
+
+def boundary_options(
+    tolerance: float = Query(0.0, ge=0, description="点阵简化容差 (像素)，0 表示不简化"),
+    max_points: int = Query(0, ge=0, description="每个多边形的点数上限，0 表示不限"),
+    accept: Optional[str] = Header(None),
+):
+    # Accept 为 application/x-boundary-f32 / application/x-boundary-delta 时返回二进制点阵，否则 JSON
+    return BoundaryOptions(tolerance=tolerance, max_points=max_points, accept=accept)
 
 @router.post("/{image_id}/annotate", response_model=AnnotationOut, summary="保存标注结果")
-async def save_annotation(image_id: int, obj_in: AnnotationCreate):
-    return await ImageController.create_annotation(image_id, obj_in)
\ No newline at end of file
+async def save_annotation(image_id: int, obj_in: AnnotationCreate, options: BoundaryOptions = Depends(boundary_options)):
+    return await ImageController.create_annotation(image_id, obj_in, options=options)
+
+@router.get("/{image_id}/annotations", response_model=List[AnnotationOut], summary="获取图片的全部标注")
+async def get_annotations(image_id: int, options: BoundaryOptions = Depends(boundary_options)):
+    return await ImageController.get_annotations(image_id, options)
+
+@router.get("/{image_id}/annotations/visible", response_model=List[AnnotationOut], summary="获取视野内的标注")
+async def get_visible_annotations(
+    image_id: int,
+    theta: float = Query(0.0, description="视角中心经度 (弧度)"),
+    phi: float = Query(0.0, ge=-1.5708, le=1.5708, description="视角中心纬度 (弧度)"),
+    fov: float = Query(90.0, gt=0, lt=180, description="水平视场角 (角度)"),
+    w: int = Query(512, ge=16, le=4096, description="切片宽度"),
+    h: int = Query(512, ge=16, le=4096, description="切片高度"),
+    options: BoundaryOptions = Depends(boundary_options),
+):
+    view = ViewSpec(theta=theta, phi=phi, fov=fov, w=w, h=h)
+    return await ImageController.get_visible_annotations(image_id, view, options)
+
+@router.get("/{image_id}/annotations/projected", response_model=List[AnnotationProjected],
+            summary="获取视野内标注在透视切片中的像素多边形")
+async def get_projected_annotations(
+    image_id: int,
+    theta: float = Query(0.0, description="视角中心经度 (弧度)"),
+    phi: float = Query(0.0, ge=-1.5708, le=1.5708, description="视角中心纬度 (弧度)"),
+    fov: float = Query(90.0, gt=0, lt=180, description="水平视场角 (角度)"),
+    w: int = Query(512, ge=16, le=4096, description="切片宽度"),
+    h: int = Query(512, ge=16, le=4096, description="切片高度"),
+):
+    view = ViewSpec(theta=theta, phi=phi, fov=fov, w=w, h=h)
+    return await ImageController.get_projected_annotations(image_id, view)
+
+@router.get("/{image_id}/annotations/preview", summary="获取叠加标注的全景缩略图 (标注变化前走缓存)")
+async def get_annotation_preview(
+    image_id: int,
+    width: int = Query(settings.ANNOTATION_PREVIEW_WIDTH, ge=64, le=8192, description="输出宽度"),
+    fmt: str = Query("jpg", pattern="^(jpg|webp)$", description="输出格式"),
+    quality: int = Query(85, ge=1, le=100, description="编码质量"),
+    if_none_match: Optional[str] = Header(None),
+):
+    return await ImageController.get_annotation_preview(image_id, width, fmt, quality, if_none_match)
+
+@router.get("/{image_id}/annotations/region", response_model=List[AnnotationOut], summary="获取 ERP 像素区域内的标注")
+async def get_region_annotations(
+    image_id: int,
+    x0: float = Query(..., ge=0, description="区域左边界 (ERP 像素，大于 x1 时表示跨越经度接缝)"),
+    y0: float = Query(..., ge=0, description="区域上边界 (ERP 像素)"),
+    x1: float = Query(..., ge=0, description="区域右边界 (ERP 像素)"),
+    y1: float = Query(..., ge=0, description="区域下边界 (ERP 像素)"),
+    options: BoundaryOptions = Depends(boundary_options),
+):
+    return await ImageController.get_region_annotations(image_id, x0, y0, x1, y1, options)
+
+@router.get("/{image_id}/annotations/nearest", response_model=List[AnnotationOut], summary="获取距某点最近的标注")
+async def get_nearest_annotations(
+    image_id: int,
+    theta: float = Query(..., description="球面点经度 (弧度，与标注 center_theta 同一约定)"),
+    phi: float = Query(..., ge=-1.5708, le=1.5708, description="球面点纬度 (弧度)"),
+    n: int = Query(10, ge=1, le=1000, description="返回数量"),
+    options: BoundaryOptions = Depends(boundary_options),
+):
+    return await ImageController.get_nearest_annotations(image_id, theta, phi, n, options)
+
+@router.get("/{image_id}/annotations/overlaps", response_model=AnnotationOverlapsOut, summary="检测重叠 / 重复标注")
+async def get_annotation_overlaps(
+    image_id: int,
+    threshold: float = Query(0.5, gt=0, le=1, description="球面交并比阈值"),
+):
+    return await ImageController.get_annotation_overlaps(image_id, threshold)
+
+@router.post("/{image_id}/annotate/batch", response_model=AnnotationBatchOut, summary="批量保存标注结果")
+async def save_annotations(image_id: int, obj_in: AnnotationBatchCreate,
+                           options: BoundaryOptions = Depends(boundary_options)):
+    return await ImageController.create_annotations(image_id, obj_in, options=options)
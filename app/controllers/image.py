@@ -1,40 +1,120 @@
 # app/controllers/image.py
+import asyncio
 import os
+import time
 import uuid
-import cv2
 import numpy as np
 import base64
-import shutil
-import math
-from fastapi import UploadFile, HTTPException
-from app.models.image import Image360, Annotation
-from app.schemas.image import AnnotationCreate
+import hashlib
+import io
+import json
+import zipfile
+from fastapi import UploadFile, HTTPException, Response
+from fastapi.responses import StreamingResponse
+from app.log import logger
+from tortoise.expressions import Q
+from tortoise.transactions import in_transaction
+from app.models.image import Image360, Annotation, AnnotationCell
+from app.models.project import Label
+from app.settings import settings
+from app.schemas.image import (AnnotationBatchCreate, AnnotationCreate, BatchViewRequest, BoundaryOptions,
+                               PerspectiveView, ViewSpec)
 
-from app.utils.ImageRecorder import ImageRecorder
+from app.controllers.viewer import viewer_stats
+from app.core import render_service
+from app.core.executor import imaging_executor
+from app.core.metrics import crop_latency
+from app.geometry import (angles_to_rays, angular_distance, cap_cells, cap_radius, cell_ranges, erp_to_angles,
+                          focal_length, perspective_to_sphere, project_boxes)
+from app.utils import imaging
+from app.utils.imaging import VIEW_FORMATS
+from app.utils.boundary import (annotation_key, boundary_key, boundary_points, encode_polygons, negotiate,
+                                pack_boundary, simplify_boundary, unpack_boundary)
+from app.utils.crop_cache import crop_cache
+from app.utils.image_cache import pano_cache
+from app.utils.prefetch import prefetcher
+from app.utils.projection import projector, quantize_view
+from app.utils.tiles import tile_store
+from app.utils.ImageRecorder import erp_bboxes, geometry_cache
 
 UPLOAD_DIR = "static/uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
+HASH_CHUNK_SIZE = 1024 * 1024
+VIEW_CACHE_CONTROL = "public, max-age=86400"
 
 
 class ImageController:
     @classmethod
     async def upload_image(cls, project_id: int, file: UploadFile):
+        fields = await cls._store_upload(file)
+        return await Image360.create(project_id=project_id, filename=file.filename, **fields)
+
+    @classmethod
+    async def replace_image(cls, image_id: int, file: UploadFile):
+        """替换全景图源文件，旧文件、衍生文件与各级缓存一并清理"""
+        img_obj = await Image360.get_or_none(id=image_id)
+        if not img_obj:
+            raise HTTPException(status_code=404, detail="图片不存在")
+        fields = await cls._store_upload(file)
+        await cls._purge_image_files(img_obj)
+        old_size = (img_obj.width, img_obj.height)
+        img_obj.update_from_dict({"filename": file.filename, **fields})
+        await img_obj.save()
+        if (img_obj.width, img_obj.height) != old_size:
+            # 尺寸变化后点阵与 ERP 外接框 (像素坐标) 全部过期，立即重算，保证按像素区域的 SQL 检索结果正确
+            await cls._refresh_stale_boundaries(img_obj)
+        return img_obj
+
+    @classmethod
+    async def delete_image(cls, image_id: int):
+        img_obj = await Image360.get_or_none(id=image_id)
+        if not img_obj:
+            raise HTTPException(status_code=404, detail="图片不存在")
+        await cls._purge_image_files(img_obj)
+        await img_obj.delete()
+        return {"msg": "删除成功"}
+
+    @staticmethod
+    async def _store_upload(file: UploadFile):
         ext = file.filename.split('.')[-1]
         new_name = f"{uuid.uuid4().hex}.{ext}"
         file_path = os.path.join(UPLOAD_DIR, new_name)
+        sha = hashlib.sha256()
         with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        img = cv2.imread(file_path)
-        h, w = img.shape[:2] if img is not None else (None, None)
-        return await Image360.create(project_id=project_id, filename=file.filename, file_path=file_path,
-                                     url=f"/static/uploads/{new_name}", width=w, height=h)
+            while chunk := await file.read(HASH_CHUNK_SIZE):
+                sha.update(chunk)
+                buffer.write(chunk)
+        derived = await imaging_executor.run(imaging.prepare_upload, file_path)
+        return {"file_path": file_path, "url": f"/static/uploads/{new_name}", "content_hash": sha.hexdigest(),
+                **derived}
+
+    @staticmethod
+    async def _purge_image_files(img_obj: Image360):
+        prefetcher.cancel_image(img_obj.id)
+        await imaging_executor.run(imaging.remove_derivatives, imaging.panorama_source(img_obj))
+        pano_cache.invalidate(img_obj.id)
+        await render_service.render_client.invalidate(img_obj.id)
+        await crop_cache.invalidate(img_obj.id)
+
+    @classmethod
+    async def generate_cubemap(cls, image_id: int):
+        img_obj = await Image360.get_or_none(id=image_id)
+        if not img_obj or not os.path.exists(img_obj.file_path):
+            raise HTTPException(status_code=404, detail="图片不存在")
+        cubemap = await imaging_executor.run(imaging.generate_cubemap, img_obj.file_path)
+        if cubemap is None:
+            raise HTTPException(status_code=500, detail="图片解码失败")
+        img_obj.cubemap = cubemap
+        await img_obj.save(update_fields=["cubemap"])
+        return {"id": img_obj.id, "cubemap": cubemap}
 
     @classmethod
     async def get_images_by_project(cls, project_id: int):
         return await Image360.filter(project_id=project_id).order_by("-created_at")
 
     @classmethod
-    async def create_annotation(cls, image_id: int, obj_in: AnnotationCreate, annotator_id: int = 1):
+    async def create_annotation(cls, image_id: int, obj_in: AnnotationCreate, annotator_id: int = 1,
+                                options: BoundaryOptions = None):
         img_obj = await Image360.get(id=image_id)
         if not img_obj or not img_obj.width or not img_obj.height:
             raise HTTPException(status_code=400, detail="图片不存在或尺寸丢失")
@@ -55,25 +135,14 @@ class ImageController:
             out_h=512  # 你的前端画布高度
         )
 
-        recorder = ImageRecorder(W, H, view_angle_w=spherical_data["fov_w"], view_angle_h=spherical_data["fov_h"],
-                                 long_side=max(W, H))
-
-        # 将球面中心坐标传入，并开启 border_only 模式，只拿边缘点阵
-        Px, Py = recorder._sample_points(
-            x=spherical_data["center_theta"],
-            y=spherical_data["center_phi"],
-            border_only=True
+        # 2. 生成球面框 (含 gamma) 在 ERP 上的边缘点阵 (CPU 密集，放到图像执行器中)
+        points = await imaging_executor.run(
+            imaging.annotation_boundary, W, H, spherical_data["center_theta"], spherical_data["center_phi"],
+            spherical_data["fov_w"], spherical_data["fov_h"], spherical_data["gamma"]
         )
 
-        # 组装给前端 SVG <polygon> 画图的点集
-        boundary_points = []
-        for i in range(len(Px)):
-            # 过滤掉无穷大或非法的点
-            if not np.isnan(Px[i]) and not np.isnan(Py[i]):
-                boundary_points.append({"x": float(Px[i]), "y": float(Py[i])})
-
-        # 3. 存入数据库
-        anno = await Annotation.create(
+        # 3. 存入数据库，点阵以紧凑 float32 格式、球面索引字段与覆盖的格子一并保存
+        anno = Annotation(
             image_id=image_id,
             annotator_id=annotator_id,
             label_id=obj_in.label_id,
@@ -90,112 +159,692 @@ class ImageController:
             box_y=obj_in.box_y,
             box_w=obj_in.box_w,
             box_h=obj_in.box_h,
-            box_angle=obj_in.box_angle
+            box_angle=obj_in.box_angle,
+
+            boundary=pack_boundary(points),
+            boundary_key=boundary_key(W, H, **spherical_data),
         )
+        cls._set_erp_bboxes([anno], [points], W, H)
+        cls._index_annotations([anno])
+        async with in_transaction() as conn:
+            await anno.save(using_db=conn)
+            await AnnotationCell.bulk_create(cls._annotation_cells([anno]), using_db=conn)
 
+        media, points = cls._boundary_format([points], options)
+        if media:
+            return Response(content=encode_polygons({"items": [cls._annotation_meta(anno)]}, points, media),
+                            media_type=media)
+        return cls._annotation_out(anno, points[0])
+
+    @staticmethod
+    def _annotation_meta(anno: Annotation):
         return {
             "id": anno.id,
-            "image_id": anno.image_id_id,  # tortoise-orm 外键特殊后缀
-            "label_id": anno.label_id_id,
+            "image_id": anno.image_id,
+            "label_id": anno.label_id,
             "annotator_id": anno.annotator_id,
             "center_theta": anno.center_theta,
             "center_phi": anno.center_phi,
             "fov_w": anno.fov_w,
             "fov_h": anno.fov_h,
             "gamma": anno.gamma,
-            "boundary_points": boundary_points,  # 🌟 灵魂数据：像素点集
+            "erp_bbox": None if anno.erp_x0 is None else [anno.erp_x0, anno.erp_y0, anno.erp_x1, anno.erp_y1],
+            "erp_seam": anno.erp_seam,
             "created_at": anno.created_at
         }
 
-    # 从 2D 切图参数 -> 球面 RBFoV 参数
+    @classmethod
+    def _annotation_out(cls, anno: Annotation, points):
+        # 🌟 灵魂数据：像素点集
+        return {**cls._annotation_meta(anno), "boundary_points": boundary_points(points)}
+
     @staticmethod
-    def _calculate_spherical_rbfov(crop_theta, crop_phi, crop_fov, box_x, box_y, box_w, box_h, box_angle, out_w, out_h):
-        # 1. 焦距 f
-        f = 0.5 * out_w / np.tan(0.5 * np.radians(crop_fov))
-        cx = box_x + box_w / 2.0
-        cy = box_y + box_h / 2.0
+    def _boundary_format(polygons, options: BoundaryOptions = None):
+        """
+        按请求选项简化点阵并协商传输格式，返回 (二进制媒体类型或 None, 点阵列表)
+        """
+        if options is None:
+            return None, polygons
+        if options.tolerance > 0 or options.max_points > 0:
+            polygons = [simplify_boundary(p, options.tolerance, options.max_points) for p in polygons]
+        return negotiate(options.accept), polygons
+
+    @classmethod
+    async def get_annotations(cls, image_id: int, options: BoundaryOptions = None):
+        """
+        图片的全部标注 (一次查询)，边缘点阵直接读取已保存的紧凑格式；
+        只有几何参数 (或图片尺寸) 变化过的旧记录才会批量重新计算并回写
+        """
+        img_obj = await Image360.get_or_none(id=image_id)
+        if not img_obj:
+            raise HTTPException(status_code=404, detail="图片不存在")
+        annos = await Annotation.filter(image_id=image_id).order_by("id")
+        return await cls._annotations_out(img_obj, annos, options)
+
+    @classmethod
+    async def _annotations_out(cls, img_obj: Image360, annos, options: BoundaryOptions = None):
+        points = await cls._ensure_boundaries(img_obj, annos)
+        media, points = cls._boundary_format(points, options)
+        if media:
+            meta = {"items": [cls._annotation_meta(anno) for anno in annos]}
+            return Response(content=encode_polygons(meta, points, media), media_type=media)
+        return [cls._annotation_out(anno, p) for anno, p in zip(annos, points)]
+
+    @classmethod
+    async def get_visible_annotations(cls, image_id: int, view: ViewSpec, options: BoundaryOptions = None):
+        """
+        与视锥相交的标注: 先按视锥外接球冠覆盖的格子在索引表中检索候选，再用中心向量与角半径精确判断，
+        查询量只与视野附近的标注数有关
+        """
+        img_obj = await cls._get_indexed_image(image_id)
+        annos = await cls._view_annotations(image_id, view)
+        return await cls._annotations_out(img_obj, annos, options)
+
+    @classmethod
+    async def get_projected_annotations(cls, image_id: int, view: ViewSpec):
+        """
+        视野内的标注重投影到切片像素坐标: 与 get_visible_annotations 相同的候选检索，
+        再对全部候选一次性投影角点并按视锥裁剪，前端直接绘制多边形即可
+        """
+        await cls._get_indexed_image(image_id)
+        annos = await cls._view_annotations(image_id, view)
+        return cls._project_annotations(annos, view)
+
+    @classmethod
+    async def _view_annotations(cls, image_id: int, view: ViewSpec):
+        """外接球冠与视锥外接球冠相交的标注 (索引检索 + 中心向量精确判断)"""
+        # 视角 (theta, phi) 下切片中心实际朝向的球面方向，与标注坐标同一约定
+        center_theta, center_phi = perspective_to_sphere(view.w / 2, view.h / 2, view.theta, view.phi, view.fov,
+                                                         view.w, view.h)
+        fov_h = np.degrees(2 * np.arctan(np.tan(np.radians(view.fov) / 2) * view.h / view.w))
+        cone = float(cap_radius(view.fov, fov_h))
+        annos = await cls._cap_candidates(image_id, float(center_theta), float(center_phi), cone)
+        if annos:
+            dist = angular_distance(cls._center_vectors(annos), center_theta, center_phi)
+            radius = np.array([anno.angular_radius for anno in annos])
+            annos = [anno for anno, hit in zip(annos, dist <= cone + radius) if hit]
+        return annos
+
+    @staticmethod
+    def _project_annotations(annos, view: ViewSpec):
+        """标注 -> 切片像素多边形，与画面无交集的标注 (外接球冠相交但框本身在画面外) 不返回"""
+        if not annos:
+            return []
+        boxes = np.array([[a.center_theta, a.center_phi, a.fov_w, a.fov_h, a.gamma] for a in annos])
+        polygons = project_boxes(boxes, view.theta, view.phi, view.fov, view.w, view.h)
+        return [
+            {"id": anno.id, "label_id": anno.label_id, "points": boundary_points(poly)}
+            for anno, poly in zip(annos, polygons) if len(poly)
+        ]
+
+    @classmethod
+    async def get_annotation_preview(cls, image_id: int, width: int, fmt: str = "jpg", quality: int = 85,
+                                     if_none_match: str = None):
+        """
+        缩小的整幅全景图叠加全部标注 (按标签颜色)，用于列表 / 审核页缩略图
+        结果按 (图片内容哈希, 标注与标签颜色摘要, 尺寸, 格式) 缓存，标注增删改或标签改色后摘要变化，自动重新渲染
+        """
+        img_obj = await Image360.get_or_none(id=image_id)
+        if not img_obj or not os.path.exists(img_obj.file_path):
+            raise HTTPException(status_code=404, detail="图片不存在")
+        if fmt not in VIEW_FORMATS:
+            raise HTTPException(status_code=400, detail=f"不支持的输出格式: {fmt}")
+        content_hash = await cls._ensure_content_hash(img_obj)
+        rows = await Annotation.filter(image_id=image_id).order_by("id").values_list(
+            "id", "label_id", "center_theta", "center_phi", "fov_w", "fov_h", "gamma", "label__color")
+        digest = hashlib.sha1(json.dumps(rows, separators=(",", ":")).encode()).hexdigest()
+        key = crop_cache.make_preview_key(img_obj.id, content_hash, digest, width, fmt, quality)
+        etag = f'"{hashlib.sha256(key.encode()).hexdigest()[:32]}"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if if_none_match and cls._etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+
+        content = await crop_cache.get(key)
+        if content is None:
+            W, _ = await cls._panorama_size(img_obj)
+            annos = await Annotation.filter(image_id=image_id).order_by("id")
+            polygons = await cls._ensure_boundaries(img_obj, annos)
+            colors = [imaging.hex_to_bgr(row[-1]) for row in rows]
+            ext, _, quality_flag = VIEW_FORMATS[fmt]
+            content = await imaging_executor.run(
+                imaging.render_annotation_preview, imaging.panorama_source(img_obj), width, W,
+                [np.asarray(p) for p in polygons], colors, ext, [int(quality_flag), quality]
+            )
+            if content is None:
+                raise HTTPException(status_code=500, detail="图片解码失败")
+            await crop_cache.set(key, content)
+        return Response(content=content, media_type=VIEW_FORMATS[fmt][1], headers=headers)
+
+    @classmethod
+    async def get_region_annotations(cls, image_id: int, x0: float, y0: float, x1: float, y1: float,
+                                     options: BoundaryOptions = None):
+        """
+        ERP 外接框与像素区域 [x0, x1] x [y0, y1] 相交的标注，完全在 SQL 中用外接框字段判断；
+        x0 > x1 表示区域本身跨越经度接缝，即 [x0, W) 与 [0, x1]
+        """
+        img_obj = await Image360.get_or_none(id=image_id)
+        if not img_obj:
+            raise HTTPException(status_code=404, detail="图片不存在")
+        # 先补算缺失或过期 (图片尺寸 / 点阵参数变化) 的外接框，SQL 过滤才能基于当前尺寸
+        await cls._refresh_stale_boundaries(img_obj)
+        if x0 <= x1:
+            cond = (Q(erp_seam=False, erp_x0__lte=x1, erp_x1__gte=x0)
+                    | (Q(erp_seam=True) & (Q(erp_x0__lte=x1) | Q(erp_x1__gte=x0))))
+        else:
+            # 两者都跨越接缝时必然相交
+            cond = Q(erp_seam=True) | Q(erp_x1__gte=x0) | Q(erp_x0__lte=x1)
+        annos = await Annotation.filter(cond, image_id=image_id, erp_y0__lte=y1, erp_y1__gte=y0).order_by("id")
+        return await cls._annotations_out(img_obj, annos, options)
+
+    @classmethod
+    async def get_nearest_annotations(cls, image_id: int, theta: float, phi: float, n: int,
+                                      options: BoundaryOptions = None):
+        """
+        中心距球面点 (theta, phi) 最近的 n 个标注，按距离升序
+        检索半径从一个格子大小开始倍增，半径内的候选已够 n 个即可确定结果
+        """
+        img_obj = await cls._get_indexed_image(image_id)
+        radius = np.sqrt(4 * np.pi / (settings.ANNOTATION_INDEX_BANDS * settings.ANNOTATION_INDEX_LONS))
+        while True:
+            annos = await cls._cap_candidates(image_id, theta, phi, radius)
+            dist = angular_distance(cls._center_vectors(annos), theta, phi) if annos else np.empty(0)
+            if radius >= np.pi or np.count_nonzero(dist <= radius) >= n:
+                break
+            radius = min(np.pi, radius * 2)
+        order = np.argsort(dist, kind="stable")[:n]
+        return await cls._annotations_out(img_obj, [annos[k] for k in order], options)
+
+    @classmethod
+    async def get_annotation_overlaps(cls, image_id: int, threshold: float = 0.5):
+        """
+        多人标注同一全景图时的重复检测: 球面交并比 >= threshold 的标注对，
+        以及球面 NMS (先保存的标注优先保留) 建议删除的标注
+        """
+        img_obj = await Image360.get_or_none(id=image_id)
+        if not img_obj:
+            raise HTTPException(status_code=404, detail="图片不存在")
+        rows = await Annotation.filter(image_id=image_id).order_by("id").values_list(
+            "id", "center_theta", "center_phi", "fov_w", "fov_h", "gamma")
+        if not rows:
+            return {"threshold": threshold, "pairs": [], "suppressed": []}
+        ids = [row[0] for row in rows]
+        boxes = np.array([row[1:] for row in rows], dtype=np.float64)
+        pairs, suppressed = await imaging_executor.run(imaging.annotation_overlaps, boxes, threshold)
+        return {
+            "threshold": threshold,
+            "pairs": [{"a": ids[i], "b": ids[j], "iou": iou} for i, j, iou in pairs],
+            "suppressed": [ids[k] for k in suppressed],
+        }
+
+    @classmethod
+    async def _get_indexed_image(cls, image_id: int):
+        img_obj = await Image360.get_or_none(id=image_id)
+        if not img_obj:
+            raise HTTPException(status_code=404, detail="图片不存在")
+        # 索引字段上线前保存的标注，首次检索时批量补建
+        missing = await Annotation.filter(image_id=image_id, angular_radius=None)
+        if missing:
+            cls._index_annotations(missing)
+            async with in_transaction() as conn:
+                await Annotation.bulk_update(missing, fields=["center_x", "center_y", "center_z", "angular_radius"],
+                                             using_db=conn)
+                await AnnotationCell.bulk_create(cls._annotation_cells(missing), using_db=conn)
+        return img_obj
+
+    @staticmethod
+    async def _cap_candidates(image_id: int, theta: float, phi: float, radius: float):
+        """覆盖格子与球冠相交的标注 (候选，未做精确判断)"""
+        bands, lons = settings.ANNOTATION_INDEX_BANDS, settings.ANNOTATION_INDEX_LONS
+        query = Annotation.filter(image_id=image_id)
+        ranges = cell_ranges(cap_cells(theta, phi, radius, bands, lons))
+        if ranges != [(0, bands * lons - 1)]:
+            cond = Q()
+            for lo, hi in ranges:
+                cond |= Q(cells__cell__gte=lo, cells__cell__lte=hi)
+            query = query.filter(Q(cells__image_id=image_id), cond)
+        return await query.distinct().order_by("id")
 
-        # 3. 转换为相机 3D 射线
-        x_c = cx - out_w / 2.0
-        y_c = -(cy - out_h / 2.0)
-        z_c = f
-        v_cam = np.array([x_c, y_c, z_c])
+    @staticmethod
+    def _center_vectors(annos):
+        return np.array([[anno.center_x, anno.center_y, anno.center_z] for anno in annos])
+
+    @staticmethod
+    def _index_annotations(annos):
+        """批量计算球面索引字段: 中心单位向量与外接球冠角半径"""
+        theta = np.array([anno.center_theta for anno in annos])
+        phi = np.array([anno.center_phi for anno in annos])
+        xyz = angles_to_rays(theta, phi)
+        radius = cap_radius(np.array([anno.fov_w for anno in annos]), np.array([anno.fov_h for anno in annos]))
+        for anno, (x, y, z), r in zip(annos, xyz.tolist(), radius.tolist()):
+            anno.center_x, anno.center_y, anno.center_z, anno.angular_radius = x, y, z, r
+
+    @staticmethod
+    def _annotation_cells(annos):
+        """已有主键的标注 -> 其外接球冠覆盖的 AnnotationCell 记录"""
+        bands, lons = settings.ANNOTATION_INDEX_BANDS, settings.ANNOTATION_INDEX_LONS
+        return [
+            AnnotationCell(annotation_id=anno.id, image_id=anno.image_id, cell=int(cell))
+            for anno in annos
+            for cell in cap_cells(anno.center_theta, anno.center_phi, anno.angular_radius, bands, lons)
+        ]
+
+    @classmethod
+    async def _refresh_stale_boundaries(cls, img_obj: Image360):
+        """
+        图片下点阵摘要与当前尺寸 / 参数不一致的标注，批量重算点阵与外接框
+        先只读取几何字段判断 (不加载点阵)，只有过期的记录才整行读取
+        外接框与点阵同时写入，摘要一致即外接框也是最新的；点阵为空的标注外接框保持为空，不会在每次查询时重算
+        """
+        W, H = img_obj.width, img_obj.height
+        if not W or not H:
+            return
+        rows = await Annotation.filter(image_id=img_obj.id).values_list(
+            "id", "center_theta", "center_phi", "fov_w", "fov_h", "gamma", "boundary_key")
+        stale = [row[0] for row in rows if row[6] != boundary_key(W, H, *row[1:6])]
+        if stale:
+            await cls._ensure_boundaries(img_obj, await Annotation.filter(id__in=stale))
+
+    @staticmethod
+    def _set_erp_bboxes(annos, polygons, W, H):
+        """由边缘点阵批量计算 ERP 外接框与跨接缝标记"""
+        boxes, seam = erp_bboxes(polygons, W, H)
+        for anno, box, crossing in zip(annos, boxes.tolist(), seam.tolist()):
+            anno.erp_x0, anno.erp_y0, anno.erp_x1, anno.erp_y1 = box if not np.isnan(box[0]) else (None,) * 4
+            anno.erp_seam = crossing
+
+    @classmethod
+    async def _ensure_boundaries(cls, img_obj: Image360, annos):
+        """
+        返回各标注的 (n, 2) 点阵，缺失或过期的在一个图像执行器任务中批量补算；
+        外接框随点阵一起更新，外接框字段上线前保存的标注也在此补算
+        """
+        W, H = img_obj.width, img_obj.height
+        stale = [anno for anno in annos if anno.boundary is None or anno.boundary_key != annotation_key(anno, W, H)]
+        if stale and W and H:
+            fresh = await imaging_executor.run(
+                imaging.annotation_boundaries, W, H, [a.center_theta for a in stale], [a.center_phi for a in stale],
+                [a.fov_w for a in stale], [a.fov_h for a in stale], [a.gamma for a in stale]
+            )
+            for anno, p in zip(stale, fresh):
+                anno.boundary = pack_boundary(p)
+                anno.boundary_key = annotation_key(anno, W, H)
+        stale_ids = {id(anno) for anno in stale}
+        unboxed = [anno for anno in annos if anno.erp_x0 is None and anno.boundary and id(anno) not in stale_ids]
+        changed = [anno for anno in stale if anno.boundary is not None] + unboxed
+        if changed and W and H:
+            cls._set_erp_bboxes(changed, [unpack_boundary(anno.boundary) for anno in changed], W, H)
+            await Annotation.bulk_update(changed, fields=["boundary", "boundary_key", "erp_x0", "erp_y0", "erp_x1",
+                                                          "erp_y1", "erp_seam"])
+        return [unpack_boundary(anno.boundary) for anno in annos]
+
+    @classmethod
+    async def create_annotations(cls, image_id: int, obj_in: AnnotationBatchCreate, annotator_id: int = 1,
+                                 options: BoundaryOptions = None):
+        """
+        批量保存标注: 2D -> 球面换算与边缘点阵对全部框一次性完成，合法的框在同一事务中 bulk_create，
+        逐项返回结果 (不合法的框只影响自身)
+        """
+        img_obj = await Image360.get_or_none(id=image_id)
+        if not img_obj or not img_obj.width or not img_obj.height:
+            raise HTTPException(status_code=400, detail="图片不存在或尺寸丢失")
+        W, H = img_obj.width, img_obj.height
+
+        # 标签必须属于图片所在项目，一次查询校验全部 label_id
+        label_ids = {item.label_id for item in obj_in.items}
+        valid_labels = set(await Label.filter(id__in=label_ids, project_id=img_obj.project_id).values_list("id", flat=True))
+        results = [{"index": i, "ok": True, "error": None, "annotation": None} for i in range(len(obj_in.items))]
+        accepted = []
+        for i, item in enumerate(obj_in.items):
+            if item.label_id not in valid_labels:
+                results[i].update(ok=False, error=f"标签不存在: {item.label_id}")
+            elif item.box_w <= 0 or item.box_h <= 0:
+                results[i].update(ok=False, error="框的宽高必须大于 0")
+            elif not 0 < item.crop_fov < 180:
+                results[i].update(ok=False, error="切图视场角必须在 (0, 180) 之间")
+            else:
+                accepted.append(i)
+        if not accepted:
+            return cls._batch_out(results, [], [], options)
 
-        # 4. 根据切图视角，构建旋转矩阵，投射回绝对球面
-        rx = np.array([[1, 0, 0], [0, np.cos(crop_phi), -np.sin(crop_phi)], [0, np.sin(crop_phi), np.cos(crop_phi)]])
-        ry = np.array(
-            [[np.cos(-crop_theta), 0, np.sin(-crop_theta)], [0, 1, 0], [-np.sin(-crop_theta), 0, np.cos(-crop_theta)]])
-        R = np.dot(ry, rx)
-        v_world = np.dot(R, v_cam)
+        items = [obj_in.items[i] for i in accepted]
+        fields = ("crop_theta", "crop_phi", "crop_fov", "box_x", "box_y", "box_w", "box_h", "box_angle")
+        columns = {name: np.array([getattr(item, name) for item in items], dtype=np.float64) for name in fields}
+        # 1. 2D 旋转框 -> RBFoV，N 个框一次性换算
+        spherical = cls._calculate_spherical_rbfov_batch(**columns, out_w=512, out_h=512)
+
+        # 2. N 个框的边缘点阵在一个图像执行器任务中批量生成
+        boundaries = await imaging_executor.run(
+            imaging.annotation_boundaries, W, H, spherical["center_theta"], spherical["center_phi"],
+            spherical["fov_w"], spherical["fov_h"], spherical["gamma"]
+        )
 
-        x_r, y_r, z_r = v_world[0], v_world[1], v_world[2]
+        # 3. 单事务批量写入
+        annos = [
+            Annotation(
+                image_id=image_id,
+                annotator_id=annotator_id,
+                label_id=item.label_id,
+                center_theta=float(spherical["center_theta"][k]),
+                center_phi=float(spherical["center_phi"][k]),
+                fov_w=float(spherical["fov_w"][k]),
+                fov_h=float(spherical["fov_h"][k]),
+                gamma=float(spherical["gamma"][k]),
+                box_x=item.box_x,
+                box_y=item.box_y,
+                box_w=item.box_w,
+                box_h=item.box_h,
+                box_angle=item.box_angle,
+                boundary=pack_boundary(boundaries[k]),
+            )
+            for k, item in enumerate(items)
+        ]
+        batch_token = uuid.uuid4().hex
+        for anno in annos:
+            anno.boundary_key = annotation_key(anno, W, H)
+            anno.batch_token = batch_token
+        cls._set_erp_bboxes(annos, boundaries, W, H)
+        cls._index_annotations(annos)
+        async with in_transaction() as conn:
+            await Annotation.bulk_create(annos, using_db=conn)
+            if any(anno.id is None for anno in annos):
+                # bulk_create 在 SQLite 等后端不回填主键: 按本次请求的批量标记回读，插入顺序即 id 顺序，
+                # 不受其他请求并发写入同一图片的影响
+                ids = await Annotation.filter(batch_token=batch_token).using_db(conn).order_by("id").values_list(
+                    "id", flat=True)
+                for anno, anno_id in zip(annos, ids):
+                    anno.id = anno_id
+            await AnnotationCell.bulk_create(cls._annotation_cells(annos), using_db=conn)
 
-        # 5. 获得真实的绝对中心 Theta 和 Phi (弧度)
-        norm_r = np.sqrt(x_r ** 2 + y_r ** 2 + z_r ** 2)
-        final_phi = np.arcsin(np.clip(y_r / norm_r, -1.0, 1.0))
-        final_theta = np.arctan2(x_r, z_r)
+        return cls._batch_out(results, annos, boundaries, options, accepted)
 
-        # 6. 计算真实水平/垂直 FOV 宽度 (张角)
+    @classmethod
+    def _batch_out(cls, results, annos, boundaries, options, accepted=()):
+        media, boundaries = cls._boundary_format(boundaries, options)
+        for k, (i, anno) in enumerate(zip(accepted, annos)):
+            # 二进制格式时点阵按成功项的顺序放在容器中，meta 里只有标注字段
+            results[i]["annotation"] = cls._annotation_meta(anno) if media else cls._annotation_out(anno, boundaries[k])
+        if media:
+            return Response(content=encode_polygons({"created": len(annos), "results": results}, boundaries, media),
+                            media_type=media)
+        return {"created": len(annos), "results": results}
+
+    # 从 2D 切图参数 -> 球面 RBFoV 参数
+    @classmethod
+    def _calculate_spherical_rbfov(cls, crop_theta, crop_phi, crop_fov, box_x, box_y, box_w, box_h, box_angle, out_w,
+                                   out_h):
+        batch = cls._calculate_spherical_rbfov_batch(
+            *(np.atleast_1d(np.asarray(v, dtype=np.float64))
+              for v in (crop_theta, crop_phi, crop_fov, box_x, box_y, box_w, box_h, box_angle)),
+            out_w=out_w, out_h=out_h
+        )
+        return {key: float(value[0]) for key, value in batch.items()}
+
+    @staticmethod
+    def _calculate_spherical_rbfov_batch(crop_theta, crop_phi, crop_fov, box_x, box_y, box_w, box_h, box_angle, out_w,
+                                         out_h):
+        """
+        N 个框的批量换算，参数为逐项对应的 (N,) 数组 (每个框可以来自不同的切图视角)，返回各字段的 (N,) 数组
+        """
+        # 1. 焦距 f 与框中心像素
+        f = focal_length(crop_fov, out_w)
+        cx = box_x + box_w / 2.0
+        cy = box_y + box_h / 2.0
+
+        # 2. 框中心像素 -> 相机射线 -> 按切图视角旋转回绝对球面，得到真实的中心 Theta 和 Phi (弧度)
+        #    点坐标取 (N, 1)，与 (N,) 的视角参数逐项配对
+        final_theta, final_phi = perspective_to_sphere(cx[:, None], cy[:, None], crop_theta, crop_phi, crop_fov,
+                                                       out_w, out_h)
+
+        # 3. 计算真实水平/垂直 FOV 宽度 (张角)
         fov_w_rad = 2 * np.arctan((box_w / 2.0) / f)
         fov_h_rad = 2 * np.arctan((box_h / 2.0) / f)
 
         gamma_rad = np.radians(box_angle)
 
         return {
-            "center_theta": float(final_theta),
-            "center_phi": float(final_phi),
-            "fov_w": float(np.degrees(fov_w_rad)),
-            "fov_h": float(np.degrees(fov_h_rad)),
-            "gamma": float(gamma_rad)
+            "center_theta": final_theta[:, 0],
+            "center_phi": final_phi[:, 0],
+            "fov_w": np.degrees(fov_w_rad),
+            "fov_h": np.degrees(fov_h_rad),
+            "gamma": gamma_rad
         }
 
     # 全景图局部切片算法
     @classmethod
-    async def get_perspective_crop(cls, image_id: int, u: float, v: float, fov: float = 90.0):
+    async def get_perspective_crop(cls, image_id: int, u: float, v: float, fov: float = 90.0,
+                                   annotations: bool = False):
         img_obj = await Image360.get_or_none(id=image_id)
         if not img_obj or not os.path.exists(img_obj.file_path):
             raise HTTPException(status_code=404, detail="图片不存在")
-        img = cv2.imread(img_obj.file_path)
-        if img is None:
-            raise HTTPException(status_code=500, detail="图片解码失败")
-        H, W = img.shape[:2]
-        center_theta = (u / W) * 2 * np.pi - np.pi
-        center_phi = (H / 2 - v) / (H / 2) * (np.pi / 2)
-        perspective_img = cls._equirectangular_to_perspective(img, center_theta, center_phi, fov, 512, 512)
-        encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), 90]
-        _, buffer = cv2.imencode('.jpg', perspective_img, encode_params)
+        W, H = await cls._panorama_size(img_obj)
+        # 视角量化后再渲染，保证与 GET /view 及切片结果缓存共用同一份结果
+        center_theta, center_phi, fov = quantize_view(*erp_to_angles(u, v, W, H), fov)
+        view = PerspectiveView(theta=center_theta, phi=center_phi, fov=fov)
+        buffer = await cls._render_cached(img_obj, view, settings.PANO_RENDER_MODE)
         img_str = base64.b64encode(buffer).decode('utf-8')
-        return {
+        result = {
             "image_base64": f"data:image/jpeg;base64,{img_str}",
             "center_theta": float(center_theta),
             "center_phi": float(center_phi),
             "fov": float(fov)
         }
+        if annotations:
+            # 与渲染使用同一 (量化后的) 视角，多边形与返回的切片逐像素对齐
+            spec = ViewSpec(theta=view.theta, phi=view.phi, fov=view.fov, w=view.w, h=view.h)
+            await cls._get_indexed_image(image_id)
+            result["annotations"] = cls._project_annotations(await cls._view_annotations(image_id, spec), spec)
+        return result
+
+    @classmethod
+    async def get_perspective_view(cls, image_id: int, view: PerspectiveView, if_none_match: str = None):
+        """
+        透视切片的二进制版本，直接返回 JPEG/WebP 字节
+        ETag 由图片内容哈希 + 量化后的视角参数决定，命中 If-None-Match 时返回 304 且不做任何渲染
+        """
+        img_obj = await Image360.get_or_none(id=image_id)
+        if not img_obj or not os.path.exists(img_obj.file_path):
+            raise HTTPException(status_code=404, detail="图片不存在")
+        if view.fmt not in VIEW_FORMATS:
+            raise HTTPException(status_code=400, detail=f"不支持的输出格式: {view.fmt}")
+
+        content_hash = await cls._ensure_content_hash(img_obj)
+        theta, phi, fov = quantize_view(view.theta, view.phi, view.fov)
+        mode = view.mode if view.mode == "cube" and img_obj.cubemap else "erp"
+        etag_src = f"{content_hash}:{theta}:{phi}:{fov}:{view.w}:{view.h}:{view.fmt}:{view.quality}:{mode}"
+        etag = f'"{hashlib.sha256(etag_src.encode()).hexdigest()[:32]}"'
+        headers = {"ETag": etag, "Cache-Control": VIEW_CACHE_CONTROL}
+        if if_none_match and cls._etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+
+        t0 = time.perf_counter()
+        if view.progressive:
+            key = crop_cache.make_key(img_obj.id, content_hash, theta, phi, fov, view.w, view.h, view.fmt,
+                                      view.quality, mode)
+            if await crop_cache.get(key, record=False) is None:
+                return await cls._progressive_view(img_obj, view, mode, t0)
+        content = await cls._render_cached(img_obj, view, mode)
+        elapsed = time.perf_counter() - t0
+        crop_latency.first_pixel.record(elapsed)
+        crop_latency.full_render.record(elapsed)
+        return Response(content=content, media_type=VIEW_FORMATS[view.fmt][1], headers=headers)
+
+    @classmethod
+    async def _progressive_view(cls, img_obj: Image360, view: PerspectiveView, mode: str, t0: float):
+        """
+        渐进式切片: 以 multipart/x-mixed-replace 流先推送低分辨率预览，再推送完整结果 (浏览器 <img> 会原地替换)
+        完整渲染与预览并行开始；预览完成前完整结果已就绪时直接跳过预览
+        """
+        theta, phi, fov = quantize_view(view.theta, view.phi, view.fov)
+        ext, media_type, quality_flag = VIEW_FORMATS[view.fmt]
+        full_task = asyncio.create_task(cls._render_cached(img_obj, view, mode))
+        try:
+            preview = await imaging_executor.run(
+                imaging.render_preview, imaging.panorama_source(img_obj), theta, phi, fov, view.w, view.h, ext,
+                [int(quality_flag), settings.PROGRESSIVE_PREVIEW_QUALITY]
+            )
+        except BaseException:
+            # 预览失败 (或请求被取消) 时还没有交给 stream() 接管，在这里取消完整渲染，避免任务悬空
+            full_task.cancel()
+            raise
+        boundary = uuid.uuid4().hex
+
+        def part(content: bytes, stage: str):
+            return (
+                f"--{boundary}\r\n"
+                f"Content-Type: {media_type}\r\n"
+                f"Content-Length: {len(content)}\r\n"
+                f"X-Render-Stage: {stage}\r\n\r\n"
+            ).encode() + content + b"\r\n"
+
+        async def stream():
+            try:
+                if preview is not None and not full_task.done():
+                    crop_latency.previews += 1
+                    crop_latency.first_pixel.record(time.perf_counter() - t0)
+                    yield part(preview, "preview")
+                else:
+                    await asyncio.wait([full_task])
+                    crop_latency.first_pixel.record(time.perf_counter() - t0)
+                try:
+                    content = await full_task
+                except HTTPException as e:
+                    logger.warning(f"progressive view {img_obj.id} failed: {e.detail}")
+                    return
+                crop_latency.full_render.record(time.perf_counter() - t0)
+                yield part(content, "full")
+                yield f"--{boundary}--\r\n".encode()
+            finally:
+                if not full_task.done():
+                    full_task.cancel()
+
+        # 流的内容与普通响应不同，不参与 ETag / 浏览器缓存
+        return StreamingResponse(stream(), media_type=f"multipart/x-mixed-replace; boundary={boundary}",
+                                 headers={"Cache-Control": "no-store"})
+
+    @classmethod
+    async def _render_cached(cls, img_obj: Image360, view: PerspectiveView, mode: str):
+        """
+        渲染单个视角并编码，结果按 (内容哈希, 量化视角, 尺寸, 格式) 写入切片结果缓存
+        """
+        content_hash = await cls._ensure_content_hash(img_obj)
+        theta, phi, fov = quantize_view(view.theta, view.phi, view.fov)
+        key = crop_cache.make_key(img_obj.id, content_hash, theta, phi, fov, view.w, view.h, view.fmt, view.quality,
+                                  mode)
+        source = imaging.panorama_source(img_obj)
+        content = await crop_cache.get(key)
+        hit = content is not None
+        if hit:
+            prefetcher.record_hit(key)
+        else:
+            ext, _, quality_flag = VIEW_FORMATS[view.fmt]
+            content = await render_service.render_perspective(
+                source, theta, phi, fov, view.w, view.h, ext, [int(quality_flag), view.quality], mode
+            )
+            if content is None:
+                raise HTTPException(status_code=500, detail="图片解码失败")
+            await crop_cache.set(key, content)
+        # 下一次请求大概率是小幅平移 / 缩放，空闲时预先渲染相邻视角 (命中且位姿未变时不重复调度)
+        prefetcher.schedule(source, content_hash, theta, phi, fov, view.w, view.h, view.fmt, view.quality, mode, hit)
+        return content
+
+    @classmethod
+    async def get_perspective_views(cls, image_id: int, req: BatchViewRequest):
+        """
+        同一张全景图的多视角批量切片，只解码一次，结果以 zip 或 multipart/mixed 返回
+        """
+        img_obj = await Image360.get_or_none(id=image_id)
+        if not img_obj or not os.path.exists(img_obj.file_path):
+            raise HTTPException(status_code=404, detail="图片不存在")
+        views = [(*quantize_view(v.theta, v.phi, v.fov), v.w, v.h) for v in req.views]
+        ext, media_type, quality_flag = VIEW_FORMATS[req.fmt]
+
+        # 已缓存的视角直接复用，只渲染未命中的部分
+        content_hash = await cls._ensure_content_hash(img_obj)
+        keys = [crop_cache.make_key(img_obj.id, content_hash, *view, req.fmt, req.quality) for view in views]
+        outputs = [await crop_cache.get(key) for key in keys]
+        missing = [i for i, content in enumerate(outputs) if content is None]
+        if missing:
+            rendered = await imaging_executor.run(
+                imaging.render_perspective_batch, imaging.panorama_source(img_obj), [views[i] for i in missing], ext,
+                [int(quality_flag), req.quality]
+            )
+            if rendered is None:
+                raise HTTPException(status_code=500, detail="图片解码失败")
+            for i, content in zip(missing, rendered):
+                outputs[i] = content
+                await crop_cache.set(keys[i], content)
+
+        manifest = [
+            {"index": i, "theta": theta, "phi": phi, "fov": fov, "w": w, "h": h, "name": f"view_{i:03d}{ext}"}
+            for i, (theta, phi, fov, w, h) in enumerate(views)
+        ]
+        if req.container == "zip":
+            buffer = io.BytesIO()
+            # JPEG/WebP 已经是压缩格式，zip 内不再压缩
+            with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as zf:
+                zf.writestr("views.json", json.dumps(manifest))
+                for item, content in zip(manifest, outputs):
+                    zf.writestr(item["name"], content)
+            return Response(content=buffer.getvalue(), media_type="application/zip")
+
+        boundary = uuid.uuid4().hex
+        parts = []
+        for item, content in zip(manifest, outputs):
+            headers = (
+                f"--{boundary}\r\n"
+                f"Content-Type: {media_type}\r\n"
+                f"Content-Disposition: attachment; filename=\"{item['name']}\"\r\n"
+                f"X-View: {json.dumps(item)}\r\n\r\n"
+            )
+            parts.extend([headers.encode(), content, b"\r\n"])
+        parts.append(f"--{boundary}--\r\n".encode())
+        return Response(content=b"".join(parts), media_type=f"multipart/mixed; boundary={boundary}")
+
+    @staticmethod
+    def _etag_matches(if_none_match: str, etag: str):
+        if if_none_match.strip() == "*":
+            return True
+        candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return etag in candidates
+
+    @staticmethod
+    async def _ensure_content_hash(img_obj: Image360):
+        # 历史数据没有内容哈希，首次访问时补算并回写
+        if not img_obj.content_hash:
+            # 大图的哈希耗时较长，放到图像执行器中，不阻塞事件循环
+            img_obj.content_hash = await imaging_executor.run(imaging.file_sha256, img_obj.file_path, HASH_CHUNK_SIZE)
+            await img_obj.save(update_fields=["content_hash"])
+        return img_obj.content_hash
+
+    @staticmethod
+    async def _panorama_size(img_obj: Image360):
+        # 优先使用入库时记录的尺寸，避免仅为获取宽高而解码
+        if img_obj.width and img_obj.height:
+            return img_obj.width, img_obj.height
+        size = await imaging_executor.run(imaging.panorama_size, img_obj.id, img_obj.file_path)
+        if size is None:
+            raise HTTPException(status_code=500, detail="图片解码失败")
+        return size
+
+    @staticmethod
+    async def get_metrics():
+        metrics = {
+            "pano_cache": pano_cache.stats(),
+            "projector": projector.stats(),
+            "executor": imaging_executor.stats(),
+            "render_service": render_service.render_client.stats(),
+            "crop_cache": crop_cache.stats(),
+            "tiles": tile_store.stats(),
+            # 标注几何在图像执行器中计算，使用进程池时这里只反映 web 进程内的调用
+            "recorder_geometry": geometry_cache.stats(),
+            "viewer": viewer_stats.as_dict(),
+            "prefetch": prefetcher.stats(),
+            "latency": crop_latency.as_dict(),
+        }
+        if render_service.render_client.enabled:
+            metrics["render_workers"] = await render_service.render_client.worker_stats()
+        return metrics
 
     @staticmethod
     def _equirectangular_to_perspective(img, theta_center, phi_center, fov, out_w, out_h):
-        H, W = img.shape[:2]
-        f = 0.5 * out_w / np.tan(0.5 * np.radians(fov))
-        cx, cy = out_w / 2, out_h / 2
-        x_grid, y_grid = np.meshgrid(np.arange(out_w, dtype=np.float32), np.arange(out_h, dtype=np.float32))
-        x_3d = x_grid - cx
-        y_3d = -(y_grid - cy)
-        z_3d = np.full_like(x_3d, f)
-        vectors = np.stack([x_3d, y_3d, z_3d], axis=-1).reshape(-1, 3)
-        rx = np.array(
-            [[1, 0, 0], [0, np.cos(phi_center), -np.sin(phi_center)], [0, np.sin(phi_center), np.cos(phi_center)]])
-        ry = np.array([[np.cos(-theta_center), 0, np.sin(-theta_center)], [0, 1, 0],
-                       [-np.sin(-theta_center), 0, np.cos(-theta_center)]])
-        R = np.dot(ry, rx)
-        xyz_rotated = np.dot(R, vectors.T).T
-        x_r, y_r, z_r = xyz_rotated[:, 0], xyz_rotated[:, 1], xyz_rotated[:, 2]
-        norm_r = np.sqrt(x_r ** 2 + y_r ** 2 + z_r ** 2)
-        phi_map = np.arcsin(np.clip(y_r / norm_r, -1, 1))
-        theta_map = np.arctan2(x_r, z_r)
-        u_src = (theta_map + np.pi) / (2 * np.pi) * W
-        v_src = (np.pi / 2 - phi_map) / np.pi * H
-        u_src = np.mod(u_src, W)
-        v_src = np.clip(v_src, 0, H - 1)
-        map_x = u_src.reshape(out_h, out_w).astype(np.float32)
-        map_y = v_src.reshape(out_h, out_w).astype(np.float32)
-        return cv2.remap(img, map_x, map_y, interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_WRAP)
\ No newline at end of file
+        return projector.render(img, theta_center, phi_center, fov, out_w, out_h)
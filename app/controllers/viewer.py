@@ -0,0 +1,218 @@
+# app/controllers/viewer.py
+import asyncio
+import json
+import time
+
+from fastapi import WebSocket, WebSocketDisconnect
+from pydantic import ValidationError
+
+from app.core import render_service
+from app.core.executor import imaging_executor
+from app.core.metrics import crop_latency
+from app.log import logger
+from app.models.image import Image360
+from app.schemas.image import PerspectiveView
+from app.settings import settings
+from app.utils import imaging
+from app.utils.crop_cache import crop_cache
+from app.utils.imaging import VIEW_FORMATS
+from app.utils.prefetch import prefetcher
+from app.utils.projection import quantize_view
+from app.utils.pyramid import select_level
+
+
+class ViewerStats:
+    def __init__(self):
+        self.sessions = 0
+        self.active = 0
+        self.poses = 0
+        self.frames = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def as_dict(self):
+        return {
+            "sessions": self.sessions,
+            "active": self.active,
+            "poses": self.poses,
+            "frames": self.frames,
+            "dropped": self.dropped,
+            "errors": self.errors,
+        }
+
+
+viewer_stats = ViewerStats()
+
+
+class ViewerSession:
+    """
+    绑定单张 Image360 的 WebSocket 浏览会话
+    客户端持续发送相机位姿 (JSON: theta/phi/fov/w/h/fmt/quality/mode/progressive)，服务端只渲染最新的位姿，
+    中间位姿直接丢弃；每帧先发送一条 JSON 元信息 ({"type": "frame", ...})，紧接着发送二进制图像
+    会话期间全景图 (按所需金字塔层级) 常驻内存，不受解码缓存淘汰影响
+    """
+
+    def __init__(self, websocket: WebSocket, img_obj: Image360):
+        self.websocket = websocket
+        self.img_obj = img_obj
+        self.source = imaging.panorama_source(img_obj)
+        self._pinned = {}
+        self._latest = None
+        self._seq = 0
+        self._preview_seq = None
+        self._pending = asyncio.Event()
+        self._closed = False
+
+    @classmethod
+    async def serve(cls, websocket: WebSocket, image_id: int):
+        await websocket.accept()
+        img_obj = await Image360.get_or_none(id=image_id)
+        if not img_obj:
+            await websocket.send_json({"type": "error", "msg": "图片不存在"})
+            await websocket.close(code=4404)
+            return
+        session = cls(websocket, img_obj)
+        viewer_stats.sessions += 1
+        viewer_stats.active += 1
+        try:
+            await session.run()
+        finally:
+            viewer_stats.active -= 1
+
+    async def run(self):
+        await self.websocket.send_json(
+            {"type": "ready", "image_id": self.img_obj.id, "width": self.img_obj.width, "height": self.img_obj.height}
+        )
+        render_task = asyncio.create_task(self._render_loop())
+        try:
+            await self._receive_loop()
+        finally:
+            self._closed = True
+            self._pending.set()
+            render_task.cancel()
+            try:
+                await render_task
+            except (asyncio.CancelledError, WebSocketDisconnect):
+                pass
+            prefetcher.cancel_image(self.img_obj.id)
+            self._pinned.clear()
+
+    async def _receive_loop(self):
+        while True:
+            try:
+                message = await self.websocket.receive_text()
+            except WebSocketDisconnect:
+                return
+            try:
+                pose = PerspectiveView.model_validate(json.loads(message))
+            except (ValueError, ValidationError) as e:
+                await self.websocket.send_json({"type": "error", "msg": f"非法位姿: {e}"})
+                continue
+            viewer_stats.poses += 1
+            self._seq += 1
+            if self._latest is not None:
+                # 上一个位姿尚未开始渲染就被覆盖，直接丢弃
+                viewer_stats.dropped += 1
+            self._latest = (self._seq, pose)
+            self._pending.set()
+
+    async def _render_loop(self):
+        while not self._closed:
+            await self._pending.wait()
+            self._pending.clear()
+            if self._closed or self._latest is None:
+                continue
+            seq, pose = self._latest
+            self._latest = None
+            t0 = time.perf_counter()
+            try:
+                content = await self._render(seq, pose, t0)
+                if content is None:
+                    await self.websocket.send_json({"type": "error", "seq": seq, "msg": "图片解码失败"})
+                    continue
+                await self._send_frame(seq, pose, content, t0, "full")
+                viewer_stats.frames += 1
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                # 单帧渲染失败不结束会话: 通知客户端后继续处理后续位姿，只有断开连接 / 取消才退出
+                logger.warning(f"viewer {self.img_obj.id} render seq {seq} failed: {e!r}")
+                viewer_stats.errors += 1
+                await self.websocket.send_json({"type": "error", "seq": seq, "msg": f"渲染失败: {e}"})
+
+    async def _send_frame(self, seq, pose: PerspectiveView, content: bytes, t0: float, stage: str):
+        elapsed = time.perf_counter() - t0
+        if stage == "preview":
+            crop_latency.first_pixel.record(elapsed)
+        else:
+            # 未发送预览时，完整结果就是首个可见像素
+            if not pose.progressive or seq != self._preview_seq:
+                crop_latency.first_pixel.record(elapsed)
+            crop_latency.full_render.record(elapsed)
+        theta, phi, fov = quantize_view(pose.theta, pose.phi, pose.fov)
+        await self.websocket.send_json({
+            "type": "frame", "seq": seq, "stage": stage, "theta": theta, "phi": phi, "fov": fov, "w": pose.w,
+            "h": pose.h, "fmt": pose.fmt, "render_ms": elapsed * 1000,
+        })
+        await self.websocket.send_bytes(content)
+
+    async def _render(self, seq, pose: PerspectiveView, t0: float):
+        theta, phi, fov = quantize_view(pose.theta, pose.phi, pose.fov)
+        content_hash = self.img_obj.content_hash
+        # 历史数据没有内容哈希时不走切片结果缓存，也不预取
+        key = content = None
+        hit = False
+        if content_hash:
+            key = crop_cache.make_key(self.img_obj.id, content_hash, theta, phi, fov, pose.w, pose.h, pose.fmt,
+                                      pose.quality, pose.mode)
+            content = await crop_cache.get(key)
+            hit = content is not None
+            if hit:
+                prefetcher.record_hit(key)
+        if content is None:
+            if pose.progressive:
+                await self._send_preview(seq, pose, theta, phi, fov, t0)
+            content = await self._render_frame(pose, theta, phi, fov)
+            if content is None:
+                return None
+            if key is not None:
+                await crop_cache.set(key, content)
+        if key is not None:
+            prefetcher.schedule(self.source, content_hash, theta, phi, fov, pose.w, pose.h, pose.fmt, pose.quality,
+                                pose.mode, hit)
+        return content
+
+    async def _send_preview(self, seq, pose: PerspectiveView, theta, phi, fov, t0: float):
+        # 缓存未命中时先推送低分辨率预览 (stage="preview")，完整结果随后以 stage="full" 推送
+        ext, _, quality_flag = VIEW_FORMATS[pose.fmt]
+        preview = await imaging_executor.run(
+            imaging.render_preview, self.source, theta, phi, fov, pose.w, pose.h, ext,
+            [int(quality_flag), settings.PROGRESSIVE_PREVIEW_QUALITY]
+        )
+        if preview is not None:
+            crop_latency.previews += 1
+            self._preview_seq = seq
+            await self._send_frame(seq, pose, preview, t0, "preview")
+
+    async def _render_frame(self, pose: PerspectiveView, theta, phi, fov):
+        ext, _, quality_flag = VIEW_FORMATS[pose.fmt]
+        params = [int(quality_flag), pose.quality]
+        if imaging_executor.use_process_pool or render_service.render_client.enabled or pose.mode == "cube":
+            # 进程池 / 渲染服务无法共享本进程的常驻数组，立方体贴图按面缓存，均退化为按路径渲染 (由解码缓存兜底)
+            return await render_service.render_perspective(
+                self.source, theta, phi, fov, pose.w, pose.h, ext, params, pose.mode
+            )
+        img = await self._pinned_panorama(fov, pose.w)
+        if img is None:
+            return None
+        return await imaging_executor.run(imaging.encode_view, img, theta, phi, fov, pose.w, pose.h, ext, params)
+
+    async def _pinned_panorama(self, fov, out_w):
+        level = select_level(self.source.get("pyramid"), fov, out_w)
+        key = level["file_path"] if level else self.source["file_path"]
+        if key not in self._pinned:
+            img = await imaging_executor.run(imaging.load_for_view, self.source, fov, out_w)
+            if img is None:
+                return None
+            self._pinned[key] = img
+        return self._pinned[key]
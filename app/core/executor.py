@@ -0,0 +1,111 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+import cv2
+
+from app.settings import settings
+
+
+def _init_worker(cv2_threads: int):
+    # 每个 worker 限制 OpenCV 内部线程数，避免 worker 数 x OpenCV 线程数超订 CPU
+    cv2.setNumThreads(cv2_threads)
+
+
+def _timed_call(func, args, kwargs):
+    started_at = time.time()
+    t0 = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, started_at, time.perf_counter() - t0
+
+
+class ImagingExecutor:
+    """
+    CPU 密集型图像任务 (解码 / remap / 编码 / 几何计算) 的专用执行器
+    默认线程池 (cv2 与 numpy 计算时会释放 GIL)，可通过 IMAGING_USE_PROCESS_POOL 切换为进程池；
+    进程池模式下任务函数与参数必须可 pickle，应传文件路径而非像素数组
+    """
+
+    def __init__(self, workers: int, use_process_pool: bool = False, cv2_threads: int = 1):
+        self.workers = workers
+        self.use_process_pool = use_process_pool
+        self.cv2_threads = cv2_threads
+        self._pool = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_run_time = 0.0
+        self.max_run_time = 0.0
+        self.total_wait_time = 0.0
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                pool_cls = ProcessPoolExecutor if self.use_process_pool else ThreadPoolExecutor
+                kwargs = {} if self.use_process_pool else {"thread_name_prefix": "imaging"}
+                self._pool = pool_cls(
+                    max_workers=self.workers, initializer=_init_worker, initargs=(self.cv2_threads,), **kwargs
+                )
+            return self._pool
+
+    async def run(self, func, *args, **kwargs):
+        """在图像执行器中运行同步函数，并等待其结果"""
+        loop = asyncio.get_running_loop()
+        submitted_at = time.time()
+        with self._lock:
+            self.in_flight += 1
+            self.submitted += 1
+        try:
+            result, started_at, elapsed = await loop.run_in_executor(
+                self._get_pool(), partial(_timed_call, func, args, kwargs)
+            )
+        except BaseException:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+        with self._lock:
+            self.completed += 1
+            self.total_run_time += elapsed
+            self.max_run_time = max(self.max_run_time, elapsed)
+            self.total_wait_time += max(0.0, started_at - submitted_at)
+        return result
+
+    def is_idle(self):
+        return self.in_flight < self.workers
+
+    def stats(self):
+        with self._lock:
+            done = self.completed or 1
+            return {
+                "mode": "process" if self.use_process_pool else "thread",
+                "workers": self.workers,
+                "in_flight": self.in_flight,
+                # 超出 worker 数量的在途任务即为排队中的任务
+                "queue_depth": max(0, self.in_flight - self.workers),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "avg_run_ms": self.total_run_time / done * 1000,
+                "max_run_ms": self.max_run_time * 1000,
+                "avg_wait_ms": self.total_wait_time / done * 1000,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+imaging_executor = ImagingExecutor(
+    workers=settings.IMAGING_WORKERS,
+    use_process_pool=settings.IMAGING_USE_PROCESS_POOL,
+    cv2_threads=settings.IMAGING_CV2_THREADS,
+)
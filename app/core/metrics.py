@@ -0,0 +1,49 @@
+import threading
+
+
+class LatencyStats:
+    """单项耗时统计 (次数 / 平均 / 最大 / 最近一次，毫秒)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+            self.last = seconds
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "count": self.count,
+                "avg_ms": self.total / self.count * 1000 if self.count else 0.0,
+                "max_ms": self.max * 1000,
+                "last_ms": self.last * 1000,
+            }
+
+
+class CropLatency:
+    """
+    切片请求的两段耗时: 首个像素可见 (预览或缓存命中的完整结果) 与完整质量结果就绪，均从请求到达开始计时
+    """
+
+    def __init__(self):
+        self.first_pixel = LatencyStats()
+        self.full_render = LatencyStats()
+        self.previews = 0
+
+    def as_dict(self):
+        return {
+            "time_to_first_pixel": self.first_pixel.as_dict(),
+            "full_render": self.full_render.as_dict(),
+            "previews": self.previews,
+        }
+
+
+crop_latency = CropLatency()
@@ -0,0 +1,343 @@
+"""
+切片渲染服务: 一组常驻的渲染 worker 进程，各自持有解码缓存
+按 image_id 分片，同一张全景图始终由同一个 worker 解码与缓存，热点图片在整个服务中只常驻一份，
+内存随热点图片数量增长，而不是 uvicorn worker 数 x 图片数
+请求参数 (id / 路径 / 标量) 经 unix socket 发送，渲染结果写入每个连接独享的 multiprocessing.shared_memory 缓冲区，
+像素与编码结果都不经过 pickle
+
+启动方式:
+    独立运行: python -m app.core.render_service (多个 uvicorn worker 共用)
+    随应用启动: RENDER_SERVICE_AUTOSTART=True (单 worker 部署 / 开发环境)
+"""
+import asyncio
+import multiprocessing
+import os
+import resource
+import signal
+import sys
+import threading
+import time
+from multiprocessing import resource_tracker
+from multiprocessing.connection import Client, Listener
+from multiprocessing.shared_memory import SharedMemory
+
+from starlette.concurrency import run_in_threadpool
+
+from app.core.executor import imaging_executor
+from app.log import logger
+from app.settings import settings
+from app.utils import imaging
+from app.utils.image_cache import pano_cache
+
+# 响应缓冲区按 1 MB 起步、按 2 的幂扩容，避免每个请求重新分配
+MIN_BUFFER_SIZE = 1024 * 1024
+# worker 进程内所有存活的响应缓冲区，进程被终止时统一释放
+_live_buffers = set()
+
+
+def _rss_bytes():
+    # 进程常驻内存峰值: Linux 以 KB 为单位，macOS 以字节为单位
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def socket_path(index: int, address: str = None):
+    return f"{address or settings.RENDER_SERVICE_ADDRESS}.{index}.sock"
+
+
+def _attach(name: str):
+    shm = SharedMemory(name=name)
+    # 缓冲区由 worker 创建并负责释放，客户端只是附加，不能让本进程的 resource_tracker 在退出时删除它
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+class _ResponseBuffer:
+    """worker 端: 单个连接复用的共享内存响应缓冲区"""
+
+    def __init__(self):
+        self.shm = None
+        _live_buffers.add(self)
+
+    def write(self, data: bytes):
+        size = len(data)
+        if self.shm is None or self.shm.size < size:
+            self.release()
+            capacity = MIN_BUFFER_SIZE
+            while capacity < size:
+                capacity *= 2
+            self.shm = SharedMemory(create=True, size=capacity)
+        self.shm.buf[:size] = data
+        return self.shm.name
+
+    def release(self):
+        shm, self.shm = self.shm, None
+        if shm is not None:
+            shm.close()
+            # 随应用启动时客户端与 worker 共用同一个 resource_tracker，客户端附加后的 unregister
+            # 可能已经移除了这条登记，unlink 前重新登记 (幂等) 以保证计数一致
+            resource_tracker.register(shm._name, "shared_memory")
+            shm.unlink()
+
+
+def _serve_connection(conn):
+    buffer = _ResponseBuffer()
+    try:
+        while True:
+            try:
+                request = conn.recv()
+            except (EOFError, OSError):
+                return
+            op = request.get("op")
+            try:
+                if op == "render":
+                    content = imaging.render_perspective(*request["args"])
+                    if content is None:
+                        conn.send({"ok": True, "size": -1})
+                    else:
+                        conn.send({"ok": True, "shm": buffer.write(content), "size": len(content)})
+                elif op == "invalidate":
+                    pano_cache.invalidate(request["image_id"])
+                    conn.send({"ok": True})
+                elif op == "stats":
+                    conn.send({"ok": True, "stats": {"pid": os.getpid(), "rss": _rss_bytes(),
+                                                     "pano_cache": pano_cache.stats()}})
+                else:
+                    conn.send({"ok": False, "error": f"unknown op: {op}"})
+            except Exception as e:
+                conn.send({"ok": False, "error": repr(e)})
+    finally:
+        buffer.release()
+        _live_buffers.discard(buffer)
+        conn.close()
+
+
+def _worker_main(index: int, address: str, authkey: bytes, cv2_threads: int):
+    import cv2
+
+    cv2.setNumThreads(cv2_threads)
+
+    def _on_terminate(signum, frame):
+        for buffer in list(_live_buffers):
+            buffer.release()
+        os._exit(0)
+
+    signal.signal(signal.SIGTERM, _on_terminate)
+    path = socket_path(index, address)
+    if os.path.exists(path):
+        os.remove(path)
+    listener = Listener(path, family="AF_UNIX", authkey=authkey)
+    rss = _rss_bytes()
+    if rss > settings.RENDER_SERVICE_WORKER_RSS_MB * 1024 * 1024:
+        logger.warning(f"render worker {index} started with {rss / 1024 / 1024:.0f} MB RSS "
+                       f"(> {settings.RENDER_SERVICE_WORKER_RSS_MB} MB), check what the worker imports")
+    # 每个连接一个线程，cv2 / numpy 计算时释放 GIL，同一进程内的连接共享解码缓存
+    while True:
+        try:
+            conn = listener.accept()
+        except Exception as e:
+            logger.warning(f"render worker {index} accept failed: {e}")
+            continue
+        threading.Thread(target=_serve_connection, args=(conn,), daemon=True).start()
+
+
+class RenderService:
+    """渲染 worker 进程的启动与回收"""
+
+    def __init__(self, workers: int, address: str, authkey: bytes, cv2_threads: int = 1):
+        self.workers = workers
+        self.address = address
+        self.authkey = authkey
+        self.cv2_threads = cv2_threads
+        self._processes = []
+
+    def start(self, timeout: float = 30.0):
+        os.makedirs(os.path.dirname(self.address) or ".", exist_ok=True)
+        # 清理上次异常退出残留的 socket 文件，下面以文件出现作为 worker 就绪的信号
+        for i in range(self.workers):
+            if os.path.exists(socket_path(i, self.address)):
+                os.remove(socket_path(i, self.address))
+        ctx = multiprocessing.get_context("spawn")
+        for i in range(self.workers):
+            proc = ctx.Process(
+                target=_worker_main, args=(i, self.address, self.authkey, self.cv2_threads),
+                name=f"render-worker-{i}", daemon=True,
+            )
+            proc.start()
+            self._processes.append(proc)
+        deadline = time.monotonic() + timeout
+        for i in range(self.workers):
+            while not os.path.exists(socket_path(i, self.address)):
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"render worker {i} did not start")
+                time.sleep(0.05)
+
+    def stop(self):
+        for proc in self._processes:
+            proc.terminate()
+        for i, proc in enumerate(self._processes):
+            proc.join(timeout=5)
+            path = socket_path(i, self.address)
+            if os.path.exists(path):
+                os.remove(path)
+        self._processes = []
+
+
+class RenderClient:
+    """
+    web 进程端: 按 image_id 分片把渲染请求发给对应的 worker，连接按分片池化复用
+    服务不可用时抛出异常，由 render_perspective 退回本进程的图像执行器
+    """
+
+    def __init__(self, workers: int, address: str, authkey: bytes, connections: int, enabled: bool = False):
+        self.enabled = enabled
+        self.workers = workers
+        self.address = address
+        self.authkey = authkey
+        self._idle = [[] for _ in range(workers)]
+        self._lock = threading.Lock()
+        self._limits = [threading.BoundedSemaphore(connections) for _ in range(workers)]
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.bytes_received = 0
+
+    def _acquire(self, shard: int):
+        with self._lock:
+            if self._idle[shard]:
+                return self._idle[shard].pop()
+        return {"conn": Client(socket_path(shard, self.address), family="AF_UNIX", authkey=self.authkey), "shm": None}
+
+    def _release(self, shard: int, entry, broken: bool = False):
+        if broken:
+            self._close(entry)
+            return
+        with self._lock:
+            self._idle[shard].append(entry)
+
+    @staticmethod
+    def _close(entry):
+        if entry["shm"] is not None:
+            entry["shm"].close()
+        try:
+            entry["conn"].close()
+        except OSError:
+            pass
+
+    def _call(self, shard: int, request):
+        with self._limits[shard]:
+            entry = self._acquire(shard)
+            try:
+                entry["conn"].send(request)
+                reply = entry["conn"].recv()
+                if not reply["ok"]:
+                    raise RuntimeError(reply["error"])
+                if "shm" in reply:
+                    # worker 扩容缓冲区后名字会变，重新附加
+                    if entry["shm"] is None or entry["shm"].name != reply["shm"]:
+                        if entry["shm"] is not None:
+                            entry["shm"].close()
+                        entry["shm"] = _attach(reply["shm"])
+                    reply["content"] = bytes(entry["shm"].buf[:reply["size"]])
+            except BaseException:
+                self._release(shard, entry, broken=True)
+                raise
+            self._release(shard, entry)
+            return reply
+
+    async def render(self, source, theta, phi, fov, out_w, out_h, ext, params, mode):
+        shard = source["image_id"] % self.workers
+        request = {"op": "render", "args": (source, theta, phi, fov, out_w, out_h, ext, params, mode)}
+        self.in_flight += 1
+        self.requests += 1
+        try:
+            reply = await run_in_threadpool(self._call, shard, request)
+        finally:
+            self.in_flight -= 1
+        if reply["size"] < 0:
+            return None
+        self.bytes_received += reply["size"]
+        return reply["content"]
+
+    async def invalidate(self, image_id: int):
+        if not self.enabled:
+            return
+        try:
+            await run_in_threadpool(self._call, image_id % self.workers, {"op": "invalidate", "image_id": image_id})
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"render service invalidate failed: {e}")
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "workers": self.workers,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "bytes_received": self.bytes_received,
+        }
+
+    async def worker_stats(self):
+        """各分片 worker 进程的解码缓存统计"""
+        shards = []
+        for shard in range(self.workers):
+            try:
+                reply = await run_in_threadpool(self._call, shard, {"op": "stats"})
+                shards.append(reply["stats"])
+            except Exception as e:
+                shards.append({"shard": shard, "error": repr(e)})
+        return shards
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle:
+                while idle:
+                    self._close(idle.pop())
+
+
+render_client = RenderClient(
+    workers=settings.RENDER_SERVICE_WORKERS,
+    address=settings.RENDER_SERVICE_ADDRESS,
+    authkey=settings.SECRET_KEY.encode(),
+    connections=settings.RENDER_SERVICE_CONNECTIONS,
+    enabled=settings.RENDER_SERVICE_ENABLED,
+)
+
+
+def create_service():
+    return RenderService(
+        workers=settings.RENDER_SERVICE_WORKERS,
+        address=settings.RENDER_SERVICE_ADDRESS,
+        authkey=settings.SECRET_KEY.encode(),
+        cv2_threads=settings.IMAGING_CV2_THREADS,
+    )
+
+
+async def render_perspective(source, theta, phi, fov, out_w, out_h, ext=".jpg", params=None, mode="erp"):
+    """
+    渲染并编码透视切片: 启用渲染服务时交给对应分片的 worker 进程，否则 (或服务不可用时) 在本进程的图像执行器中完成
+    """
+    if render_client.enabled:
+        try:
+            return await render_client.render(source, theta, phi, fov, out_w, out_h, ext, params, mode)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            render_client.errors += 1
+            logger.warning(f"render service unavailable, falling back to local executor: {e}")
+    return await imaging_executor.run(imaging.render_perspective, source, theta, phi, fov, out_w, out_h, ext, params,
+                                      mode)
+
+
+if __name__ == "__main__":
+    service = create_service()
+    service.start()
+    print(f"render service: {service.workers} workers at {service.address}.*.sock")
+    try:
+        for proc in service._processes:
+            proc.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
@@ -0,0 +1,65 @@
+from .cells import (
+    angular_distance,
+    cap_cells,
+    cap_radius,
+    cell_of,
+    cell_ranges,
+)
+from .iou import (
+    box_solid_angle,
+    overlapping_pairs,
+    spherical_iou,
+    spherical_nms,
+)
+from .reproject import (
+    box_corners,
+    project_boxes,
+)
+from .sphere import (
+    angles_to_erp,
+    angles_to_rays,
+    camera_rays,
+    erp_maps,
+    erp_to_angles,
+    focal_length,
+    look_at_matrices,
+    perspective_to_sphere,
+    pixels_to_rays,
+    rays_to_angles,
+    rays_to_erp,
+    roll_matrices,
+    rotate,
+    rotation_matrices,
+    rotation_matrix,
+    sphere_to_perspective,
+)
+
+__all__ = [
+    "angles_to_erp",
+    "angles_to_rays",
+    "angular_distance",
+    "box_corners",
+    "box_solid_angle",
+    "camera_rays",
+    "cap_cells",
+    "cap_radius",
+    "cell_of",
+    "cell_ranges",
+    "erp_maps",
+    "erp_to_angles",
+    "focal_length",
+    "look_at_matrices",
+    "overlapping_pairs",
+    "perspective_to_sphere",
+    "pixels_to_rays",
+    "project_boxes",
+    "rays_to_angles",
+    "rays_to_erp",
+    "roll_matrices",
+    "rotate",
+    "rotation_matrices",
+    "rotation_matrix",
+    "sphere_to_perspective",
+    "spherical_iou",
+    "spherical_nms",
+]
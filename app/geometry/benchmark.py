@@ -0,0 +1,124 @@
+"""
+app.geometry 与重构前各处投影实现的微基准
+用法: python -m app.geometry.benchmark [--repeat N]
+等价性 / 精度校验见 tests/test_geometry.py (复用本模块中的重构前参考实现)
+"""
+import argparse
+import time
+
+import numpy as np
+
+from app.geometry import erp_maps, perspective_to_sphere, project_boxes, spherical_iou, spherical_nms
+from app.utils.ImageRecorder import ImageRecorder
+
+W, H = 4096, 2048
+OUT_W, OUT_H = 512, 512
+VIEWS = [(0.0, 0.0, 90.0), (1.2, 0.3, 60.0), (-2.5, -0.4, 90.0), (0.7, 1.3, 90.0), (3.1, -1.45, 75.0), (-3.1, 0.0, 30.0)]
+
+
+def _legacy_rotation(theta, phi):
+    rx = np.array([[1, 0, 0], [0, np.cos(phi), -np.sin(phi)], [0, np.sin(phi), np.cos(phi)]])
+    ry = np.array([[np.cos(-theta), 0, np.sin(-theta)], [0, 1, 0], [-np.sin(-theta), 0, np.cos(-theta)]])
+    return np.dot(ry, rx)
+
+
+def _legacy_erp_maps(theta, phi, fov, out_w, out_h, W=W, H=H):
+    """ImageController / ToolController._equirectangular_to_perspective 重构前的 remap 表 (float64)"""
+    f = 0.5 * out_w / np.tan(0.5 * np.radians(fov))
+    x_grid, y_grid = np.meshgrid(np.arange(out_w, dtype=np.float32), np.arange(out_h, dtype=np.float32))
+    vectors = np.stack([x_grid - out_w / 2, -(y_grid - out_h / 2), np.full_like(x_grid, f)], axis=-1).reshape(-1, 3)
+    xyz = np.dot(_legacy_rotation(theta, phi), vectors.T).T
+    norm = np.sqrt((xyz ** 2).sum(axis=1))
+    phi_map = np.arcsin(np.clip(xyz[:, 1] / norm, -1, 1))
+    theta_map = np.arctan2(xyz[:, 0], xyz[:, 2])
+    u = np.mod((theta_map + np.pi) / (2 * np.pi) * W, W)
+    v = np.clip((np.pi / 2 - phi_map) / np.pi * H, 0, H - 1)
+    return u.reshape(out_h, out_w).astype(np.float32), v.reshape(out_h, out_w).astype(np.float32)
+
+
+def _legacy_rbfov_center(crop_theta, crop_phi, crop_fov, cx, cy, out_w, out_h):
+    """ImageController._calculate_spherical_rbfov 重构前的中心点逆投影"""
+    f = 0.5 * out_w / np.tan(0.5 * np.radians(crop_fov))
+    v_world = np.dot(_legacy_rotation(crop_theta, crop_phi), np.array([cx - out_w / 2.0, -(cy - out_h / 2.0), f]))
+    norm = np.sqrt((v_world ** 2).sum())
+    return np.arctan2(v_world[0], v_world[2]), np.arcsin(np.clip(v_world[1] / norm, -1.0, 1.0))
+
+
+def _legacy_direct_camera(recorder, view_angle_w, rotate_x, rotate_y):
+    """ImageRecorder._direct_camera 重构前的实现 (俯仰角叠加 + 反正切)"""
+    TX, TY = recorder._meshgrid()
+    r = recorder._imgW / 2 / np.tan(view_angle_w / 360 * np.pi)
+    R = np.sqrt(TY ** 2 + r ** 2)
+    angle_y = np.arctan(-TY / r) + rotate_y
+    X = np.sin(angle_y) * R
+    Y = -np.cos(angle_y) * R
+    INDn = np.abs(angle_y) > np.pi / 2
+    angle_x = np.arctan(TX / -Y)
+    angle_y = np.arctan(X / np.sqrt(Y ** 2 + TX ** 2))
+    angle_x[INDn] += np.pi
+    angle_x += rotate_x
+    INDy = angle_y < -np.pi / 2
+    angle_y[INDy] = -np.pi - angle_y[INDy]
+    angle_x[INDy] = angle_x[INDy] + np.pi
+    angle_x[angle_x <= -np.pi] += 2 * np.pi
+    angle_x[angle_x > np.pi] -= 2 * np.pi
+    return angle_x, angle_y
+
+
+def _random_boxes(rng, n, fov_lo=3.0, fov_hi=25.0):
+    return np.column_stack([rng.uniform(-np.pi, np.pi, n), rng.uniform(-1.4, 1.4, n), rng.uniform(fov_lo, fov_hi, n),
+                            rng.uniform(fov_lo, fov_hi, n), rng.uniform(-np.pi, np.pi, n)])
+
+
+def _timeit(func, repeat):
+    func()
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - t0) / repeat * 1000
+
+
+def benchmark(repeat: int):
+    thetas, phis = np.array([v[0] for v in VIEWS]), np.array([v[1] for v in VIEWS])
+    results = {
+        "erp_maps legacy x6 (float64, per view)": _timeit(
+            lambda: [_legacy_erp_maps(theta, phi, 90.0, OUT_W, OUT_H) for theta, phi, _ in VIEWS], repeat),
+        "erp_maps batched x6 (float32)": _timeit(
+            lambda: erp_maps(thetas, phis, 90.0, OUT_W, OUT_H, W, H), repeat),
+    }
+    rng = np.random.default_rng(1)
+    n = 1000
+    crop = rng.uniform(-1, 1, (n, 2))
+    boxes = rng.uniform(0, 512, (n, 2))
+    results[f"rbfov center legacy x{n} (per box)"] = _timeit(
+        lambda: [_legacy_rbfov_center(crop[i, 0], crop[i, 1], 90.0, boxes[i, 0], boxes[i, 1], 512, 512)
+                 for i in range(n)], repeat)
+    results[f"rbfov center batched x{n}"] = _timeit(
+        lambda: perspective_to_sphere(boxes[:, :1], boxes[:, 1:], crop[:, 0], crop[:, 1], 90.0, 512, 512), repeat)
+
+    recorder = ImageRecorder(W, H, view_angle_w=60, view_angle_h=40, long_side=640)
+    results["ImageRecorder direct_camera legacy"] = _timeit(lambda: _legacy_direct_camera(recorder, 60, 1.0, 0.4), repeat)
+    results["ImageRecorder direct_camera geometry"] = _timeit(lambda: recorder._direct_camera(1.0, 0.4), repeat)
+    pano = rng.integers(0, 256, (H, W, 3), dtype=np.uint8)
+    centers = np.column_stack([rng.uniform(-np.pi, np.pi, 32), rng.uniform(-1.4, 1.4, 32)])
+    results["ImageRecorder catch_batch x32 (cv2.remap)"] = _timeit(lambda: recorder.catch_batch(centers, pano), 1)
+
+    boxes = _random_boxes(rng, 3000)
+    results["spherical_iou 3000x3000"] = _timeit(lambda: spherical_iou(boxes, boxes), 1)
+    results["spherical_nms 3000 (iou >= 0.5)"] = _timeit(lambda: spherical_nms(boxes, threshold=0.5), 1)
+    results["project_boxes 3000 into one view"] = _timeit(lambda: project_boxes(boxes, 1.2, 0.3, 60.0, OUT_W, OUT_H),
+                                                          repeat)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    for name, ms in benchmark(args.repeat).items():
+        print(f"{name:<45} {ms:9.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+球面等面积网格与球冠检索
+
+网格: 按 y = sin(phi) 等分为 bands 个纬带，每个纬带按经度等分为 lons 个格子，
+即 Lambert 圆柱等面积投影上的均匀网格，所有格子面积相等；格子编号 cell = band * lons + lon
+球冠: 中心方向 (theta, phi) + 角半径，用作标注框与视锥的外接范围
+"""
+import numpy as np
+
+from .sphere import angles_to_rays
+
+
+def cap_radius(fov_w, fov_h):
+    """
+    视场为 fov_w x fov_h (度) 的矩形框 / 视锥，中心到角点的角距离 (弧度)，即外接球冠半径
+    """
+    tw = np.tan(0.5 * np.radians(fov_w))
+    th = np.tan(0.5 * np.radians(fov_h))
+    return np.arccos(1.0 / np.sqrt(1.0 + tw * tw + th * th))
+
+
+def angular_distance(xyz, theta, phi):
+    """单位向量 (..., 3) 到方向 (theta, phi) 的角距离 (弧度)"""
+    d = np.asarray(xyz) @ angles_to_rays(theta, phi)
+    return np.arccos(np.clip(d, -1.0, 1.0))
+
+
+def cell_of(theta, phi, bands: int, lons: int):
+    """方向 (theta, phi) 所在的格子编号"""
+    band = np.clip(np.floor((np.sin(phi) + 1) * 0.5 * bands), 0, bands - 1).astype(np.int64)
+    lon = np.floor((np.asarray(theta) + np.pi) / (2 * np.pi) * lons).astype(np.int64) % lons
+    return band * lons + lon
+
+
+def cap_cells(theta, phi, radius, bands: int, lons: int):
+    """
+    与球冠相交的格子编号 (保守估计: 取球冠的经纬度包围盒，结果可能多出少量格子，不会遗漏)
+    """
+    if radius >= np.pi:
+        return np.arange(bands * lons)
+    lat0, lat1 = phi - radius, phi + radius
+    band0 = int(np.clip(np.floor((np.sin(max(lat0, -np.pi / 2)) + 1) * 0.5 * bands), 0, bands - 1))
+    band1 = int(np.clip(np.floor((np.sin(min(lat1, np.pi / 2)) + 1) * 0.5 * bands), 0, bands - 1))
+    if lat0 <= -np.pi / 2 or lat1 >= np.pi / 2:
+        # 球冠包含极点，覆盖所有经度
+        lon_idx = np.arange(lons)
+    else:
+        dlon = np.arcsin(min(1.0, np.sin(radius) / np.cos(phi)))
+        start = int(np.floor((theta - dlon + np.pi) / (2 * np.pi) * lons))
+        end = int(np.floor((theta + dlon + np.pi) / (2 * np.pi) * lons))
+        lon_idx = np.arange(lons) if end - start + 1 >= lons else np.arange(start, end + 1) % lons
+    return (np.arange(band0, band1 + 1)[:, None] * lons + lon_idx[None, :]).ravel()
+
+
+def cell_ranges(cells):
+    """格子编号 -> 连续区间列表 [(lo, hi)]，用于生成紧凑的范围查询"""
+    cells = np.unique(np.asarray(cells, dtype=np.int64))
+    if len(cells) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(cells) != 1)
+    starts = np.concatenate([[0], breaks + 1])
+    ends = np.concatenate([breaks, [len(cells) - 1]])
+    return [(int(cells[s]), int(cells[e])) for s, e in zip(starts, ends)]
@@ -0,0 +1,176 @@
+"""
+球面框 (RBFoV) 的交并比与非极大值抑制
+
+球面框以 (N, 5) 数组表示，列为 (center_theta, center_phi, fov_w, fov_h, gamma)，角度单位与 Annotation 一致
+(中心与 gamma 为弧度，fov 为角度)；框的朝向与边缘点阵一致: R = look_at(theta, phi) · roll(gamma)
+
+面积取矩形视锥的解析立体角 4 * asin(sin(a) * sin(b))，交集面积用采样近似:
+每个框在切平面上取 samples 个低差异序列 (R2) 点 (按立体角加权，权重和等于解析面积；
+旋转框的边界与规则网格对齐时误差很大，R2 序列在同样点数下误差约为网格的一半)，
+统计 A 的采样点落在 B 内的权重与 B 的采样点落在 A 内的权重并取平均
+外接球冠不相交的框对直接为 0，只对候选框对做采样判断，N x M 的开销主要在一次角距离计算上
+"""
+import numpy as np
+
+from .cells import cap_radius
+from .sphere import angles_to_rays, look_at_matrices, roll_matrices
+
+# 每个框的默认采样点数，交并比的平均误差约 0.01
+DEFAULT_SAMPLES = 64
+# R2 序列的生成常数 (塑料数的倒数及其平方)
+_PLASTIC = 1.32471795724474602596
+
+
+def _unit_square_samples(n: int):
+    """[-1, 1]^2 上的 n 个 R2 低差异序列点 (n, 2)"""
+    k = np.arange(n)
+    points = np.column_stack([(0.5 + k / _PLASTIC) % 1, (0.5 + k / _PLASTIC ** 2) % 1])
+    return points * 2 - 1
+
+
+def box_rotations(boxes):
+    """(N, 5) 球面框 -> (N, 3, 3) 相机到世界的旋转"""
+    boxes = np.asarray(boxes, dtype=np.float64)
+    return np.matmul(look_at_matrices(boxes[:, 0], boxes[:, 1]), roll_matrices(boxes[:, 4]))
+
+
+def box_solid_angle(fov_w, fov_h):
+    """矩形视锥 (视场角为度) 的立体角 (球面度)"""
+    a = 0.5 * np.radians(fov_w)
+    b = 0.5 * np.radians(fov_h)
+    return 4 * np.arcsin(np.sin(a) * np.sin(b))
+
+
+def box_samples(boxes, samples: int = DEFAULT_SAMPLES):
+    """
+    各框内部的采样射线 (世界坐标, (N, S, 3)) 与立体角权重 ((N, S)，每行之和等于该框的立体角)
+    """
+    boxes = np.asarray(boxes, dtype=np.float64)
+    tw = np.tan(0.5 * np.radians(boxes[:, 2]))
+    th = np.tan(0.5 * np.radians(boxes[:, 3]))
+    # 切平面 [-1, 1]^2 上的采样点，按各框的半宽 / 半高缩放
+    unit = _unit_square_samples(samples)
+    u = tw[:, None] * unit[None, :, 0]
+    v = th[:, None] * unit[None, :, 1]
+    rays = np.stack([u, v, np.ones_like(u)], axis=-1)
+    norm = np.linalg.norm(rays, axis=-1)
+    rays /= norm[..., None]
+    # 切平面面元对应的立体角 dOmega = du dv / |r|^3，归一化到解析面积
+    weights = 1.0 / norm ** 3
+    weights *= (box_solid_angle(boxes[:, 2], boxes[:, 3]) / weights.sum(axis=1))[:, None]
+    world = np.matmul(rays, np.swapaxes(box_rotations(boxes), -1, -2))
+    return world, weights
+
+
+def _weight_inside(samples, weights, R, tw, th, owner, other):
+    """
+    各框对中 owner 框的采样点落在 other 框内的权重和，返回 (P,)
+    按 owner 分组: 一个框的采样点 (S, 3) 与其全部配对框的旋转拼成的 (3, 3m) 矩阵做一次矩阵乘法，
+    避免逐框对的 3x3 小矩阵乘法
+    """
+    out = np.empty(len(owner))
+    order = np.argsort(owner, kind="stable")
+    sorted_owner = owner[order]
+    bounds = np.flatnonzero(np.r_[True, sorted_owner[1:] != sorted_owner[:-1], True])
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        idx = order[start:end]
+        k, js = sorted_owner[start], other[idx]
+        # R^T · world，按行向量写作 world · R
+        cam = (samples[k] @ R[js].transpose(1, 0, 2).reshape(3, -1)).reshape(len(samples[k]), len(js), 3)
+        x, y, z = cam[..., 0], cam[..., 1], cam[..., 2]
+        inside = (z > 0) & (np.abs(x) <= tw[js] * z) & (np.abs(y) <= th[js] * z)
+        out[idx] = weights[k] @ inside
+    return out
+
+
+def candidate_pairs(a, b, same: bool = False):
+    """
+    外接球冠相交的框对 (i, j)；same=True 表示 a 与 b 为同一组框，只返回 i < j
+    """
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    va, vb = angles_to_rays(a[:, 0], a[:, 1]), angles_to_rays(b[:, 0], b[:, 1])
+    ra, rb = cap_radius(a[:, 2], a[:, 3]), cap_radius(b[:, 2], b[:, 3])
+    rows, cols = [], []
+    # 按行分块，避免 N x M 的中间数组过大
+    step = max(1, (1 << 22) // max(1, len(b)))
+    for start in range(0, len(a), step):
+        cos_d = np.clip(va[start:start + step] @ vb.T, -1, 1)
+        hit = np.arccos(cos_d) <= ra[start:start + step, None] + rb[None, :]
+        if same:
+            hit &= np.arange(start, start + len(cos_d))[:, None] < np.arange(len(b))[None, :]
+        i, j = np.nonzero(hit)
+        rows.append(i + start)
+        cols.append(j)
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(rows), np.concatenate(cols)
+
+
+def pair_iou(a, b, i, j, samples: int = DEFAULT_SAMPLES):
+    """框对 (a[i], b[j]) 的交并比，返回 (P,)"""
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    if len(i) == 0:
+        return np.empty(0)
+    # 包含判断用 float32 (约 1e-7 弧度的误差只影响恰好落在边界上的采样点)，内存与计算量减半
+    sa, wa = box_samples(a, samples)
+    sb, wb = box_samples(b, samples)
+    sa, sb = sa.astype(np.float32), sb.astype(np.float32)
+    Ra, Rb = box_rotations(a).astype(np.float32), box_rotations(b).astype(np.float32)
+    ta, ha = np.tan(0.5 * np.radians(a[:, 2])), np.tan(0.5 * np.radians(a[:, 3]))
+    tb, hb = np.tan(0.5 * np.radians(b[:, 2])), np.tan(0.5 * np.radians(b[:, 3]))
+    area_a = box_solid_angle(a[:, 2], a[:, 3])
+    area_b = box_solid_angle(b[:, 2], b[:, 3])
+    a_in_b = _weight_inside(sa, wa, Rb, tb.astype(np.float32), hb.astype(np.float32), i, j)
+    b_in_a = _weight_inside(sb, wb, Ra, ta.astype(np.float32), ha.astype(np.float32), j, i)
+    inter = 0.5 * (a_in_b + b_in_a)
+    union = area_a[i] + area_b[j] - inter
+    return inter / np.maximum(union, 1e-12)
+
+
+def spherical_iou(a, b, samples: int = DEFAULT_SAMPLES):
+    """两组球面框的交并比矩阵 (N, M)"""
+    a = np.asarray(a, dtype=np.float64).reshape(-1, 5)
+    b = np.asarray(b, dtype=np.float64).reshape(-1, 5)
+    iou = np.zeros((len(a), len(b)))
+    i, j = candidate_pairs(a, b)
+    iou[i, j] = pair_iou(a, b, i, j, samples)
+    return iou
+
+
+def overlapping_pairs(boxes, threshold: float = 0.5, samples: int = DEFAULT_SAMPLES):
+    """同一组框中交并比 >= threshold 的框对，返回 (i, j, iou)，i < j"""
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 5)
+    i, j = candidate_pairs(boxes, boxes, same=True)
+    # IoU 不超过小框与大框的面积比，面积相差过大的框对无需采样
+    area = box_solid_angle(boxes[:, 2], boxes[:, 3])
+    ratio = np.minimum(area[i], area[j]) / np.maximum(area[i], area[j])
+    i, j = i[ratio >= threshold], j[ratio >= threshold]
+    iou = pair_iou(boxes, boxes, i, j, samples)
+    keep = iou >= threshold
+    return i[keep], j[keep], iou[keep]
+
+
+def spherical_nms(boxes, scores=None, threshold: float = 0.5, samples: int = DEFAULT_SAMPLES, pairs=None):
+    """
+    球面非极大值抑制: 按 scores 从高到低 (缺省时按下标顺序，靠前的优先) 保留框，
+    与已保留框交并比 >= threshold 的框被抑制；返回保留框的下标 (按优先级排序)
+    pairs: 已算好的 overlapping_pairs(boxes, threshold) 结果，可省去重复计算
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 5)
+    n = len(boxes)
+    order = np.arange(n) if scores is None else np.argsort(-np.asarray(scores), kind="stable")
+    i, j, _ = pairs if pairs is not None else overlapping_pairs(boxes, threshold, samples)
+    neighbors = [[] for _ in range(n)]
+    for p, q in zip(i.tolist(), j.tolist()):
+        neighbors[p].append(q)
+        neighbors[q].append(p)
+    suppressed = np.zeros(n, dtype=bool)
+    keep = []
+    for k in order.tolist():
+        if suppressed[k]:
+            continue
+        keep.append(k)
+        suppressed[neighbors[k]] = True
+    return np.array(keep, dtype=np.int64)
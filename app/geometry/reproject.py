@@ -0,0 +1,87 @@
+"""
+球面框到透视切片的重投影
+
+球面框的四条边在其自身切平面上是直线，对应球面上的大圆弧；透视 (gnomonic) 投影把大圆映射为直线，
+因此任意切片中的球面框都是一个多边形，只需投影四个角点，再用视锥的五个平面 (近平面 + 四个侧面) 裁剪
+裁剪在相机坐标系中对全部框同时进行 (Sutherland-Hodgman，定长数组 + 有效掩码)，
+旋转与 透视切片渲染 (rotation_matrices) 一致
+"""
+import numpy as np
+
+from .iou import box_rotations
+from .sphere import focal_length, rotation_matrices
+
+# 近平面 z 的下限 (单位球半径的比例)，避免除以接近 0 的 z
+NEAR = 1e-6
+
+
+def box_corners(boxes):
+    """(N, 5) 球面框 -> 世界坐标下的四个角点方向 (N, 4, 3)，顺序为左上、右上、右下、左下 (画面方向)"""
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 5)
+    tw = np.tan(0.5 * np.radians(boxes[:, 2]))
+    th = np.tan(0.5 * np.radians(boxes[:, 3]))
+    sx = np.array([-1, 1, 1, -1])
+    sy = np.array([1, 1, -1, -1])
+    corners = np.stack([tw[:, None] * sx, th[:, None] * sy, np.ones((len(boxes), 4))], axis=-1)
+    return np.matmul(corners, np.swapaxes(box_rotations(boxes), -1, -2))
+
+
+def clip_polygons(vertices, counts, plane):
+    """
+    按半空间 plane[:3] · v + plane[3] >= 0 裁剪一组多边形
+    vertices: (N, V, 3)，counts: (N,) 各多边形的有效顶点数 (有效顶点在前)
+    返回裁剪后的 (vertices, counts)
+    """
+    n, v = vertices.shape[:2]
+    if v == 0:
+        return vertices, counts
+    k = np.arange(v)
+    valid = k[None, :] < counts[:, None]
+    # 每个顶点的下一个顶点 (在各自的有效顶点数内循环)
+    nxt = np.where(k[None, :] + 1 < counts[:, None], k[None, :] + 1, 0)
+    cur_v = vertices
+    nxt_v = np.take_along_axis(vertices, nxt[..., None], axis=1)
+    d0 = cur_v @ plane[:3] + plane[3]
+    d1 = np.take_along_axis(d0, nxt, axis=1)
+    keep = valid & (d0 >= 0)
+    cross = valid & ((d0 >= 0) != (d1 >= 0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = np.where(cross, d0 / (d0 - d1), 0.0)
+    inter = cur_v + t[..., None] * (nxt_v - cur_v)
+    # 每条边依次输出 [当前顶点 (若在内侧), 交点 (若穿越平面)]，再把有效点前移
+    out = np.stack([cur_v, inter], axis=2).reshape(n, 2 * v, 3)
+    mask = np.stack([keep, cross], axis=2).reshape(n, 2 * v)
+    order = np.argsort(~mask, axis=1, kind="stable")
+    out = np.take_along_axis(out, order[..., None], axis=1)
+    new_counts = mask.sum(axis=1)
+    width = int(new_counts.max()) if n else 0
+    return out[:, :width], new_counts
+
+
+def project_boxes(boxes, theta, phi, fov, out_w, out_h):
+    """
+    球面框在视角 (theta, phi, fov) 的 out_w x out_h 切片中的多边形 (已裁剪到画面内)
+    返回 N 个 float64 (k, 2) 像素坐标数组，与画面无交集的框为空数组
+    """
+    corners = box_corners(boxes)
+    n = len(corners)
+    # 世界 -> 切片相机坐标: R 为正交阵，逆旋转即乘以 R^T (行向量写作 world · R)
+    cam = corners @ rotation_matrices(theta, phi)
+    f = float(focal_length(fov, out_w))
+    hx, hy = out_w / 2 / f, out_h / 2 / f
+    counts = np.full(n, 4)
+    planes = np.array([
+        [0.0, 0.0, 1.0, -NEAR],  # z >= NEAR
+        [-1.0, 0.0, hx, 0.0], [1.0, 0.0, hx, 0.0],  # |x| <= hx * z
+        [0.0, -1.0, hy, 0.0], [0.0, 1.0, hy, 0.0],  # |y| <= hy * z
+    ])
+    for plane in planes:
+        cam, counts = clip_polygons(cam, counts, plane)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        px = cam[..., 0] / cam[..., 2] * f + out_w / 2
+        py = out_h / 2 - cam[..., 1] / cam[..., 2] * f
+    points = np.stack([px, py], axis=-1)
+    # 数值误差可能让边界上的点略微越界
+    np.clip(points[..., 0], 0, out_w, out=points[..., 0])
+    np.clip(points[..., 1], 0, out_h, out=points[..., 1])
+    return [points[i, :counts[i]] if counts[i] >= 3 else np.empty((0, 2)) for i in range(n)]
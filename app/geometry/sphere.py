@@ -0,0 +1,203 @@
+"""
+球面投影几何: 旋转、像素 <-> 射线 <-> (theta, phi)、ERP 与透视切片之间的正 / 逆映射
+
+坐标约定 (与透视切片渲染一致):
+    相机坐标系 x 右、y 上、z 前；theta = atan2(x, z) ∈ [-pi, pi]，phi = asin(y) ∈ [-pi/2, pi/2]
+    ERP 像素 u = (theta + pi) / 2pi * W，v = (pi/2 - phi) / pi * H
+    切片像素 (px, py) 对应相机射线 (px - out_w/2, -(py - out_h/2), f)，f = out_w/2 / tan(fov/2)
+    视角 (theta, phi) 的相机旋转 R = Ry(-theta) · Rx(phi)，world = R · cam
+
+批量约定:
+    视角参数 (theta / phi / fov / out_w / out_h) 可以是标量或形状为 (V,) 的数组；
+    点坐标可以是 (N,) 或 (V, N)，按 numpy 广播规则组合，标量视角得到 (N,) 结果，多视角得到 (V, N) 结果
+    dtype 决定计算精度，float32 用于生成 remap 表等大批量场景
+"""
+import numpy as np
+
+
+def _per_view(a, dtype):
+    # 视角参数追加一维，使 (V,) 与点坐标 (N,) / (V, N) 广播为 (V, N)；标量保持原样
+    a = np.asarray(a, dtype=dtype)
+    return a[..., None] if a.ndim else a
+
+
+def rotation_matrices(theta, phi, dtype=np.float64):
+    """
+    R = Ry(-theta) · Rx(phi)，返回形状 (..., 3, 3)，与 theta / phi 的广播形状一致
+    """
+    theta = np.asarray(theta, dtype=np.float64)
+    phi = np.asarray(phi, dtype=np.float64)
+    theta, phi = np.broadcast_arrays(theta, phi)
+    ct, st = np.cos(-theta), np.sin(-theta)
+    cp, sp = np.cos(phi), np.sin(phi)
+    zero = np.zeros_like(theta)
+    R = np.stack([
+        np.stack([ct, st * sp, st * cp], axis=-1),
+        np.stack([zero, cp, -sp], axis=-1),
+        np.stack([-st, ct * sp, ct * cp], axis=-1),
+    ], axis=-2)
+    return R.astype(dtype, copy=False)
+
+
+def rotation_matrix(theta, phi):
+    """单个视角的 3x3 旋转矩阵 (float64)"""
+    return rotation_matrices(float(theta), float(phi))
+
+
+def look_at_matrices(theta, phi, dtype=np.float64):
+    """
+    将相机前向 (+Z) 旋转到球面方向 (theta, phi) 的旋转矩阵
+    注意透视切片渲染使用的 rotation_matrices(theta, phi) 会把前向转到 (-theta, -phi)，两者互为符号翻转
+    """
+    return rotation_matrices(-np.asarray(theta, dtype=np.float64), -np.asarray(phi, dtype=np.float64), dtype)
+
+
+def roll_matrices(gamma, dtype=np.float64):
+    """
+    绕相机光轴 (+Z) 的旋转矩阵 (..., 3, 3)，gamma > 0 时在切片画面上顺时针旋转 (画面 y 轴向下)
+    """
+    gamma = np.asarray(gamma, dtype=np.float64)
+    c, s = np.cos(gamma), np.sin(gamma)
+    zero, one = np.zeros_like(gamma), np.ones_like(gamma)
+    R = np.stack([
+        np.stack([c, s, zero], axis=-1),
+        np.stack([-s, c, zero], axis=-1),
+        np.stack([zero, zero, one], axis=-1),
+    ], axis=-2)
+    return R.astype(dtype, copy=False)
+
+
+def focal_length(fov, out_w):
+    """水平视场角 (度) + 输出宽度 -> 像素焦距"""
+    return 0.5 * np.asarray(out_w, dtype=np.float64) / np.tan(0.5 * np.radians(fov))
+
+
+def rotate(rays, R):
+    """
+    射线 (..., N, 3) 按旋转矩阵 (..., 3, 3) 旋转，即 world = R · cam，返回 (..., N, 3)
+    """
+    return np.matmul(rays, np.swapaxes(R, -1, -2))
+
+
+def pixels_to_rays(px, py, fov, out_w, out_h, dtype=np.float64, normalize=True):
+    """
+    切片像素坐标 -> 相机坐标系射线 (..., N, 3)
+    """
+    px = np.asarray(px, dtype=dtype)
+    py = np.asarray(py, dtype=dtype)
+    f = _per_view(focal_length(fov, out_w), dtype)
+    x = px - _per_view(out_w, dtype) / 2
+    y = -(py - _per_view(out_h, dtype) / 2)
+    x, y, f = np.broadcast_arrays(x, y, f)
+    rays = np.stack([x, y, f], axis=-1)
+    if normalize:
+        rays /= np.linalg.norm(rays, axis=-1, keepdims=True)
+    return rays
+
+
+def camera_rays(fov, out_w, out_h, dtype=np.float32):
+    """
+    单个视角的完整像素网格射线 (out_h * out_w, 3)，按行优先排列，已归一化
+    """
+    x_grid, y_grid = np.meshgrid(np.arange(out_w, dtype=np.float64), np.arange(out_h, dtype=np.float64))
+    rays = pixels_to_rays(x_grid.ravel(), y_grid.ravel(), float(fov), int(out_w), int(out_h))
+    return rays.astype(dtype, copy=False)
+
+
+def rays_to_angles(xyz):
+    """
+    射线 (..., 3) -> (theta, phi)，射线无需归一化
+    """
+    x, y, z = xyz[..., 0], xyz[..., 1], xyz[..., 2]
+    norm = np.sqrt(x * x + y * y + z * z)
+    phi = np.arcsin(np.clip(y / norm, -1, 1))
+    theta = np.arctan2(x, z)
+    return theta, phi
+
+
+def angles_to_rays(theta, phi, dtype=np.float64):
+    """(theta, phi) -> 单位射线 (..., 3)"""
+    theta = np.asarray(theta, dtype=dtype)
+    phi = np.asarray(phi, dtype=dtype)
+    cos_phi = np.cos(phi)
+    return np.stack([cos_phi * np.sin(theta), np.sin(phi) * np.ones_like(theta), cos_phi * np.cos(theta)], axis=-1)
+
+
+def angles_to_erp(theta, phi, W, H, wrap=True, clip=True):
+    """
+    (theta, phi) -> ERP 像素坐标 (u, v)
+    wrap: u 对 W 取模；clip: v 截断到 [0, H-1] (cv2.remap 取样约定)
+    """
+    u = (np.asarray(theta) + np.pi) * (W / (2 * np.pi))
+    v = (np.pi / 2 - np.asarray(phi)) * (H / np.pi)
+    if wrap:
+        u = np.mod(u, W)
+    if clip:
+        v = np.clip(v, 0, H - 1)
+    return u, v
+
+
+def erp_to_angles(u, v, W, H):
+    """ERP 像素坐标 -> (theta, phi)"""
+    theta = np.asarray(u) / W * 2 * np.pi - np.pi
+    phi = (H / 2 - np.asarray(v)) / (H / 2) * (np.pi / 2)
+    return theta, phi
+
+
+def rays_to_erp(xyz, W, H, out_x=None, out_y=None):
+    """
+    单位射线 (..., 3) -> ERP remap 坐标 (map_x, map_y)
+    计算全部原地完成，可传入预分配的 out_x / out_y 复用内存；dtype 跟随 xyz
+    """
+    map_x = np.arctan2(xyz[..., 0], xyz[..., 2], out=out_x)
+    map_y = np.clip(xyz[..., 1], -1, 1, out=out_y)
+    np.arcsin(map_y, out=map_y)
+
+    # 经度 [-pi, pi] -> [0, W)，纬度 [pi/2, -pi/2] -> [0, H-1]
+    map_x += np.pi
+    map_x *= W / (2 * np.pi)
+    np.mod(map_x, W, out=map_x)
+    np.subtract(np.pi / 2, map_y, out=map_y)
+    map_y *= H / np.pi
+    np.clip(map_y, 0, H - 1, out=map_y)
+    return map_x, map_y
+
+
+def erp_maps(theta, phi, fov, out_w, out_h, W, H, dtype=np.float32, rays=None):
+    """
+    ERP -> 透视切片的 remap 表 (正向渲染)
+    theta / phi 可为 (V,) 数组，同一内参 (fov, out_w, out_h) 的多个视角共用射线束，
+    返回 (map_x, map_y)，形状为 (..., out_h, out_w)
+    """
+    if rays is None:
+        rays = camera_rays(fov, out_w, out_h, dtype)
+    xyz = rotate(rays, rotation_matrices(theta, phi, dtype))
+    map_x, map_y = rays_to_erp(xyz, W, H)
+    shape = map_x.shape[:-1] + (out_h, out_w)
+    return map_x.reshape(shape), map_y.reshape(shape)
+
+
+def perspective_to_sphere(px, py, theta, phi, fov, out_w, out_h, dtype=np.float64):
+    """
+    逆映射: 视角 (theta, phi, fov) 下切片像素 (px, py) -> 球面坐标 (theta, phi)
+    """
+    rays = pixels_to_rays(px, py, fov, out_w, out_h, dtype, normalize=False)
+    xyz = rotate(rays, rotation_matrices(theta, phi, dtype))
+    return rays_to_angles(xyz)
+
+
+def sphere_to_perspective(point_theta, point_phi, theta, phi, fov, out_w, out_h, dtype=np.float64):
+    """
+    正映射: 球面点 (point_theta, point_phi) -> 视角 (theta, phi, fov) 下的切片像素 (px, py)
+    同时返回 in_front 掩码 (点位于相机前方)；相机后方的点坐标无意义
+    """
+    world = angles_to_rays(np.atleast_1d(point_theta), np.atleast_1d(point_phi), dtype)
+    # R 为正交阵，逆旋转即乘以 R^T
+    cam = np.matmul(world, rotation_matrices(theta, phi, dtype))
+    x, y, z = cam[..., 0], cam[..., 1], cam[..., 2]
+    in_front = z > 0
+    f = _per_view(focal_length(fov, out_w), dtype)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        px = x / z * f + _per_view(out_w, dtype) / 2
+        py = _per_view(out_h, dtype) / 2 - y / z * f
+    return px, py, in_front
@@ -1,4 +1,4 @@
 # 新增model需要在这里导入
 from .admin import *
 from .project import Project, Label
-from .image import Image360, Annotation
\ No newline at end of file
+from .image import Image360, Annotation, AnnotationCell
\ No newline at end of file
@@ -14,6 +14,10 @@ class Image360(BaseModel, TimestampMixin):
     url = fields.CharField(max_length=512, description="访问URL")
     width = fields.IntField(null=True, description="图片真实宽度")
     height = fields.IntField(null=True, description="图片真实高度")
+    content_hash = fields.CharField(max_length=64, null=True, description="文件内容 SHA256 (用于 ETag/缓存键)")
+    pyramid = fields.JSONField(null=True, description="多分辨率金字塔层级 [{level, width, height, file_path}]")
+    cubemap = fields.JSONField(null=True, description="立方体贴图 {size, faces: {F/R/B/L/U/D: file_path}}")
+    tiles = fields.JSONField(null=True, description="分块原始像素文件 {file_path, tile_size, width, height}")
 
     # 反向关联
     annotations: fields.ReverseRelation["Annotation"]
@@ -46,5 +50,40 @@ class Annotation(BaseModel, TimestampMixin):
     box_h = fields.FloatField(description="2D框 高度", null=True)
     box_angle = fields.FloatField(description="2D框 旋转角度", null=True, default=0.0)
 
+    # 球面框 (含 gamma) 在 ERP 上的边缘点阵，float32 [x0, y0, x1, y1, ...]
+    boundary = fields.BinaryField(null=True, description="ERP 边缘点阵 (float32 紧凑格式)")
+    boundary_key = fields.CharField(max_length=40, null=True, description="生成点阵时的几何参数摘要，变化时重新计算")
+
+    # 球面空间索引: 中心单位向量 + 外接球冠角半径 (弧度)，覆盖的等面积格子见 AnnotationCell
+    center_x = fields.FloatField(null=True, description="中心单位向量 x")
+    center_y = fields.FloatField(null=True, description="中心单位向量 y")
+    center_z = fields.FloatField(null=True, description="中心单位向量 z")
+    angular_radius = fields.FloatField(null=True, description="外接球冠角半径 (弧度)")
+
+    # 边缘点阵在 ERP 上的轴对齐外接框 (像素，与 boundary 同一坐标)，用于按像素区域检索 / 导出 / 分块
+    # 跨越经度接缝时 erp_seam 为真且 erp_x0 > erp_x1，覆盖 [erp_x0, W) 与 [0, erp_x1]；包含极点的框横跨整个宽度
+    erp_x0 = fields.FloatField(null=True, description="ERP 外接框左边界")
+    erp_y0 = fields.FloatField(null=True, description="ERP 外接框上边界")
+    erp_x1 = fields.FloatField(null=True, description="ERP 外接框右边界")
+    erp_y1 = fields.FloatField(null=True, description="ERP 外接框下边界")
+    erp_seam = fields.BooleanField(default=False, description="外接框是否跨越经度接缝")
+    # 批量写入时同一请求的行共用的标记，用于在不回填主键的后端上按 id 顺序回读主键
+    batch_token = fields.CharField(max_length=32, null=True, index=True, description="批量写入标记")
+
+    cells: fields.ReverseRelation["AnnotationCell"]
+
+    class Meta:
+        table = "annotation"
+        indexes = (("image_id", "erp_y0", "erp_y1"), ("image_id", "erp_x0", "erp_x1"))
+
+
+class AnnotationCell(BaseModel):
+    """标注外接球冠覆盖的球面等面积格子 (一条标注对应多个格子)"""
+    annotation = fields.ForeignKeyField('models.Annotation', related_name='cells', on_delete=fields.CASCADE,
+                                        description="所属标注")
+    image_id = fields.IntField(description="所属图片ID (冗余，用于按图片 + 格子检索)")
+    cell = fields.IntField(description="格子编号 band * lons + lon")
+
     class Meta:
-        table = "annotation"
\ No newline at end of file
+        table = "annotation_cell"
+        indexes = (("image_id", "cell"),)
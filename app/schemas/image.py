@@ -1,5 +1,5 @@
 # app/schemas/image.py
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List, Dict
 from datetime import datetime
 
@@ -24,6 +24,36 @@ class PerspectiveRequest(BaseModel):
     u: float
     v: float
     fov: float = 90.0
+    annotations: bool = False  # 同时返回视野内标注在切片像素坐标下的多边形
+
+
+# --- 二进制透视切片 (GET，可被 HTTP 缓存) ---
+class PerspectiveView(BaseModel):
+    theta: float = 0.0  # 视角中心经度 (弧度)
+    phi: float = Field(0.0, ge=-1.5708, le=1.5708)  # 视角中心纬度 (弧度)
+    fov: float = Field(90.0, gt=0, lt=180)  # 水平视场角 (角度)
+    w: int = Field(512, ge=16, le=4096)
+    h: int = Field(512, ge=16, le=4096)
+    fmt: str = Field("jpg", pattern="^(jpg|webp)$")
+    quality: int = Field(90, ge=1, le=100)
+    mode: str = Field("erp", pattern="^(erp|cube)$")
+    progressive: bool = False  # 先返回低分辨率预览，再返回完整结果
+
+
+# --- 批量多视角切片 ---
+class ViewSpec(BaseModel):
+    theta: float = 0.0
+    phi: float = Field(0.0, ge=-1.5708, le=1.5708)
+    fov: float = Field(90.0, gt=0, lt=180)
+    w: int = Field(512, ge=16, le=4096)
+    h: int = Field(512, ge=16, le=4096)
+
+
+class BatchViewRequest(BaseModel):
+    views: List[ViewSpec] = Field(..., min_length=1, max_length=64)
+    fmt: str = Field("jpg", pattern="^(jpg|webp)$")
+    quality: int = Field(90, ge=1, le=100)
+    container: str = Field("zip", pattern="^(zip|multipart)$")  # zip / multipart/mixed
 
 
 class AnnotationCreate(BaseModel):
@@ -55,7 +85,56 @@ class AnnotationOut(BaseModel):
     # 用于前端 SVG完美渲染曲率边界的 2D 像素点阵序列
     boundary_points: List[Dict[str, float]]
 
+    # ERP 轴对齐外接框 [x0, y0, x1, y1]，erp_seam 为真时 x0 > x1 (跨越经度接缝)
+    erp_bbox: Optional[List[float]] = None
+    erp_seam: bool = False
+
     created_at: datetime
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+
+# --- 标注点阵的返回格式 ---
+class BoundaryOptions(BaseModel):
+    tolerance: float = Field(0.0, ge=0)  # 简化容差 (像素)，0 表示不简化
+    max_points: int = Field(0, ge=0)  # 每个多边形的点数上限，0 表示不限
+    accept: Optional[str] = None  # Accept 头，application/x-boundary-f32 / application/x-boundary-delta 返回二进制
+
+
+# --- 批量标注 ---
+class AnnotationBatchCreate(BaseModel):
+    items: List[AnnotationCreate] = Field(..., min_length=1, max_length=1000)
+
+
+class AnnotationBatchItem(BaseModel):
+    index: int  # 对应请求 items 中的下标
+    ok: bool
+    error: Optional[str] = None
+    annotation: Optional[AnnotationOut] = None
+
+
+class AnnotationBatchOut(BaseModel):
+    created: int
+    results: List[AnnotationBatchItem]
+
+
+# --- 标注在透视切片中的重投影 ---
+class AnnotationProjected(BaseModel):
+    id: int
+    label_id: int
+    # 切片像素坐标下的多边形 (已裁剪到画面内)
+    points: List[Dict[str, float]]
+
+
+# --- 标注重叠检测 ---
+class AnnotationOverlap(BaseModel):
+    a: int
+    b: int
+    iou: float  # 球面交并比
+
+
+class AnnotationOverlapsOut(BaseModel):
+    threshold: float
+    pairs: List[AnnotationOverlap]
+    suppressed: List[int]  # 球面 NMS (先保存的优先) 建议删除的标注ID
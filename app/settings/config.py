@@ -1,4 +1,5 @@
 import os
+import tempfile
 import typing
 
 from pydantic_settings import BaseSettings
@@ -90,5 +91,71 @@ class Settings(BaseSettings):
     }
     DATETIME_FORMAT: str = "%Y-%m-%d %H:%M:%S"
 
+    # 全景图解码缓存的字节预算 (按 LRU 淘汰)
+    PANO_CACHE_MAX_BYTES: int = 1024 * 1024 * 1024
+    # 透视切片 remap 使用 CV_16SC2 定点映射表
+    PANO_REMAP_FIXED_POINT: bool = True
+    # 多视角批量渲染时同时生成 remap 表的像素数上限 (每像素约 40 字节中间数组)，超过时分块生成
+    PANO_BATCH_CHUNK_PIXELS: int = 4 * 1024 * 1024
+    # 多分辨率金字塔: 最小层宽度 / 层级 JPEG 质量 / 选层时的过采样系数
+    PANO_PYRAMID_MIN_WIDTH: int = 1024
+    PANO_PYRAMID_QUALITY: int = 95
+    PANO_PYRAMID_OVERSAMPLE: float = 1.0
+    # 立方体贴图: 上传时是否生成 / 面边长 (0 表示取 ERP 宽度的 1/4) / 默认渲染路径 (erp 或 cube)
+    PANO_CUBEMAP_ON_UPLOAD: bool = False
+    PANO_CUBEMAP_FACE_SIZE: int = 0
+    PANO_RENDER_MODE: str = "erp"
+    # 分块原始像素存储: 上传时是否生成 / 分块边长；生成后全分辨率切片只读取视锥覆盖的分块
+    PANO_TILES_ON_UPLOAD: bool = False
+    PANO_TILE_SIZE: int = 512
+    # 渐进式切片预览: 预览输出尺寸缩小倍数 / 预览编码质量 / 无金字塔时原图的缩小解码倍数 (2 / 4 / 8)
+    PROGRESSIVE_PREVIEW_SCALE: int = 4
+    PROGRESSIVE_PREVIEW_QUALITY: int = 60
+    PROGRESSIVE_DECODE_REDUCTION: int = 8
+    # 标注边界点阵的总点数 (0 表示沿视场网格边缘逐像素取点，点数约为 4 x long_side)
+    ANNOTATION_BOUNDARY_POINTS: int = 0
+    # ImageRecorder 相机射线缓存上限 (字节)，按量化后的 (fov_w, fov_h, long_side) 共享，超过上限的单项 (如整图稠密网格) 不缓存
+    RECORDER_GEOMETRY_CACHE_BYTES: int = 256 * 1024 * 1024
+    # 缓存 key 中视场角的量化步长 (度)
+    RECORDER_FOV_QUANTUM: float = 0.01
+    # 标注点阵差分传输格式的坐标量化步长 (像素)
+    ANNOTATION_WIRE_STEP: float = 0.1
+    # 标注球面索引的等面积网格: 纬带数 x 每个纬带的经度格子数 (修改后需清空 annotation_cell 与 angular_radius 以重建索引)
+    ANNOTATION_INDEX_BANDS: int = 32
+    ANNOTATION_INDEX_LONS: int = 64
+    # 标注预览图 (缩小的整幅全景图 + 标注叠加): 默认宽度 (像素) / 填充不透明度 / 描边宽度 (像素)
+    ANNOTATION_PREVIEW_WIDTH: int = 2048
+    ANNOTATION_PREVIEW_FILL_ALPHA: float = 0.25
+    ANNOTATION_PREVIEW_LINE: int = 2
+
+    # 已编码切片结果缓存: memory / disk / redis / none
+    CROP_CACHE_BACKEND: str = "memory"
+    CROP_CACHE_MAX_BYTES: int = 256 * 1024 * 1024
+    CROP_CACHE_DIR: str = os.path.join(BASE_DIR, "cache/crops")
+    CROP_CACHE_REDIS_URL: str = "redis://localhost:6379/0"
+    CROP_CACHE_TTL: int = 7 * 24 * 3600
+    # 邻近视角预取: 开关 / 偏航、俯仰、视场角步长 (度) / 同时预取的图片数 / 预取结果跟踪上限
+    PREFETCH_ENABLED: bool = True
+    PREFETCH_YAW_STEP: float = 15.0
+    PREFETCH_PITCH_STEP: float = 10.0
+    PREFETCH_FOV_STEP: float = 10.0
+    PREFETCH_MAX_IMAGES: int = 8
+    PREFETCH_TRACK_SIZE: int = 1024
+
+    # 图像计算执行器: worker 数量 / 是否使用进程池 / 每个 worker 的 OpenCV 线程数
+    IMAGING_WORKERS: int = min(4, os.cpu_count() or 1)
+    IMAGING_USE_PROCESS_POOL: bool = False
+    IMAGING_CV2_THREADS: int = 1
+
+    # 切片渲染服务 (常驻 worker 进程 + 共享内存返回结果): 开关 / worker 进程数 / socket 路径前缀 /
+    # 每个分片的最大并发连接数 / 是否随应用启动 (多 uvicorn worker 部署时应单独运行 python -m app.core.render_service)
+    RENDER_SERVICE_ENABLED: bool = False
+    RENDER_SERVICE_WORKERS: int = min(4, os.cpu_count() or 1)
+    RENDER_SERVICE_ADDRESS: str = os.path.join(tempfile.gettempdir(), "pano-render")
+    RENDER_SERVICE_CONNECTIONS: int = 4
+    RENDER_SERVICE_AUTOSTART: bool = False
+    # 渲染 worker 启动完成时常驻内存 (RSS, MB) 的告警阈值: worker 只应导入渲染相关模块，超出说明连带导入了整个应用
+    RENDER_SERVICE_WORKER_RSS_MB: int = 96
+
 
 settings = Settings()
@@ -1,9 +1,188 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
+import threading
+from collections import OrderedDict
+
 import cv2
 import numpy as np
-from scipy.interpolate import RegularGridInterpolator as interp2d
+from app.geometry import look_at_matrices, rays_to_angles, rotate
+from app.settings import settings
+
+
+def quantize_fov(fov, quantum=None):
+    """
+    Round a FOV (degrees) to the geometry cache grid, so that nearly identical
+    annotation sizes share one set of camera rays.
+    """
+    quantum = quantum or settings.RECORDER_FOV_QUANTUM
+    return round(round(float(fov) / quantum) * quantum, 6)
+
+
+class GeometryCache:
+    """
+    Size-aware LRU of the orientation-independent recorder geometry (camera rays),
+    keyed by (kind, fov_w, fov_h, long_side, ...). Arrays are shared read-only
+    by every recorder with the same quantized FOVs.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.oversized = 0
+
+    def get_or_build(self, key, build):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+        value = build()
+        value.flags.writeable = False
+        if value.nbytes > self.max_bytes:
+            # e.g. the dense grid of a full-resolution ERP; built per use, never cached
+            with self._lock:
+                self.oversized += 1
+            return value
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            self._entries[key] = value
+            self._bytes += value.nbytes
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "oversized": self.oversized,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+geometry_cache = GeometryCache(settings.RECORDER_GEOMETRY_CACHE_BYTES)
+
+# fractional bits of the fixed-point coordinates passed to cv2 drawing calls
+_SHIFT = 4
+
+
+def _unwrap_ring(Px, Py, sphereW):
+    """
+    Closed ERP ring -> continuous open polyline (n + 1, 2) in cv2 pixel coordinates.
+    Jumps across the seam are undone by shifting the following points by +-sphereW, so
+    the last point equals the first one plus k * sphereW; k != 0 means the ring winds
+    around a pole. Also returns k.
+    """
+    x = np.asarray(Px, dtype=np.float64) - 0.5
+    y = np.asarray(Py, dtype=np.float64) - 0.5
+    x = np.append(x, x[0])
+    y = np.append(y, y[0])
+    steps = np.diff(x)
+    jumps = -np.round(steps / sphereW) * sphereW
+    x[1:] += np.cumsum(jumps)
+    return np.column_stack([x, y]), int(round(jumps.sum() / sphereW))
+
+
+def erp_bboxes(rings, sphereW, sphereH):
+    """
+    Axis-aligned ERP bounding boxes of closed border rings, vectorized over all rings.
+    Returns (N, 4) [x0, y0, x1, y1] (NaN for empty rings) and an (N,) seam flag.
+    A box crossing the seam has x0 > x1 and covers [x0, sphereW) and [0, x1];
+    a ring winding around a pole spans the full width and reaches that pole's row.
+    """
+    counts = np.array([len(r) for r in rings], dtype=np.int64)
+    boxes = np.full((len(rings), 4), np.nan)
+    seam = np.zeros(len(rings), dtype=bool)
+    valid = counts > 0
+    if not valid.any():
+        return boxes, seam
+    points = np.concatenate([np.asarray(r, dtype=np.float64).reshape(-1, 2) for r in rings if len(r)])
+    x, y = points[:, 0], points[:, 1]
+    n = counts[valid]
+    starts = np.concatenate([[0], np.cumsum(n)[:-1]])
+    # step from every point to the next one of its ring (the last point steps back to the first)
+    nxt = np.arange(1, len(x) + 1)
+    nxt[starts + n - 1] = starts
+    jumps = -np.round((x[nxt] - x) / sphereW) * sphereW
+    # unwrap each ring independently: exclusive cumulative sum restarted at every ring start
+    shift = np.cumsum(jumps) - jumps
+    shift -= np.repeat(shift[starts], n)
+    ux = x + shift
+    x_min, x_max = np.minimum.reduceat(ux, starts), np.maximum.reduceat(ux, starts)
+    y_min, y_max = np.minimum.reduceat(y, starts), np.maximum.reduceat(y, starts)
+    pole = np.round(np.add.reduceat(jumps, starts) / sphereW) != 0
+    north = pole & (np.add.reduceat(y, starts) / n < sphereH / 2)
+    y_min[north] = 0.0
+    y_max[pole & ~north] = float(sphereH)
+    width = x_max - x_min
+    full = pole | (width >= sphereW)
+    x0 = np.mod(x_min, sphereW)
+    x1 = x0 + width
+    crossing = ~full & (x1 > sphereW)
+    x1[crossing] -= sphereW
+    x0[full], x1[full] = 0.0, float(sphereW)
+    boxes[valid] = np.column_stack([x0, y_min, x1, y_max])
+    seam[valid] = crossing
+    return boxes, seam
+
+
+def _seam_copies(points, sphereW):
+    """Copies of a polyline shifted by whole panorama widths so that every part lands inside [0, sphereW)."""
+    lo = int(np.floor(points[:, 0].min() / sphereW))
+    hi = int(np.floor(points[:, 0].max() / sphereW))
+    return [np.rint((points - [k * sphereW, 0]) * (1 << _SHIFT)).astype(np.int32) for k in range(lo, hi + 1)]
+
+
+def draw_spherical_outline(frame, Px, Py, color, thickness=1):
+    """
+    Outline of a spherical box given its closed ERP border ring, drawn as polylines.
+    Segments crossing the seam are split onto both sides of the image.
+    """
+    H, W = frame.shape[:2]
+    if len(Px) < 2:
+        return frame
+    points, _ = _unwrap_ring(Px, Py, W)
+    cv2.polylines(frame, _seam_copies(points, W), False, color, thickness, cv2.LINE_AA, _SHIFT)
+    return frame
+
+
+def fill_spherical_box(frame, Px, Py, color):
+    """
+    Fill the inside of a spherical box given its closed ERP border ring.
+    A ring that winds around a pole is closed along the nearer pole row.
+    """
+    H, W = frame.shape[:2]
+    if len(Px) < 3:
+        return frame
+    points, winding = _unwrap_ring(Px, Py, W)
+    if winding:
+        pole = 0.0 if points[:, 1].mean() < H / 2 else H - 1.0
+        points = np.vstack([points, [[points[-1, 0], pole], [points[0, 0], pole]]])
+    cv2.fillPoly(frame, _seam_copies(points, W), color, cv2.LINE_8, _SHIFT)
+    return frame
 
 
 class ImageRecorder(object):
@@ -21,8 +200,9 @@ class ImageRecorder(object):
         """
         self.sphereW = sphereW
         self.sphereH = sphereH
-        fov_w, fov_h = view_angle_w, view_angle_h
+        fov_w, fov_h = quantize_fov(view_angle_w), quantize_fov(view_angle_h)
         self._long_side = long_side
+        self._geometry_key = (fov_w, fov_h, long_side)
 
         if fov_w >= fov_h:
             self._imgW = long_side
@@ -33,12 +213,29 @@ class ImageRecorder(object):
             self._imgW = int(np.tan(fov_w / 360 * np.pi) *
                              self._imgH / float(np.tan(fov_h / 360 * np.pi)))
 
-        TX, TY = self._meshgrid()
-        R, ANGy = self._compute_radius(view_angle_w, TY)
+        # focal length in pixels; the dense ray grid is only built on demand
+        self._focal = self._imgW/2 / np.tan(np.pi * fov_w / 360.)
 
-        self._R = R
-        self._ANGy = ANGy
-        self._Z = TX
+    @property
+    def _rays(self):
+        """
+        Dense camera rays of the whole FOV grid, shape (imgH, imgW, 3).
+        Only callers that sample every pixel (catch, dense draw_Sphbbox) pay for it.
+        """
+        return geometry_cache.get_or_build(("dense",) + self._geometry_key,
+                                           lambda: self._camera_rays(*self._meshgrid()))
+
+    def _mesh_axes(self):
+        """
+        The 1-D pixel coordinates along x and y that _meshgrid combines.
+        """
+        xs = np.arange(self._imgW, dtype=np.float64)
+        ys = np.arange(self._imgH, dtype=np.float64)
+        if self._imgW >= self._imgH:
+            ys += int((self._imgW - self._imgH)/2)
+        else:
+            xs += int((self._imgH - self._imgW)/2)
+        return xs - 0.5 - self._long_side/2, ys - 0.5 - self._long_side/2
 
     def _meshgrid(self):
         """
@@ -61,92 +258,108 @@ class ImageRecorder(object):
         TY -= self._long_side/2
         return TX, TY
 
-    def _compute_radius(self, view_angle, TY):
-        _view_angle = np.pi * view_angle / 180.
-        r = self._imgW/2 / np.tan(_view_angle/2)
-        R = np.sqrt(np.power(TY, 2) + r**2)
-        ANGy = np.arctan(-TY/r)
-        return R, ANGy
+    def _camera_rays(self, TX, TY):
+        """
+        Camera rays (x right, y up, z forward) of the mesh points.
+        """
+        return np.stack([TX, -TY, np.full_like(TX, self._focal)], axis=-1)
+
+    def _border_rays(self, num_points=None):
+        """
+        Camera rays on the four edges only, computed from the edge coordinates
+        without building the dense grid. Points form a closed ring (top left->right,
+        right top->bottom, bottom right->left, left bottom->top), corners once.
+        num_points: total number of points along the perimeter, split between
+        the edges by length; None keeps one point per pixel of the FOV grid.
+        """
+        return geometry_cache.get_or_build(("border",) + self._geometry_key + (num_points or 0,),
+                                           lambda: self._build_border_rays(num_points))
+
+    def _build_border_rays(self, num_points):
+        xs, ys = self._mesh_axes()
+        if num_points:
+            per_unit = num_points / (2. * (self._imgW + self._imgH))
+            xs = np.linspace(xs[0], xs[-1], max(2, int(round(self._imgW * per_unit))))
+            ys = np.linspace(ys[0], ys[-1], max(2, int(round(self._imgH * per_unit))))
+        top = self._camera_rays(xs, np.full_like(xs, ys[0]))
+        right = self._camera_rays(np.full_like(ys[1:-1], xs[-1]), ys[1:-1])
+        bottom = self._camera_rays(xs[::-1], np.full_like(xs, ys[-1]))
+        left = self._camera_rays(np.full_like(ys[1:-1], xs[0]), ys[-2:0:-1])
+        return np.concatenate([top, right, bottom, left])
 
     def catch(self, x, y, image):
-        Px, Py = self._sample_points(x, y)
-        warped_image = self._warp_image(Px, Py, image)
-        return warped_image
+        """
+        Rectified patch (imgH, imgW, C) centered at (x, y), same dtype as image.
+        """
+        map_x, map_y = self._sample_maps(x, y)
+        return self._warp_image(map_x[0], map_y[0], image)
+
+    def catch_batch(self, centers, image, chunk=16):
+        """
+        Rectified patches for many centers of one decoded panorama.
+        centers: (N, 2) array of (x, y); returns (N, imgH, imgW, C), same dtype as image.
+        The cached dense rays are rotated for up to `chunk` centers at a time.
+        """
+        centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+        patches = np.empty((len(centers), self._imgH, self._imgW) + image.shape[2:], dtype=image.dtype)
+        for start in range(0, len(centers), chunk):
+            map_x, map_y = self._sample_maps(centers[start:start + chunk, 0], centers[start:start + chunk, 1])
+            for k in range(len(map_x)):
+                patches[start + k] = self._warp_image(map_x[k], map_y[k], image)
+        return patches
 
-    def _sample_points(self, x, y, border_only=False):
+    def _sample_maps(self, x, y):
+        """
+        float32 remap tables (N, imgH, imgW) for the centers (x, y), in the same
+        pixel convention as _sample_points; x is wrapped into [0, sphereW).
+        """
+        R = look_at_matrices(np.atleast_1d(x), np.atleast_1d(y), np.float32)
+        rays = self._rays.astype(np.float32).reshape(-1, 3)
+        angle_x, angle_y = rays_to_angles(rotate(rays, R))
+        map_x = np.mod((angle_x + np.pi) / (2*np.pi) * self.sphereW + 0.5, self.sphereW)
+        map_y = (np.pi/2 - angle_y) / np.pi * self.sphereH + 0.5
+        shape = (len(R), self._imgH, self._imgW)
+        return map_x.reshape(shape), map_y.reshape(shape)
+
+    def _sample_points(self, x, y, border_only=False, num_points=None):
         """
         Sample necessary points.
         x, y: the coordinate of the center point
+        num_points: perimeter point count when border_only (see _border_rays)
+        """
+        angle_x, angle_y = self._direct_camera(x, y, border_only, num_points)
+        return self._angles_to_pixels(angle_x, angle_y)
+
+    def _angles_to_pixels(self, angle_x, angle_y):
+        """
+        Spherical angles -> ERP sample coordinates (Px, Py).
         """
-        angle_x, angle_y = self._direct_camera(x, y, border_only)
         Px = (angle_x + np.pi) / (2*np.pi) * self.sphereW + 0.5
         Py = (np.pi/2 - angle_y) / np.pi * self.sphereH + 0.5
         INDx = Px < 1
         Px[INDx] += self.sphereW
         return Px, Py
 
-    def _direct_camera(self, rotate_x, rotate_y, border_only=False):
+    def _direct_camera(self, rotate_x, rotate_y, border_only=False, num_points=None):
         """
         rotate_x, rotate_y: the coordinate of the center point (FOV)
         """
         if border_only:
-            angle_y = np.hstack([self._ANGy[0, :], self._ANGy[-1, :],
-                                 self._ANGy[:, 0], self._ANGy[:, -1]]) + rotate_y
-            Z = np.hstack([self._Z[0, :], self._Z[-1, :],
-                           self._Z[:, 0], self._Z[:, -1]])
-            R = np.hstack([self._R[0, :], self._R[-1, :],
-                           self._R[:, 0], self._R[:, -1]])
+            rays = self._border_rays(num_points)
         else:
-            angle_y = self._ANGy + rotate_y
-            Z = self._Z
-            R = self._R
-
-        X = np.sin(angle_y) * R
-        Y = - np.cos(angle_y) * R
-
-        INDn = np.abs(angle_y) > np.pi/2
-
-        angle_x = np.arctan(Z / -Y)
-        RZY = np.linalg.norm(np.stack((Y, Z), axis=0), axis=0)
-        angle_y = np.arctan(X / RZY)
-
-        angle_x[INDn] += np.pi
-        angle_x += rotate_x
-
-        INDy = angle_y < -np.pi/2
-        angle_y[INDy] = -np.pi - angle_y[INDy]
-        angle_x[INDy] = angle_x[INDy] + np.pi
-
-        INDx = angle_x <= -np.pi
-        angle_x[INDx] += 2*np.pi
-        INDx = angle_x > np.pi
-        angle_x[INDx] -= 2*np.pi
-        return angle_x, angle_y
+            rays = self._rays
+        # the optical axis is pointed at (rotate_x, rotate_y)
+        xyz = rotate(rays, look_at_matrices(rotate_x, rotate_y))
+        return rays_to_angles(xyz)
 
     def _warp_image(self, Px, Py, frame):
-        minX = max(0, int(np.floor(Px.min())))
-        minY = max(0, int(np.floor(Py.min())))
-
-        maxX = min(int(self.sphereW), int(np.ceil(Px.max())))
-        maxY = min(int(self.sphereH), int(np.ceil(Py.max())))
-
-        im = frame[minY:maxY, minX:maxX, :]
-        Px -= minX
-        Py -= minY
-        warped_images = []
-
-        y_grid = np.arange(im.shape[0])
-        x_grid = np.arange(im.shape[1])
-        samples = np.vstack([Py.ravel(), Px.ravel()]).transpose()
-        for c in range(3):
-            full_image = interp2d((y_grid, x_grid), im[:, :, c],
-                                  bounds_error=False,
-                                  method='linear',
-                                  fill_value=None)
-            warped_image = full_image(samples).reshape(Px.shape)
-            warped_images.append(warped_image)
-        warped_image = np.stack(warped_images, axis=2)
-        return warped_image
+        """
+        Bilinear sampling of all channels at (Px, Py) in one cv2.remap pass.
+        Columns wrap across the ERP seam; rows are clamped at the poles.
+        """
+        map_x = np.asarray(Px, dtype=np.float32)
+        map_y = np.clip(np.asarray(Py, dtype=np.float32), 0, self.sphereH - 1)
+        return cv2.remap(frame, map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_WRAP)
 
     def draw_bbox(self, frame, Px, Py):
         '''
@@ -176,17 +389,34 @@ class ImageRecorder(object):
     def draw_Sphbbox(self, frame, Px, Py, border_only=False, color=(0, 0, 255), thickness=1):
         '''
         Draw a spherical bounding box on the spherical image in ERP format.
+        border_only: Px, Py is the closed border ring, drawn as a polyline;
+        otherwise every sample point of the dense grid is marked (i.e. the box is
+        filled) and grown by `thickness` pixels, wrapping across the seam.
         '''
         if border_only:
-            for j in range(Px.shape[0]):
-                cv2.circle(frame, (int(Px[j]), int(Py[j])), radius=thickness, color=color, thickness=-1)
-        else:
-            for i in range(Px.shape[0]):
-                for j in range(Px.shape[1]):
-                    cv2.circle(
-                        frame, (int(Px[i][j]), int(Py[i][j])), radius=thickness, color=color, thickness=-1)
+            return draw_spherical_outline(frame, Px, Py, color, 2 * thickness + 1)
+        H, W = frame.shape[:2]
+        cols = np.floor(Px).astype(np.int64).ravel() % W
+        rows = np.clip(np.floor(Py).astype(np.int64).ravel(), 0, H - 1)
+        # only the rows touched by the box (plus the dilation margin) are rasterized
+        top = max(0, int(rows.min()) - thickness)
+        bottom = min(H, int(rows.max()) + thickness + 1)
+        mask = np.zeros((bottom - top, W), dtype=np.uint8)
+        mask[rows - top, cols] = 1
+        if thickness > 0:
+            kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * thickness + 1, 2 * thickness + 1))
+            # wrap-padding the columns first lets the dilation spill across the seam
+            padded = np.pad(mask, ((0, 0), (thickness, thickness)), mode="wrap")
+            mask = cv2.dilate(padded, kernel)[:, thickness:thickness + W]
+        frame[top:bottom][mask.astype(bool)] = color
         return frame
 
+    def fill_Sphbbox(self, frame, Px, Py, color=(0, 0, 255)):
+        '''
+        Fill a spherical bounding box from its border ring (see _border_rays).
+        '''
+        return fill_spherical_box(frame, Px, Py, color)
+
     def boxinfo(self, Px, Py):
         '''
         Record bounding boxes information.
@@ -0,0 +1,188 @@
+"""
+标注边缘点阵的持久化格式与传输格式
+
+持久化: 点阵 (闭合环，首尾不重复) 以 float32 小端序 [x0, y0, x1, y1, ...] 存入 Annotation.boundary，
+boundary_key 记录生成时的几何参数摘要，参数不变时直接复用，不再重新计算
+
+传输 (按 Accept 协商，默认 JSON): 二进制容器，全部小端序
+    magic "PBND" | u8 版本 | u8 编码 (0: float32, 1: 量化差分) | u16 保留 | u32 meta 长度
+    meta: UTF-8 JSON，{"counts": [...], "widths": [...] (仅差分编码), "step": 量化步长 (仅差分编码), ...响应字段}
+    补齐到 4 字节后依次是各多边形的点阵:
+        float32: n 个 (x, y) float32
+        量化差分: 首点量化坐标 (int32 x, int32 y)，之后 n-1 个相邻点差值 (int16 或 int32，见 widths)，每个多边形补齐到 4 字节
+    坐标 = 量化值 * step
+"""
+import hashlib
+import heapq
+import json
+import struct
+
+import numpy as np
+from fastapi.encoders import jsonable_encoder
+
+from app.settings import settings
+
+BOUNDARY_DTYPE = np.dtype("<f4")
+# 点阵生成方式或随点阵一起保存的派生字段 (ERP 外接框) 变化时递增，使已保存的旧点阵在读取时重新计算
+BOUNDARY_VERSION = 3
+
+MEDIA_F32 = "application/x-boundary-f32"
+MEDIA_DELTA = "application/x-boundary-delta"
+WIRE_MAGIC = b"PBND"
+WIRE_VERSION = 1
+ENCODINGS = {MEDIA_F32: 0, MEDIA_DELTA: 1}
+_HEADER = struct.Struct("<4sBBHI")
+
+
+def boundary_key(W, H, center_theta, center_phi, fov_w, fov_h, gamma):
+    """影响点阵结果的全部参数 (含图片尺寸与采样点数) 的摘要"""
+    src = (f"v{BOUNDARY_VERSION}:{W}:{H}:{center_theta!r}:{center_phi!r}:{fov_w!r}:{fov_h!r}:{gamma!r}:"
+           f"{settings.ANNOTATION_BOUNDARY_POINTS}:{settings.RECORDER_FOV_QUANTUM!r}")
+    return hashlib.sha1(src.encode()).hexdigest()
+
+
+def annotation_key(anno, W, H):
+    return boundary_key(W, H, anno.center_theta, anno.center_phi, anno.fov_w, anno.fov_h, anno.gamma)
+
+
+def pack_boundary(points) -> bytes:
+    """(n, 2) 点阵 -> 紧凑 float32 字节"""
+    return np.ascontiguousarray(points, dtype=BOUNDARY_DTYPE).tobytes()
+
+
+def unpack_boundary(blob) -> np.ndarray:
+    """紧凑字节 -> (n, 2) float32 点阵 (只读视图，不复制)"""
+    if not blob:
+        return np.empty((0, 2), dtype=BOUNDARY_DTYPE)
+    return np.frombuffer(blob, dtype=BOUNDARY_DTYPE).reshape(-1, 2)
+
+
+def boundary_points(points):
+    """(n, 2) 点阵 -> 前端使用的 [{"x", "y"}] 列表"""
+    return [{"x": x, "y": y} for x, y in points.tolist()]
+
+
+def simplify_boundary(points, tolerance: float = 0.0, max_points: int = 0):
+    """
+    闭合点阵的 Douglas-Peucker 简化 (自顶向下按最大偏差优先细分)
+    tolerance: 允许的最大偏差 (像素)；max_points: 点数上限，0 表示不限
+    两者都为 0 时原样返回
+    """
+    n = len(points)
+    if n <= 3 or (tolerance <= 0 and max_points <= 0):
+        return points
+    limit = max(3, max_points) if max_points > 0 else n
+    pts = np.asarray(points, dtype=np.float64)
+
+    def farthest(i, j):
+        # 区间 (i, j) 内距线段 i-j 最远的点 (按线段而非直线计距离，投影落在线段外的点取到端点的距离)
+        if j - i < 2:
+            return -1.0, -1
+        a, b = pts[i], pts[j % n]
+        seg = pts[i + 1:j]
+        d = b - a
+        length2 = d[0] * d[0] + d[1] * d[1]
+        t = np.clip((seg - a) @ d / length2, 0.0, 1.0) if length2 > 0 else np.zeros(len(seg))
+        diff = seg - (a + t[:, None] * d)
+        dist = np.hypot(diff[:, 0], diff[:, 1])
+        k = int(np.argmax(dist))
+        return float(dist[k]), i + 1 + k
+
+    # 闭合环先以 0 与 n/2 两点为锚，分成两段开放折线 (第二段终点回到 0)
+    keep = {0, n // 2}
+    heap = []
+    for i, j in ((0, n // 2), (n // 2, n)):
+        dist, k = farthest(i, j)
+        if k >= 0:
+            heapq.heappush(heap, (-dist, i, j, k))
+    while heap and len(keep) < limit:
+        neg_dist, i, j, k = heapq.heappop(heap)
+        if -neg_dist <= tolerance:
+            break
+        keep.add(k)
+        for a, b in ((i, k), (k, j)):
+            dist, m = farthest(a, b)
+            if m >= 0:
+                heapq.heappush(heap, (-dist, a, b, m))
+    return points[sorted(keep)]
+
+
+def negotiate(accept: str = None):
+    """
+    Accept 头 -> 二进制媒体类型，未请求二进制格式时返回 None (使用 JSON)
+    按 q 值选择 (q=0 表示不接受)，q 相同时取先出现的；application/json 的 q 更高时仍使用 JSON
+    """
+    best, best_q = None, 0.0
+    for part in (accept or "").split(","):
+        media, *params = [item.strip().lower() for item in part.split(";")]
+        if media not in ENCODINGS and media != "application/json":
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > best_q:
+            best, best_q = (media if media in ENCODINGS else None), q
+    return best
+
+
+def encode_polygons(meta: dict, polygons, media: str, step: float = None) -> bytes:
+    """
+    按传输格式编码: meta 为 JSON 可序列化的响应字段，polygons 为 (n, 2) 点阵列表
+    """
+    encoding = ENCODINGS[media]
+    meta = dict(jsonable_encoder(meta), counts=[len(p) for p in polygons])
+    chunks = []
+    if encoding == 0:
+        chunks = [np.ascontiguousarray(p, dtype=BOUNDARY_DTYPE).tobytes() for p in polygons]
+    else:
+        step = step or settings.ANNOTATION_WIRE_STEP
+        meta["step"] = step
+        widths = []
+        for p in polygons:
+            q = np.rint(np.asarray(p, dtype=np.float64) / step).astype(np.int64)
+            if len(q) == 0:
+                widths.append(0)
+                continue
+            deltas = np.diff(q, axis=0)
+            # 跨越经度接缝或相对两边之间的跳变可能超出 int16，该多边形改用 int32
+            width = 2 if deltas.size == 0 or np.abs(deltas).max() <= 32767 else 4
+            widths.append(width)
+            body = q[0].astype("<i4").tobytes() + deltas.astype("<i2" if width == 2 else "<i4").tobytes()
+            chunks.append(body + b"\0" * (-len(body) % 4))
+        meta["widths"] = widths
+    meta_bytes = json.dumps(meta, ensure_ascii=False, separators=(",", ":")).encode()
+    meta_bytes += b" " * (-(_HEADER.size + len(meta_bytes)) % 4)
+    header = _HEADER.pack(WIRE_MAGIC, WIRE_VERSION, encoding, 0, len(meta_bytes))
+    return b"".join([header, meta_bytes] + chunks)
+
+
+def decode_polygons(data: bytes):
+    """encode_polygons 的逆过程 (参考实现)，返回 (meta, polygons)"""
+    magic, version, encoding, _, meta_len = _HEADER.unpack_from(data)
+    if magic != WIRE_MAGIC or version != WIRE_VERSION:
+        raise ValueError("not a boundary container")
+    offset = _HEADER.size + meta_len
+    meta = json.loads(data[_HEADER.size:offset])
+    polygons = []
+    for k, n in enumerate(meta["counts"]):
+        if encoding == 0:
+            polygons.append(np.frombuffer(data, dtype=BOUNDARY_DTYPE, count=2 * n, offset=offset).reshape(-1, 2))
+            offset += 8 * n
+            continue
+        if n == 0:
+            polygons.append(np.empty((0, 2), dtype=BOUNDARY_DTYPE))
+            continue
+        width = meta["widths"][k]
+        first = np.frombuffer(data, dtype="<i4", count=2, offset=offset).astype(np.int64)
+        deltas = np.frombuffer(data, dtype="<i2" if width == 2 else "<i4", count=2 * (n - 1),
+                               offset=offset + 8).reshape(-1, 2)
+        size = 8 + width * 2 * (n - 1)
+        offset += size + (-size % 4)
+        q = np.vstack([first, first + np.cumsum(deltas, axis=0)])
+        polygons.append((q * meta["step"]).astype(BOUNDARY_DTYPE))
+    return meta, polygons
@@ -0,0 +1,267 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from starlette.concurrency import run_in_threadpool
+
+from app.log import logger
+from app.settings import settings
+
+
+class MemoryBackend:
+    """进程内 LRU，按字节预算淘汰"""
+
+    blocking = False
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[key] = value
+            self._bytes += len(value)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def delete_prefix(self, prefix: str):
+        with self._lock:
+            for key in [k for k in self._entries if k.startswith(prefix)]:
+                self._bytes -= len(self._entries.pop(key))
+
+    def stats(self):
+        return {"entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+
+class DiskBackend:
+    """
+    磁盘存储，目录结构为 {root}/{image_id}/{key_hash}，总大小超过上限时按最近访问时间淘汰
+    同一台机器上的多个 uvicorn worker 可以共享
+    """
+
+    blocking = True
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._bytes = sum(entry[2] for entry in self._scan())
+
+    def _path(self, key):
+        # key 形如 crop:{image_id}:{...}，按图片分目录便于整体失效
+        image_dir = key.split(":")[1]
+        return os.path.join(self.root, image_dir, hashlib.sha1(key.encode()).hexdigest())
+
+    def _scan(self):
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, path, st.st_size))
+        return entries
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = f.read()
+        except OSError:
+            return None
+        # 以 mtime 记录最近访问时间，供淘汰使用
+        os.utime(path, None)
+        return value
+
+    def set(self, key, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(value)
+        # 覆盖已有 key 时扣除旧文件大小，避免计数虚高导致过早淘汰
+        try:
+            old_size = os.path.getsize(path)
+        except OSError:
+            old_size = 0
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._bytes += len(value) - old_size
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted(self._scan())
+        self._bytes = sum(entry[2] for entry in entries)
+        # 淘汰到上限的 90%，避免每次写入都触发全量扫描
+        target = self.max_bytes * 0.9
+        for _, path, size in entries:
+            if self._bytes <= target:
+                break
+            try:
+                os.remove(path)
+                self._bytes -= size
+            except OSError:
+                pass
+
+    def delete_prefix(self, prefix: str):
+        image_dir = os.path.join(self.root, prefix.split(":")[1])
+        if not os.path.isdir(image_dir):
+            return
+        for name in os.listdir(image_dir):
+            path = os.path.join(image_dir, name)
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+                with self._lock:
+                    self._bytes -= size
+            except OSError:
+                pass
+
+    def stats(self):
+        return {"bytes": self._bytes, "max_bytes": self.max_bytes, "root": self.root}
+
+
+class RedisBackend:
+    """
+    Redis 兼容存储，多个 worker / 节点共享命中
+    client 可传入任意实现了 get / set / scan_iter / delete 的 Redis 兼容客户端
+    """
+
+    blocking = True
+
+    def __init__(self, url: str = None, ttl: int = 0, client=None):
+        if client is None:
+            import redis
+
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.ttl = ttl
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value: bytes):
+        self.client.set(key, value, ex=self.ttl or None)
+
+    def delete_prefix(self, prefix: str):
+        keys = list(self.client.scan_iter(match=f"{prefix}*"))
+        if keys:
+            self.client.delete(*keys)
+
+    def stats(self):
+        return {"ttl": self.ttl}
+
+
+class CropCache:
+    """
+    已编码切片结果缓存，key 由 (图片内容哈希, 量化视角, 输出尺寸, 格式) 决定
+    图片被替换后内容哈希变化，旧条目不会再被命中；删除 / 替换时按图片前缀整体清理
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @staticmethod
+    def make_key(image_id: int, content_hash: str, theta, phi, fov, w, h, fmt, quality, mode="erp"):
+        return f"crop:{image_id}:{content_hash}:{theta}:{phi}:{fov}:{w}x{h}:{fmt}:{quality}:{mode}"
+
+    @staticmethod
+    def make_preview_key(image_id: int, content_hash: str, digest: str, w, fmt, quality):
+        """标注预览图的 key，digest 为标注 (含标签颜色) 的摘要，标注变化后旧条目自然失效"""
+        return f"crop:{image_id}:{content_hash}:preview:{digest}:{w}:{fmt}:{quality}"
+
+    async def _call(self, func, *args):
+        if self.backend.blocking:
+            return await run_in_threadpool(func, *args)
+        return func(*args)
+
+    async def get(self, key, record: bool = True):
+        """record=False 时不计入命中率统计 (供预取探测使用)"""
+        if self.backend is None:
+            return None
+        try:
+            value = await self._call(self.backend.get, key)
+        except Exception as e:
+            # 缓存不可用时降级为直接渲染
+            self.errors += 1
+            logger.warning(f"crop cache get failed: {e}")
+            return None
+        if not record:
+            return value
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key, value: bytes):
+        if self.backend is None:
+            return
+        try:
+            await self._call(self.backend.set, key, value)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"crop cache set failed: {e}")
+
+    async def invalidate(self, image_id: int):
+        if self.backend is None:
+            return
+        try:
+            await self._call(self.backend.delete_prefix, f"crop:{image_id}:")
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"crop cache invalidate failed: {e}")
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__ if self.backend else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_rate": self.hits / total if total else 0.0,
+            **(self.backend.stats() if self.backend else {}),
+        }
+
+
+def create_backend(name: str):
+    if name == "memory":
+        return MemoryBackend(settings.CROP_CACHE_MAX_BYTES)
+    if name == "disk":
+        return DiskBackend(settings.CROP_CACHE_DIR, settings.CROP_CACHE_MAX_BYTES)
+    if name == "redis":
+        try:
+            return RedisBackend(settings.CROP_CACHE_REDIS_URL, ttl=settings.CROP_CACHE_TTL)
+        except ImportError:
+            # redis 为可选依赖，未安装时降级为进程内缓存，不影响启动
+            logger.warning("crop cache backend 'redis' requires the redis package, falling back to memory")
+            return MemoryBackend(settings.CROP_CACHE_MAX_BYTES)
+    return None
+
+
+crop_cache = CropCache(create_backend(settings.CROP_CACHE_BACKEND))
@@ -0,0 +1,174 @@
+import os
+
+import cv2
+import numpy as np
+
+from app.geometry import rays_to_erp, rotate, rotation_matrices
+from app.settings import settings
+from app.utils.image_cache import pano_cache
+from app.utils.projection import projector
+
+# 六个面的 (前向 f, 右向 r, 上向 u) 基向量，面内方向 = f + a*r + b*u, a/b ∈ [-1, 1]
+# 坐标系与透视切片一致: x 右, y 上, z 前, theta = atan2(x, z), phi = asin(y)
+CUBE_FACES = ("F", "R", "B", "L", "U", "D")
+CUBE_BASES = np.array([
+    [[0, 0, 1], [1, 0, 0], [0, 1, 0]],
+    [[1, 0, 0], [0, 0, -1], [0, 1, 0]],
+    [[0, 0, -1], [-1, 0, 0], [0, 1, 0]],
+    [[-1, 0, 0], [0, 0, 1], [0, 1, 0]],
+    [[0, 1, 0], [1, 0, 0], [0, 0, -1]],
+    [[0, -1, 0], [1, 0, 0], [0, 0, 1]],
+], dtype=np.float32)
+# (主轴, 是否为正方向) -> 面索引
+_AXIS_TO_FACE = np.array([[3, 1], [5, 4], [2, 0]])
+
+
+def build_cubemap(file_path: str, img=None, face_size: int = None):
+    """
+    由 ERP 生成立方体贴图，六个面分别存为 {stem}_cube_{F|R|B|L|U|D}.jpg
+    face_size 默认取 ERP 宽度的 1/4，与赤道处的角分辨率一致
+    """
+    if img is None:
+        img = cv2.imread(file_path)
+    if img is None:
+        return None
+    H, W = img.shape[:2]
+    size = face_size or settings.PANO_CUBEMAP_FACE_SIZE or W // 4
+
+    # 面内像素中心 -> [-1, 1]
+    coords = (np.arange(size, dtype=np.float32) + 0.5) / size * 2 - 1
+    a, b = np.meshgrid(coords, -coords)
+    stem, _ = os.path.splitext(file_path)
+    encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), settings.PANO_PYRAMID_QUALITY]
+    faces = {}
+    for name, (f, r, u) in zip(CUBE_FACES, CUBE_BASES):
+        d = f + a[..., None] * r + b[..., None] * u
+        d /= np.linalg.norm(d, axis=-1, keepdims=True)
+        map_x, map_y = rays_to_erp(d, W, H)
+        face = cv2.remap(img, map_x, map_y, interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_WRAP)
+        face_path = f"{stem}_cube_{name}.jpg"
+        cv2.imwrite(face_path, face, encode_params)
+        faces[name] = face_path
+    return {"size": size, "faces": faces}
+
+
+def rays_to_faces(xyz):
+    """
+    世界坐标射线 (N, 3) -> 所属面索引 (N,)
+    """
+    axis = np.argmax(np.abs(xyz), axis=1)
+    positive = np.take_along_axis(xyz, axis[:, None], axis=1)[:, 0] > 0
+    return _AXIS_TO_FACE[axis, positive.astype(np.intp)]
+
+
+def face_maps(xyz, idx, size):
+    """
+    计算射线在第 idx 个面上的 remap 坐标，以及落在该面上的掩码
+    """
+    proj = xyz @ CUBE_BASES[idx].T
+    t, dr, du = proj[:, 0], proj[:, 1], proj[:, 2]
+    mask = (t > 0) & (np.abs(dr) <= t) & (np.abs(du) <= t)
+    half = np.float32(size / 2)
+    # 不在该面上的射线 t 可能为 0，其坐标会被掩码丢弃
+    with np.errstate(divide="ignore", invalid="ignore"):
+        inv_t = half / t
+        col = dr * inv_t + (half - 0.5)
+        row = (half - 0.5) - du * inv_t
+    return col, row, mask
+
+
+def render_from_cubemap(image_id: int, cubemap: dict, theta, phi, fov, out_w, out_h):
+    """
+    从立方体贴图渲染透视切片，只解码 / 缓存视锥实际覆盖到的面
+    """
+    rays = projector.ray_bundle(fov, out_w, out_h)
+    xyz = rotate(rays, rotation_matrices(theta, phi, np.float32))
+    size = cubemap["size"]
+
+    # 先在稀疏网格 (含四条边) 上判断视锥覆盖到哪些面，未覆盖完全时再补齐其余面
+    grid = xyz.reshape(out_h, out_w, 3)
+    probe = np.concatenate([grid[::8, ::8].reshape(-1, 3), grid[-1].reshape(-1, 3), grid[:, -1].reshape(-1, 3)])
+    touched = list(np.unique(rays_to_faces(probe)))
+    faces = touched + [idx for idx in range(len(CUBE_FACES)) if idx not in touched]
+
+    out = None
+    covered = np.zeros(out_h * out_w, dtype=bool)
+    for n, idx in enumerate(faces):
+        if n >= len(touched) and covered.all():
+            break
+        col, row, mask = face_maps(xyz, idx, size)
+        if not mask.any():
+            continue
+        face_img = pano_cache.load(image_id, cubemap["faces"][CUBE_FACES[idx]])
+        if face_img is None:
+            return None
+        if out is None:
+            out = np.zeros((out_h, out_w) + face_img.shape[2:], dtype=face_img.dtype)
+        # 只在该面覆盖到的行区间内重映射
+        mask2d = mask.reshape(out_h, out_w)
+        rows = np.flatnonzero(mask2d.any(axis=1))
+        r0, r1 = rows[0], rows[-1] + 1
+        sampled = cv2.remap(face_img, col.reshape(out_h, out_w)[r0:r1], row.reshape(out_h, out_w)[r0:r1],
+                            interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+        np.copyto(out[r0:r1], sampled, where=mask2d[r0:r1].reshape((r1 - r0, out_w) + (1,) * (out.ndim - 2)))
+        covered |= mask
+    return out
+
+
+def remove_cubemap(cubemap):
+    for path in (cubemap or {}).get("faces", {}).values():
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def benchmark(file_path: str, repeat: int = 10):
+    """
+    对比 ERP 与立方体贴图两种采样路径在典型标注视角下的耗时与常驻内存
+    用法: python -m app.utils.cubemap <erp.jpg>
+    """
+    import tempfile
+    import time
+
+    img = cv2.imread(file_path)
+    if img is None:
+        raise SystemExit(f"无法解码: {file_path}")
+    views = [(0.0, 0.0, 90), (1.2, 0.3, 60), (-2.5, -0.4, 90), (0.7, 1.3, 90), (2.0, -1.45, 75), (3.1, 0.0, 30)]
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_path = os.path.join(tmp, "pano.jpg")
+        cv2.imwrite(tmp_path, img)
+        cubemap = build_cubemap(tmp_path, img)
+        print(f"ERP {img.shape[1]}x{img.shape[0]}, face {cubemap['size']}px")
+        for theta, phi, fov in views:
+            pano_cache.clear()
+            t0 = time.perf_counter()
+            erp = pano_cache.load(-1, tmp_path)
+            projector.render(erp, theta, phi, fov, 512, 512)
+            erp_cold = time.perf_counter() - t0
+            erp_bytes = pano_cache.stats()["bytes"]
+            t0 = time.perf_counter()
+            for _ in range(repeat):
+                projector.render(erp, theta, phi, fov, 512, 512)
+            erp_warm = (time.perf_counter() - t0) / repeat
+
+            pano_cache.clear()
+            t0 = time.perf_counter()
+            render_from_cubemap(-1, cubemap, theta, phi, fov, 512, 512)
+            cube_cold = time.perf_counter() - t0
+            cube_bytes = pano_cache.stats()["bytes"]
+            t0 = time.perf_counter()
+            for _ in range(repeat):
+                render_from_cubemap(-1, cubemap, theta, phi, fov, 512, 512)
+            cube_warm = (time.perf_counter() - t0) / repeat
+
+            print(
+                f"theta={theta:+.2f} phi={phi:+.2f} fov={fov:3d} | "
+                f"erp cold {erp_cold * 1000:7.1f}ms warm {erp_warm * 1000:6.1f}ms {erp_bytes / 2 ** 20:7.1f}MB | "
+                f"cube cold {cube_cold * 1000:7.1f}ms warm {cube_warm * 1000:6.1f}ms {cube_bytes / 2 ** 20:7.1f}MB"
+            )
+    pano_cache.clear()
+
+
+if __name__ == "__main__":
+    import sys
+
+    benchmark(sys.argv[1])
@@ -0,0 +1,114 @@
+import os
+import threading
+from collections import OrderedDict
+
+import cv2
+
+from app.settings import settings
+
+
+class PanoramaCache:
+    """
+    已解码全景图的进程内 LRU 缓存
+    key 为 (image_id, 文件路径, 文件 mtime)，同一图片的各金字塔层级分别缓存；
+    文件被替换后 mtime 变化，旧条目自然失效
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            img = self._entries.get(key)
+            if img is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return img
+
+    def put(self, key, img):
+        # 缓存中的数组被多个请求共享，禁止原地修改
+        img.flags.writeable = False
+        size = img.nbytes
+        if size > self.max_bytes:
+            return img
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            self._entries[key] = img
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.evictions += 1
+        return img
+
+    def invalidate(self, image_id: int):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == image_id]:
+                self._bytes -= self._entries.pop(key).nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def load(self, image_id: int, file_path: str):
+        """
+        读取全景图，命中缓存则直接返回共享的只读数组
+        文件不存在返回 None，解码失败同样返回 None
+        """
+        try:
+            mtime = os.path.getmtime(file_path)
+        except OSError:
+            return None
+        key = (image_id, file_path, mtime)
+        img = self.get(key)
+        if img is not None:
+            return img
+        img = cv2.imread(file_path)
+        if img is None:
+            return None
+        return self.put(key, img)
+
+    def load_reduced(self, image_id: int, file_path: str, factor: int):
+        """
+        以 1/factor 分辨率解码 (JPEG 可直接在 DCT 域缩小，比完整解码快得多)，factor 取 2 / 4 / 8
+        """
+        try:
+            mtime = os.path.getmtime(file_path)
+        except OSError:
+            return None
+        key = (image_id, file_path, mtime, factor)
+        img = self.get(key)
+        if img is not None:
+            return img
+        flags = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+        img = cv2.imread(file_path, flags[factor])
+        if img is None:
+            return None
+        return self.put(key, img)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+pano_cache = PanoramaCache(settings.PANO_CACHE_MAX_BYTES)
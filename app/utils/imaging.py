@@ -0,0 +1,273 @@
+"""
+在图像执行器 (app.core.executor) 中运行的同步任务
+任务只接收 id / 文件路径 / 标量参数，返回字节或普通 Python 对象，线程池与进程池模式均可使用
+"""
+import hashlib
+import os
+
+import cv2
+import numpy as np
+
+from app.geometry import look_at_matrices, overlapping_pairs, rays_to_angles, roll_matrices, rotate, spherical_nms
+from app.settings import settings
+from app.utils.ImageRecorder import ImageRecorder, draw_spherical_outline, fill_spherical_box
+from app.utils.cubemap import build_cubemap, remove_cubemap, render_from_cubemap
+from app.utils.image_cache import pano_cache
+from app.utils.projection import projector
+from app.utils.pyramid import build_pyramid, remove_pyramid, select_level
+from app.utils.tiles import build_tiles, remove_tiles, render_from_tiles
+
+# 切片输出格式: fmt -> (扩展名, MIME, 质量参数)
+VIEW_FORMATS = {
+    "jpg": (".jpg", "image/jpeg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", "image/webp", cv2.IMWRITE_WEBP_QUALITY),
+}
+
+
+def panorama_source(img_obj):
+    """
+    从 Image360 记录中提取渲染所需的可 pickle 描述，作为各渲染任务的入参
+    """
+    return {
+        "image_id": img_obj.id,
+        "file_path": img_obj.file_path,
+        "pyramid": img_obj.pyramid,
+        "cubemap": img_obj.cubemap,
+        "tiles": img_obj.tiles,
+    }
+
+
+def prepare_upload(file_path: str):
+    """
+    解码一次上传文件，生成各衍生文件，返回 Image360 的对应字段；无法解码时各字段均为 None
+    """
+    img = cv2.imread(file_path)
+    if img is None:
+        return {"width": None, "height": None, "pyramid": None, "cubemap": None, "tiles": None}
+    h, w = img.shape[:2]
+    return {
+        "width": w,
+        "height": h,
+        "pyramid": build_pyramid(file_path, img),
+        "cubemap": build_cubemap(file_path, img) if settings.PANO_CUBEMAP_ON_UPLOAD else None,
+        "tiles": build_tiles(file_path, img) if settings.PANO_TILES_ON_UPLOAD else None,
+    }
+
+
+def generate_cubemap(file_path: str):
+    return build_cubemap(file_path)
+
+
+def remove_derivatives(source):
+    """删除原图及其金字塔 / 立方体贴图衍生文件"""
+    remove_pyramid(source.get("pyramid"))
+    remove_cubemap(source.get("cubemap"))
+    remove_tiles(source.get("tiles"))
+    if os.path.exists(source["file_path"]):
+        os.remove(source["file_path"])
+
+
+def file_sha256(file_path: str, chunk_size: int = 1024 * 1024):
+    """文件内容的 SHA256 (分块读取)"""
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def panorama_size(image_id: int, file_path: str):
+    img = pano_cache.load(image_id, file_path)
+    if img is None:
+        return None
+    h, w = img.shape[:2]
+    return w, h
+
+
+def load_for_view(source, fov, out_w):
+    """
+    按视场角与输出尺寸选择满足分辨率要求的最粗金字塔层级并解码 (走缓存)
+    """
+    file_path = source["file_path"]
+    level = select_level(source.get("pyramid"), fov, out_w)
+    if level is not None and os.path.exists(level["file_path"]):
+        file_path = level["file_path"]
+    return pano_cache.load(source["image_id"], file_path)
+
+
+def render_view(source, theta, phi, fov, out_w, out_h, mode="erp"):
+    """
+    渲染透视切片像素，mode="cube" 且已生成立方体贴图时只采样视锥覆盖的面；
+    ERP 模式下若已生成分块文件，全分辨率请求只读取覆盖到的分块
+    """
+    if mode == "cube" and source.get("cubemap"):
+        return render_from_cubemap(source["image_id"], source["cubemap"], theta, phi, fov, out_w, out_h)
+    # 需要全分辨率且有分块文件时，只读取视锥覆盖的分块，不解码整张原图
+    tiles = source.get("tiles")
+    level = select_level(source.get("pyramid"), fov, out_w)
+    if tiles and (level is None or level["level"] == 0) and os.path.exists(tiles["file_path"]):
+        return render_from_tiles(tiles, theta, phi, fov, out_w, out_h)
+    img = load_for_view(source, fov, out_w)
+    if img is None:
+        return None
+    return projector.render(img, theta, phi, fov, out_w, out_h)
+
+
+def render_perspective(source, theta, phi, fov, out_w, out_h, ext=".jpg", params=None, mode="erp"):
+    """
+    解码 (走缓存) + 透视重映射 + 编码，返回编码后的字节；解码或编码失败返回 None
+    """
+    perspective_img = render_view(source, theta, phi, fov, out_w, out_h, mode)
+    if perspective_img is None:
+        return None
+    ok, buffer = cv2.imencode(ext, perspective_img, params or [])
+    if not ok:
+        return None
+    return buffer.tobytes()
+
+
+def encode_view(img, theta, phi, fov, out_w, out_h, ext=".jpg", params=None):
+    """
+    对已解码 (常驻) 的全景图渲染并编码，仅用于线程池模式下的会话渲染
+    """
+    ok, buffer = cv2.imencode(ext, projector.render(img, theta, phi, fov, out_w, out_h), params or [])
+    return buffer.tobytes() if ok else None
+
+
+def render_preview(source, theta, phi, fov, out_w, out_h, ext=".jpg", params=None):
+    """
+    渐进式切片的快速预览: 从最粗的金字塔层级 (没有金字塔时对原图做缩小解码) 以 1/scale 尺寸渲染，
+    再用最近邻放大回输出尺寸，保证与完整结果的像素坐标一致
+    """
+    levels = source.get("pyramid") or []
+    if len(levels) > 1:
+        coarsest = min(levels, key=lambda lv: lv["width"])
+        img = pano_cache.load(source["image_id"], coarsest["file_path"])
+    else:
+        img = pano_cache.load_reduced(source["image_id"], source["file_path"], settings.PROGRESSIVE_DECODE_REDUCTION)
+    if img is None:
+        return None
+    scale = settings.PROGRESSIVE_PREVIEW_SCALE
+    small = projector.render(img, theta, phi, fov, max(1, out_w // scale), max(1, out_h // scale))
+    preview = cv2.resize(small, (out_w, out_h), interpolation=cv2.INTER_NEAREST)
+    ok, buffer = cv2.imencode(ext, preview, params or [])
+    return buffer.tobytes() if ok else None
+
+
+def render_perspective_batch(source, views, ext=".jpg", params=None):
+    """
+    同一张全景图的多视角批量渲染：只解码一次 (取所有视角中要求最高的金字塔层级)，
+    remap 表按像素预算分块向量化生成，每个视角渲染后立即编码，返回与 views 一一对应的编码字节列表
+    """
+    level_source = max(views, key=lambda v: 0.5 * v[3] / np.tan(0.5 * np.radians(v[2])))
+    img = load_for_view(source, level_source[2], level_source[3])
+    if img is None:
+        return None
+    outputs = [None] * len(views)
+    for i, perspective_img in projector.render_batch(img, views):
+        ok, buffer = cv2.imencode(ext, perspective_img, params or [])
+        if not ok:
+            return None
+        outputs[i] = buffer.tobytes()
+    return outputs
+
+
+def annotation_boundary(W, H, center_theta, center_phi, fov_w, fov_h, gamma=0.0):
+    """
+    生成球面框在 ERP 上的边缘点阵 (float32, 形状 (n, 2))，供前端 SVG <polygon> 绘制
+    """
+    return annotation_boundaries(W, H, [center_theta], [center_phi], [fov_w], [fov_h], [gamma])[0]
+
+
+def annotation_boundaries(W, H, center_theta, center_phi, fov_w, fov_h, gamma=None):
+    """
+    批量生成 N 个球面框的边缘点阵: 各框的边缘射线 (按量化 FOV 缓存) 拼接后一次性旋转、转换到 ERP 坐标
+    参数为长度 N 的序列 (gamma 为框绕自身中心的旋转，弧度)，返回 N 个 float32 (n, 2) 数组
+    """
+    if len(fov_w) == 0:
+        return []
+    num_points = settings.ANNOTATION_BOUNDARY_POINTS or None
+    recorders = [ImageRecorder(W, H, view_angle_w=fw, view_angle_h=fh, long_side=max(W, H))
+                 for fw, fh in zip(fov_w, fov_h)]
+    # 只解析计算四条边上的射线，不构建整个视场网格
+    rays = [recorder._border_rays(num_points) for recorder in recorders]
+    offsets = np.cumsum([0] + [len(r) for r in rays])
+    # 先绕光轴转 gamma，再把光轴指向各框中心；逐框旋转写入同一缓冲区，之后的角度 / 像素换算对全部点一次完成
+    R = look_at_matrices(np.asarray(center_theta, dtype=np.float64), np.asarray(center_phi, dtype=np.float64))
+    if gamma is not None:
+        R = np.matmul(R, roll_matrices(gamma))
+    xyz = np.empty((offsets[-1], 3))
+    for k, r in enumerate(rays):
+        xyz[offsets[k]:offsets[k + 1]] = rotate(r, R[k])
+    Px, Py = recorders[0]._angles_to_pixels(*rays_to_angles(xyz))
+
+    points = np.stack([Px, Py], axis=-1).astype(np.float32)
+    boundaries = []
+    for chunk in np.split(points, offsets[1:-1]):
+        # 过滤掉无穷大或非法的点
+        boundaries.append(chunk[~np.isnan(chunk).any(axis=1)])
+    return boundaries
+
+
+def annotation_overlaps(boxes, threshold):
+    """
+    同一图片标注的重叠检测: boxes 为 (N, 5) 球面框 (按保存顺序)，
+    返回交并比 >= threshold 的下标对 [(i, j, iou)]，以及按保存顺序 (先保存的优先) 做球面 NMS 时被抑制的下标
+    """
+    pairs = overlapping_pairs(boxes, threshold)
+    keep = spherical_nms(boxes, threshold=threshold, pairs=pairs)
+    suppressed = np.setdiff1d(np.arange(len(boxes)), keep)
+    return list(zip(*(p.tolist() for p in pairs))), suppressed.tolist()
+
+
+def hex_to_bgr(color: str, default=(88, 160, 24)):
+    """"#RRGGBB" / "#RGB" -> OpenCV 的 (B, G, R)，无法解析时返回 default (标签默认色 #18a058)"""
+    value = (color or "").strip().lstrip("#")
+    if len(value) == 3:
+        value = "".join(c * 2 for c in value)
+    try:
+        r, g, b = (int(value[i:i + 2], 16) for i in (0, 2, 4))
+    except ValueError:
+        return default
+    return b, g, r
+
+
+def load_for_width(source, width: int, full_w: int):
+    """
+    解码宽度不小于 width 的最小版本 (走缓存): 金字塔层级，没有金字塔时对原图做缩小解码
+    """
+    levels = [lv for lv in source.get("pyramid") or [] if lv["width"] >= width and os.path.exists(lv["file_path"])]
+    if levels:
+        level = min(levels, key=lambda lv: lv["width"])
+        return pano_cache.load(source["image_id"], level["file_path"])
+    for factor in (8, 4, 2):
+        if full_w // factor >= width:
+            return pano_cache.load_reduced(source["image_id"], source["file_path"], factor)
+    return pano_cache.load(source["image_id"], source["file_path"])
+
+
+def render_annotation_preview(source, width, full_w, polygons, colors, ext=".jpg", params=None):
+    """
+    缩小的整幅全景图 + 标注叠加: 半透明填充 + 描边，跨越经度接缝的标注在左右两侧分别绘制
+    polygons 为原图像素坐标下的闭合边缘点阵 (n, 2)，full_w 为原图宽度，colors 为对应的 (B, G, R)
+    """
+    img = load_for_width(source, width, full_w)
+    if img is None:
+        return None
+    h, w = img.shape[:2]
+    height = max(1, int(round(width * h / w)))
+    img = cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA) if w != width else img.copy()
+    scale = width / full_w
+    # 点阵坐标按宽度等比缩放 (ERP 宽高比固定为 2:1，纵向同一比例)
+    scaled = [np.asarray(p, dtype=np.float64) * scale for p in polygons]
+    overlay = img.copy()
+    for points, color in zip(scaled, colors):
+        if len(points):
+            fill_spherical_box(overlay, points[:, 0], points[:, 1], color)
+    alpha = settings.ANNOTATION_PREVIEW_FILL_ALPHA
+    img = cv2.addWeighted(overlay, alpha, img, 1 - alpha, 0)
+    for points, color in zip(scaled, colors):
+        if len(points):
+            draw_spherical_outline(img, points[:, 0], points[:, 1], color, settings.ANNOTATION_PREVIEW_LINE)
+    ok, buffer = cv2.imencode(ext, img, params or [])
+    return buffer.tobytes() if ok else None
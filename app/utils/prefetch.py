@@ -0,0 +1,191 @@
+import asyncio
+import math
+from collections import OrderedDict
+
+from app.core import render_service
+from app.core.executor import imaging_executor
+from app.log import logger
+from app.settings import settings
+from app.utils.crop_cache import crop_cache
+from app.utils.imaging import VIEW_FORMATS
+from app.utils.projection import quantize_view
+
+
+class ViewPrefetcher:
+    """
+    邻近视角预取: 每次切片请求后，在执行器空闲时按 ±偏航 / ±俯仰 / ±视场角 的顺序
+    推测渲染相邻视角并写入切片结果缓存
+    每张图片同时只保留一个预取任务，新请求到达时取消旧任务；缓存命中且位姿与上次相同时不重复预取
+    预取结果的 key 会被记录，之后被真实请求命中时计入 hits，用于判断预取是否值得
+    """
+
+    def __init__(self, yaw_step, pitch_step, fov_step, max_images: int, track_size: int, enabled: bool = True):
+        self.enabled = enabled
+        self.yaw_step = math.radians(yaw_step)
+        self.pitch_step = math.radians(pitch_step)
+        self.fov_step = fov_step
+        self.max_images = max_images
+        self.track_size = track_size
+        self._tasks: OrderedDict = OrderedDict()
+        self._prefetched: OrderedDict = OrderedDict()
+        # 每张图片最近一次登记预取的位姿，缓存命中且位姿未变时不重新调度
+        self._last_pose: OrderedDict = OrderedDict()
+        # 每张图片的取消代数: cancel_image 时递增，预取任务在渲染前与写缓存前比对，已取消的结果不写入缓存
+        self._generation = {}
+        self.scheduled = 0
+        self.rendered = 0
+        self.already_cached = 0
+        self.skipped_busy = 0
+        self.skipped_repeat = 0
+        self.cancelled = 0
+        self.failed = 0
+        self.hits = 0
+        self.expired = 0
+        self.render_time = 0.0
+
+    def neighbors(self, theta, phi, fov):
+        """按优先级返回相邻视角 (已量化、去重，不含自身)"""
+        candidates = [
+            (theta + self.yaw_step, phi, fov),
+            (theta - self.yaw_step, phi, fov),
+            (theta, phi + self.pitch_step, fov),
+            (theta, phi - self.pitch_step, fov),
+            (theta, phi, fov - self.fov_step),
+            (theta, phi, fov + self.fov_step),
+        ]
+        origin = quantize_view(theta, phi, fov)
+        views = []
+        for c_theta, c_phi, c_fov in candidates:
+            if not 0 < c_fov < 180:
+                continue
+            view = quantize_view(c_theta, c_phi, c_fov)
+            # 靠近极点时俯仰被截断，可能与自身或已有视角重合
+            if view != origin and view not in views:
+                views.append(view)
+        return views
+
+    def schedule(self, source, content_hash: str, theta, phi, fov, w, h, fmt, quality, mode="erp", hit=False):
+        """
+        登记一次真实请求的视角，后台预取其邻近视角；同一图片的旧预取任务被取消
+        hit 为真 (请求命中切片缓存) 且位姿与该图片上次登记的相同时直接返回，邻近视角已经预取过或正在预取
+        """
+        if not self.enabled or not content_hash:
+            return
+        image_id = source["image_id"]
+        pose = (content_hash, theta, phi, fov, w, h, fmt, quality, mode)
+        if hit and self._last_pose.get(image_id) == pose:
+            self.skipped_repeat += 1
+            return
+        self._last_pose[image_id] = pose
+        self._last_pose.move_to_end(image_id)
+        while len(self._last_pose) > self.track_size:
+            self._last_pose.popitem(last=False)
+        self._cancel(image_id)
+        # 同时预取的图片数有上限，超出时取消最早的任务
+        while len(self._tasks) >= self.max_images:
+            self._cancel(next(iter(self._tasks)))
+        task = asyncio.create_task(
+            self._run(source, content_hash, self.neighbors(theta, phi, fov), w, h, fmt, quality, mode,
+                      self._generation.get(image_id, 0))
+        )
+        self._tasks[image_id] = task
+        task.add_done_callback(lambda t: self._tasks.pop(image_id, None) if self._tasks.get(image_id) is t else None)
+        self.scheduled += 1
+
+    def _cancel(self, image_id):
+        task = self._tasks.pop(image_id, None)
+        if task is not None and not task.done():
+            task.cancel()
+            self.cancelled += 1
+
+    def _is_cancelled(self, image_id, generation):
+        if self._generation.get(image_id, 0) != generation:
+            self.cancelled += 1
+            return True
+        return False
+
+    async def _run(self, source, content_hash, views, w, h, fmt, quality, mode, generation):
+        image_id = source["image_id"]
+        ext, _, quality_flag = VIEW_FORMATS[fmt]
+        params = [int(quality_flag), quality]
+        loop = asyncio.get_running_loop()
+        for theta, phi, fov in views:
+            # 低优先级: 执行器有任务在跑时放弃剩余预取，不与真实请求争抢 worker
+            if imaging_executor.in_flight > 0 or render_service.render_client.in_flight > 0:
+                self.skipped_busy += 1
+                return
+            key = crop_cache.make_key(image_id, content_hash, theta, phi, fov, w, h, fmt, quality, mode)
+            if await crop_cache.get(key, record=False) is not None:
+                self.already_cached += 1
+                continue
+            if self._is_cancelled(image_id, generation):
+                return
+            t0 = loop.time()
+            try:
+                content = await render_service.render_perspective(source, theta, phi, fov, w, h, ext, params, mode)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.warning(f"prefetch render failed: {e}")
+                return
+            self.render_time += loop.time() - t0
+            if content is None:
+                self.failed += 1
+                return
+            # 渲染期间图片可能已被替换 / 删除 (缓存已失效)，此时的结果不能再写回缓存
+            if self._is_cancelled(image_id, generation):
+                return
+            await crop_cache.set(key, content)
+            self.rendered += 1
+            self._track(key)
+
+    def _track(self, key):
+        self._prefetched[key] = True
+        self._prefetched.move_to_end(key)
+        while len(self._prefetched) > self.track_size:
+            self._prefetched.popitem(last=False)
+            self.expired += 1
+
+    def record_hit(self, key):
+        """真实请求命中切片缓存时调用，命中的是预取结果则计数"""
+        if self._prefetched.pop(key, None) is not None:
+            self.hits += 1
+
+    def cancel_image(self, image_id: int):
+        """图片被替换 / 删除 (或浏览会话结束) 时取消其预取任务，正在进行的渲染结果也不再写入缓存"""
+        self._generation[image_id] = self._generation.get(image_id, 0) + 1
+        self._last_pose.pop(image_id, None)
+        self._cancel(image_id)
+
+    def shutdown(self):
+        for image_id in list(self._tasks):
+            self._cancel(image_id)
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "active": len(self._tasks),
+            "scheduled": self.scheduled,
+            "rendered": self.rendered,
+            "already_cached": self.already_cached,
+            "skipped_busy": self.skipped_busy,
+            "skipped_repeat": self.skipped_repeat,
+            "cancelled": self.cancelled,
+            "failed": self.failed,
+            "hits": self.hits,
+            "expired": self.expired,
+            # 预取渲染结果中被真实请求用到的比例
+            "hit_rate": self.hits / self.rendered if self.rendered else 0.0,
+            "render_ms": self.render_time * 1000,
+        }
+
+
+prefetcher = ViewPrefetcher(
+    yaw_step=settings.PREFETCH_YAW_STEP,
+    pitch_step=settings.PREFETCH_PITCH_STEP,
+    fov_step=settings.PREFETCH_FOV_STEP,
+    max_images=settings.PREFETCH_MAX_IMAGES,
+    track_size=settings.PREFETCH_TRACK_SIZE,
+    enabled=settings.PREFETCH_ENABLED,
+)
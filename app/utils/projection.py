@@ -0,0 +1,139 @@
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from app.geometry import camera_rays, rays_to_erp, rotate, rotation_matrices, rotation_matrix
+from app.settings import settings
+
+
+def quantize_view(theta, phi, fov):
+    """
+    视角参数量化 (约 0.006° / 0.01°)，等价视角得到同一个 ETag / 缓存键
+    """
+    theta = (float(theta) + np.pi) % (2 * np.pi) - np.pi
+    phi = float(np.clip(phi, -np.pi / 2, np.pi / 2))
+    return round(theta, 4), round(phi, 4), round(float(fov), 2)
+
+
+class PerspectiveProjector:
+    """
+    ERP -> 透视投影的 remap 表生成器
+    相机坐标系下的单位射线束只与 (fov, out_w, out_h) 有关，按内参缓存；
+    每次请求只做一次 3x3 旋转 + 反三角函数，全部在 float32 预分配缓冲区中完成
+    """
+
+    def __init__(self, max_bundles: int = 32):
+        self.max_bundles = max_bundles
+        self._bundles: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        # 预分配的输出缓冲区按线程隔离，避免并发请求互相覆盖
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _intrinsics_key(fov, out_w, out_h):
+        return round(float(fov), 4), int(out_w), int(out_h)
+
+    def ray_bundle(self, fov, out_w, out_h):
+        """
+        返回 (out_h * out_w, 3) 的归一化 float32 相机射线，只读共享
+        """
+        key = self._intrinsics_key(fov, out_w, out_h)
+        with self._lock:
+            rays = self._bundles.get(key)
+            if rays is not None:
+                self._bundles.move_to_end(key)
+                self.hits += 1
+                return rays
+            self.misses += 1
+
+        rays = camera_rays(fov, out_w, out_h, np.float32)
+        rays.flags.writeable = False
+
+        with self._lock:
+            self._bundles[key] = rays
+            while len(self._bundles) > self.max_bundles:
+                self._bundles.popitem(last=False)
+        return rays
+
+    def _buffers(self, n):
+        bufs = getattr(self._local, "bufs", None)
+        if bufs is None or bufs[0].shape[0] != n:
+            bufs = (np.empty((n, 3), dtype=np.float32), np.empty(n, dtype=np.float32), np.empty(n, dtype=np.float32))
+            self._local.bufs = bufs
+        return bufs
+
+    def build_maps(self, W, H, theta, phi, fov, out_w, out_h, fixed_point=False):
+        """
+        生成 cv2.remap 所需的映射表
+        fixed_point=False 返回 float32 的 (map_x, map_y)，其内存为线程内复用的缓冲区，需在下次调用前用完；
+        fixed_point=True 返回 CV_16SC2 定点表 (map1, map2)，remap 走更快的整数路径
+        """
+        rays = self.ray_bundle(fov, out_w, out_h)
+        xyz, map_x, map_y = self._buffers(rays.shape[0])
+        np.matmul(rays, rotation_matrix(theta, phi).astype(np.float32).T, out=xyz)
+        # 射线已归一化，旋转后模长仍为 1
+        rays_to_erp(xyz, W, H, out_x=map_x, out_y=map_y)
+
+        map_x = map_x.reshape(out_h, out_w)
+        map_y = map_y.reshape(out_h, out_w)
+        if fixed_point:
+            return cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+        return map_x, map_y
+
+    def iter_maps_batch(self, W, H, views, chunk_pixels=None):
+        """
+        分块向量化计算多个视角的 remap 表，逐个产出 (下标, map_x, map_y)
+        views 为 [(theta, phi, fov, out_w, out_h), ...]；内参相同的视角共用同一射线束，
+        旋转通过 (k, N, 3) 的批量矩阵乘完成，每块的总像素数不超过 chunk_pixels (单个视角超过时单独成块)，
+        内存占用与批量大小无关
+        """
+        if chunk_pixels is None:
+            chunk_pixels = settings.PANO_BATCH_CHUNK_PIXELS
+        groups = {}
+        for i, (theta, phi, fov, out_w, out_h) in enumerate(views):
+            groups.setdefault(self._intrinsics_key(fov, out_w, out_h), []).append(i)
+
+        for (fov, out_w, out_h), idxs in groups.items():
+            rays = self.ray_bundle(fov, out_w, out_h)
+            step = max(1, chunk_pixels // (out_w * out_h))
+            for start in range(0, len(idxs), step):
+                chunk = idxs[start:start + step]
+                Rs = rotation_matrices([views[i][0] for i in chunk], [views[i][1] for i in chunk], np.float32)
+                map_x, map_y = rays_to_erp(rotate(rays, Rs), W, H)
+                for k, i in enumerate(chunk):
+                    yield i, map_x[k].reshape(out_h, out_w), map_y[k].reshape(out_h, out_w)
+
+    def build_maps_batch(self, W, H, views, chunk_pixels=None):
+        """返回与 views 一一对应的 (map_x, map_y) float32 列表 (结果全部驻留内存，大批量请用 iter_maps_batch)"""
+        results = [None] * len(views)
+        for i, map_x, map_y in self.iter_maps_batch(W, H, views, chunk_pixels):
+            results[i] = (map_x, map_y)
+        return results
+
+    def render_batch(self, img, views, fixed_point=None):
+        """逐个产出 (下标, 切片像素)，调用方处理完一个再取下一个，避免所有视角的结果同时驻留内存"""
+        if fixed_point is None:
+            fixed_point = settings.PANO_REMAP_FIXED_POINT
+        H, W = img.shape[:2]
+        for i, map_x, map_y in self.iter_maps_batch(W, H, views):
+            if fixed_point:
+                map_x, map_y = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+            yield i, cv2.remap(img, map_x, map_y, interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_WRAP)
+
+    def render(self, img, theta, phi, fov, out_w, out_h, fixed_point=None):
+        if fixed_point is None:
+            fixed_point = settings.PANO_REMAP_FIXED_POINT
+        H, W = img.shape[:2]
+        map1, map2 = self.build_maps(W, H, theta, phi, fov, out_w, out_h, fixed_point=fixed_point)
+        return cv2.remap(img, map1, map2, interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_WRAP)
+
+    def stats(self):
+        with self._lock:
+            return {"bundles": len(self._bundles), "hits": self.hits, "misses": self.misses}
+
+
+projector = PerspectiveProjector()
@@ -0,0 +1,54 @@
+import os
+
+import cv2
+import numpy as np
+
+from app.settings import settings
+
+
+def build_pyramid(file_path: str, img=None):
+    """
+    为 ERP 全景图生成逐级减半的多分辨率金字塔，文件存放在原图旁边 ({stem}_L{n}.jpg)
+    返回所有层级 (含第 0 层原图) 的描述列表，原图无法解码时返回 None
+    """
+    if img is None:
+        img = cv2.imread(file_path)
+    if img is None:
+        return None
+    h, w = img.shape[:2]
+    levels = [{"level": 0, "width": w, "height": h, "file_path": file_path}]
+
+    stem, _ = os.path.splitext(file_path)
+    encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), settings.PANO_PYRAMID_QUALITY]
+    level = 0
+    while w // 2 >= settings.PANO_PYRAMID_MIN_WIDTH:
+        level += 1
+        w, h = w // 2, h // 2
+        # INTER_AREA 等价于盒式滤波下采样，可以抑制混叠
+        img = cv2.resize(img, (w, h), interpolation=cv2.INTER_AREA)
+        level_path = f"{stem}_L{level}.jpg"
+        cv2.imwrite(level_path, img, encode_params)
+        levels.append({"level": level, "width": w, "height": h, "file_path": level_path})
+    return levels
+
+
+def select_level(levels, fov, out_w):
+    """
+    选择满足角分辨率要求的最粗层级
+    透视图中心像素的张角约为 1/f (f 为焦距像素数)，ERP 每像素张角为 2pi/W，
+    因此要求 W >= 2pi * f，否则放大采样会丢失细节
+    """
+    if not levels:
+        return None
+    f = 0.5 * out_w / np.tan(0.5 * np.radians(fov))
+    required_w = 2 * np.pi * f * settings.PANO_PYRAMID_OVERSAMPLE
+    candidates = [lv for lv in levels if lv["width"] >= required_w]
+    if not candidates:
+        return max(levels, key=lambda lv: lv["width"])
+    return min(candidates, key=lambda lv: lv["width"])
+
+
+def remove_pyramid(levels):
+    for lv in levels or []:
+        if lv["level"] > 0 and os.path.exists(lv["file_path"]):
+            os.remove(lv["file_path"])
@@ -0,0 +1,156 @@
+import os
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from app.settings import settings
+from app.utils.projection import projector
+
+
+def build_tiles(file_path: str, img=None, tile_size: int = None):
+    """
+    将 ERP 原图切成固定大小的未压缩分块，存为单个 .npy 文件 ({stem}_tiles.npy)
+    数组形状为 (行块数, 列块数, tile, tile, 通道)，每个分块在文件中连续存放，
+    读取时用 numpy.memmap 打开，只有被访问到的分块才会进入 (多进程共享的) 操作系统页缓存
+    """
+    if img is None:
+        img = cv2.imread(file_path)
+    if img is None:
+        return None
+    H, W, channels = img.shape
+    size = tile_size or settings.PANO_TILE_SIZE
+    rows, cols = -(-H // size), -(-W // size)
+
+    stem, _ = os.path.splitext(file_path)
+    tiles_path = f"{stem}_tiles.npy"
+    tiles = np.lib.format.open_memmap(tiles_path, mode="w+", dtype=img.dtype, shape=(rows, cols, size, size, channels))
+    for r in range(rows):
+        for c in range(cols):
+            block = img[r * size:(r + 1) * size, c * size:(c + 1) * size]
+            tiles[r, c, :block.shape[0], :block.shape[1]] = block
+    tiles.flush()
+    del tiles
+    return {"file_path": tiles_path, "tile_size": size, "width": W, "height": H}
+
+
+class TileStore:
+    """
+    已打开的分块文件 (memmap) 句柄缓存，key 为 (文件路径, mtime)
+    memmap 本身不占用进程私有内存，句柄数量有上限即可
+    """
+
+    def __init__(self, max_open: int = 64):
+        self.max_open = max_open
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.tiles_read = 0
+        self.tiles_total = 0
+
+    def open(self, file_path: str):
+        try:
+            mtime = os.path.getmtime(file_path)
+        except OSError:
+            return None
+        key = (file_path, mtime)
+        with self._lock:
+            tiles = self._entries.get(key)
+            if tiles is not None:
+                self._entries.move_to_end(key)
+                return tiles
+        tiles = np.load(file_path, mmap_mode="r")
+        with self._lock:
+            self._entries[key] = tiles
+            while len(self._entries) > self.max_open:
+                self._entries.popitem(last=False)
+        return tiles
+
+    def record(self, read, total):
+        with self._lock:
+            self.tiles_read += read
+            self.tiles_total += total
+
+    def stats(self):
+        with self._lock:
+            return {
+                "open": len(self._entries),
+                "tiles_read": self.tiles_read,
+                # 相对于整图解码，实际读取的分块比例
+                "read_ratio": self.tiles_read / self.tiles_total if self.tiles_total else 0.0,
+            }
+
+
+tile_store = TileStore()
+
+
+def _covering_arc(touched):
+    """
+    环形排列的列块中，覆盖所有被访问列块的最短连续区间，返回 (起始列块, 列块数)
+    """
+    n = len(touched)
+    idx = np.flatnonzero(touched)
+    if len(idx) == n:
+        return 0, n
+    # 最大的未访问间隔之后即为区间起点
+    gaps = np.diff(np.append(idx, idx[0] + n))
+    k = int(np.argmax(gaps))
+    start = int(idx[(k + 1) % len(idx)])
+    return start, n - int(gaps[k]) + 1
+
+
+def render_from_tiles(tiles_meta, theta, phi, fov, out_w, out_h):
+    """
+    从分块文件渲染透视切片: 先算 remap 表，求出视锥在 ERP 上覆盖的分块 (含双线性插值需要的右 / 下邻像素)，
+    只读取这些分块拼成局部图，再在局部图上 remap
+    """
+    tiles = tile_store.open(tiles_meta["file_path"])
+    if tiles is None:
+        return None
+    W, H, size = tiles_meta["width"], tiles_meta["height"], tiles_meta["tile_size"]
+    rows, cols = tiles.shape[:2]
+    map_x, map_y = projector.build_maps(W, H, theta, phi, fov, out_w, out_h, fixed_point=False)
+
+    # 双线性插值会读取 (x0, y0) 及其右 / 下邻像素，四个角所在的分块都要读
+    x0 = map_x.astype(np.int32).ravel()
+    y0 = map_y.astype(np.int32).ravel()
+    tile_x = (x0 // size, ((x0 + 1) % W) // size)
+    tile_y = (y0 // size, np.minimum(y0 + 1, H - 1) // size)
+    touched = np.zeros((rows, cols), dtype=bool)
+    for ty in tile_y:
+        for tx in tile_x:
+            touched[ty, tx] = True
+    touched_rows = np.flatnonzero(touched.any(axis=1))
+    r0, r1 = int(touched_rows[0]), int(touched_rows[-1]) + 1
+    c0, n_cols = _covering_arc(touched.any(axis=0))
+    full_width = n_cols == cols
+
+    # 按真实像素范围拼接 (末列 / 末行分块有填充)，保证拼接后的局部图在列方向上与 ERP 像素连续；
+    # 包围区域内未被访问的分块不读取，对应位置不会被取样
+    strip_cols = [(c0 + k) % cols for k in range(n_cols)]
+    widths = [min(size, W - c * size) for c in strip_cols]
+    heights = [min(size, H - r * size) for r in range(r0, r1)]
+    region = np.empty((sum(heights), sum(widths), tiles.shape[-1]), dtype=tiles.dtype)
+    y = 0
+    for r, h in zip(range(r0, r1), heights):
+        x = 0
+        for c, w in zip(strip_cols, widths):
+            if touched[r, c]:
+                region[y:y + h, x:x + w] = tiles[r, c, :h, :w]
+            x += w
+        y += h
+    tile_store.record(int(touched.sum()), rows * cols)
+
+    # ERP 坐标平移到局部图坐标；整行都被覆盖时局部图就是完整宽度，仍按环形取样
+    local_x = np.mod(map_x - c0 * size, W)
+    local_y = map_y - r0 * size
+    if settings.PANO_REMAP_FIXED_POINT:
+        local_x, local_y = cv2.convertMaps(local_x, local_y, cv2.CV_16SC2)
+    border = cv2.BORDER_WRAP if full_width else cv2.BORDER_REPLICATE
+    return cv2.remap(region, local_x, local_y, interpolation=cv2.INTER_LINEAR, borderMode=border)
+
+
+def remove_tiles(tiles_meta):
+    path = (tiles_meta or {}).get("file_path")
+    if path and os.path.exists(path):
+        os.remove(path)
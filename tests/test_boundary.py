@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+
+from app.utils.boundary import (MEDIA_DELTA, MEDIA_F32, decode_polygons, encode_polygons, negotiate, pack_boundary,
+                                simplify_boundary, unpack_boundary)
+
+STEP = 0.05
+
+
+def _ring(n, rng, noise=0.0):
+    # 带噪声的椭圆闭合环 (首尾不重复)，坐标量级与 ERP 像素相当
+    t = np.linspace(0, 2 * np.pi, n, endpoint=False)
+    ring = np.column_stack([1000 + 300 * np.cos(t), 500 + 120 * np.sin(t)])
+    return (ring + rng.normal(0, noise, ring.shape)).astype(np.float32)
+
+
+def _segment_distance(points, a, b):
+    d = b - a
+    length2 = (d * d).sum(-1)
+    t = np.clip(((points[:, None] - a[None]) * d[None]).sum(-1) / np.maximum(length2, 1e-12)[None], 0, 1)
+    return np.linalg.norm(points[:, None] - (a[None] + t[..., None] * d[None]), axis=-1)
+
+
+@pytest.fixture
+def polygons():
+    rng = np.random.default_rng(0)
+    # 奇数点数用于检查每个多边形补齐到 4 字节；中间夹一个空多边形
+    return [_ring(401, rng, 0.3), np.empty((0, 2), np.float32), _ring(7, rng), _ring(1, rng)]
+
+
+def test_pack_unpack_roundtrip(polygons):
+    assert np.array_equal(unpack_boundary(pack_boundary(polygons[0])), polygons[0])
+    assert unpack_boundary(None).shape == (0, 2)
+
+
+def test_f32_roundtrip(polygons):
+    meta, decoded = decode_polygons(encode_polygons({"image_id": 3}, polygons, MEDIA_F32))
+    assert meta["image_id"] == 3
+    assert meta["counts"] == [401, 0, 7, 1]
+    for src, out in zip(polygons, decoded):
+        assert np.array_equal(src, out)
+
+
+def test_delta_roundtrip_within_half_step(polygons):
+    meta, decoded = decode_polygons(encode_polygons({"image_id": 3}, polygons, MEDIA_DELTA, step=STEP))
+    assert meta["step"] == STEP
+    assert meta["widths"] == [2, 0, 2, 2]
+    for src, out in zip(polygons, decoded):
+        assert out.shape == src.shape
+        if len(src):
+            assert np.abs(out - src).max() <= STEP / 2 + 1e-3
+
+
+def test_delta_large_jump_uses_int32():
+    # 跨越经度接缝的跳变 (量化后 > int16)，该多边形改用 int32，前后的多边形不受影响
+    seam = np.array([[10.0, 100.0], [4090.0, 100.0], [4090.0, 200.0], [10.0, 200.0], [5.0, 150.0]], np.float32)
+    small = np.array([[1.0, 1.0], [2.0, 2.0], [3.0, 1.0]], np.float32)
+    meta, decoded = decode_polygons(encode_polygons({}, [small, seam, small], MEDIA_DELTA, step=STEP))
+    assert meta["widths"] == [2, 4, 2]
+    for src, out in zip([small, seam, small], decoded):
+        assert np.abs(out - src).max() <= STEP / 2 + 1e-3
+
+
+def test_decode_rejects_other_payloads():
+    with pytest.raises(ValueError):
+        decode_polygons(b"JUNK" + bytes(8))
+
+
+@pytest.mark.parametrize("accept, expected", [
+    (None, None),
+    ("application/json", None),
+    ("*/*", None),
+    (MEDIA_F32, MEDIA_F32),
+    (f"text/html;q=0.9, {MEDIA_DELTA};q=0.8", MEDIA_DELTA),
+    (f"{MEDIA_F32};q=0.5, {MEDIA_DELTA}", MEDIA_DELTA),
+    (f"{MEDIA_F32}; q=0.5, {MEDIA_DELTA};q=0.5", MEDIA_F32),
+    (f"{MEDIA_DELTA};q=0, {MEDIA_F32};q=0.1", MEDIA_F32),
+    (f"{MEDIA_DELTA};q=0", None),
+    (f"application/json, {MEDIA_DELTA};q=0.5", None),
+    (f"Application/X-Boundary-Delta;charset=binary", MEDIA_DELTA),
+])
+def test_negotiate(accept, expected):
+    assert negotiate(accept) == expected
+
+
+@pytest.mark.parametrize("tolerance", [0.1, 0.5, 2.0])
+def test_simplify_error_within_tolerance(tolerance):
+    points = _ring(600, np.random.default_rng(1), 0.3)
+    simplified = simplify_boundary(points, tolerance=tolerance)
+    assert 3 <= len(simplified) < len(points)
+    # 结果是原点阵的有序子集
+    idx = [int(np.flatnonzero((points == p).all(axis=1))[0]) for p in simplified]
+    assert idx == sorted(idx)
+    # 每个原始点到简化后闭合折线的距离不超过容差
+    a = simplified.astype(np.float64)
+    b = np.roll(a, -1, axis=0)
+    assert _segment_distance(points.astype(np.float64), a, b).min(axis=1).max() <= tolerance + 1e-6
+
+
+@pytest.mark.parametrize("max_points", [2, 3, 16, 64])
+def test_simplify_respects_max_points(max_points):
+    points = _ring(600, np.random.default_rng(2), 0.3)
+    simplified = simplify_boundary(points, max_points=max_points)
+    assert len(simplified) == max(3, max_points)
+    assert len(simplify_boundary(points, tolerance=0.01, max_points=max_points)) <= max(3, max_points)
+
+
+def test_simplify_noop_without_limits():
+    points = _ring(50, np.random.default_rng(3))
+    assert simplify_boundary(points) is points
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from app.geometry import angles_to_rays, angular_distance, cap_cells, cap_radius, cell_of, cell_ranges, rays_to_angles
+
+GRIDS = [(64, 128), (7, 13)]
+CAPS = [
+    # (theta, phi, radius): 跨越经度接缝 / 包含北极 / 包含南极 / 贴近极点但不包含 / 赤道 / 大半径
+    (np.pi - 0.05, 0.2, 0.3),
+    (-np.pi + 0.01, -0.4, 0.15),
+    (0.3, 1.4, 0.3),
+    (-2.0, -1.5, 0.2),
+    (1.0, 1.2, 0.3),
+    (0.0, 0.0, 0.05),
+    (2.5, 0.1, 2.0),
+    (0.0, 0.0, np.pi),
+]
+
+
+def _sphere_samples(n, seed=0):
+    # 球面均匀采样的单位向量
+    v = np.random.default_rng(seed).normal(size=(n, 3))
+    return v / np.linalg.norm(v, axis=1, keepdims=True)
+
+
+def _cells_in_cap(theta, phi, radius, bands, lons, samples):
+    # 暴力求解: 球冠内所有采样点 (加上中心) 所在的格子
+    inside = samples[angular_distance(samples, theta, phi) < radius]
+    s_theta, s_phi = rays_to_angles(np.vstack([inside, angles_to_rays(theta, phi)]))
+    return set(cell_of(s_theta, s_phi, bands, lons).tolist())
+
+
+@pytest.fixture(scope="module")
+def samples():
+    return _sphere_samples(400_000)
+
+
+@pytest.mark.parametrize("bands, lons", GRIDS)
+@pytest.mark.parametrize("theta, phi, radius", CAPS)
+def test_cap_cells_cover_brute_force(samples, theta, phi, radius, bands, lons):
+    cells = cap_cells(theta, phi, radius, bands, lons)
+    assert len(cells) == len(set(cells.tolist()))
+    assert ((cells >= 0) & (cells < bands * lons)).all()
+    assert _cells_in_cap(theta, phi, radius, bands, lons, samples) <= set(cells.tolist())
+
+
+def test_cap_cells_cover_random_caps(samples):
+    rng = np.random.default_rng(1)
+    for _ in range(200):
+        theta, phi = rng.uniform(-np.pi, np.pi), np.arcsin(rng.uniform(-1, 1))
+        radius = float(cap_radius(*rng.uniform(5, 120, 2)))
+        bands, lons = GRIDS[rng.integers(len(GRIDS))]
+        cells = set(cap_cells(theta, phi, radius, bands, lons).tolist())
+        assert _cells_in_cap(theta, phi, radius, bands, lons, samples) <= cells
+
+
+def test_cap_cells_pole_cap_spans_all_longitudes():
+    bands, lons = GRIDS[0]
+    cells = cap_cells(0.3, np.pi / 2 - 0.1, 0.2, bands, lons)
+    assert set((cells % lons).tolist()) == set(range(lons))
+    assert (cells // lons).max() == bands - 1
+
+
+def test_cap_cells_seam_wraps_longitudes():
+    bands, lons = GRIDS[0]
+    lon = set((cap_cells(np.pi - 0.01, 0.0, 0.1, bands, lons) % lons).tolist())
+    assert {0, lons - 1} <= lon
+    assert len(lon) < lons
+
+
+def test_cap_radius_matches_corner_distance():
+    # 水平 / 垂直视场均为 90 度时，中心到角点的角距离为 arccos(1 / sqrt(3))
+    assert np.isclose(cap_radius(90, 90), np.arccos(1 / np.sqrt(3)))
+    assert np.isclose(cap_radius(60, 0), np.radians(30))
+
+
+@pytest.mark.parametrize("cells, expected", [
+    ([], []),
+    ([5], [(5, 5)]),
+    ([3, 1, 2, 2, 7, 8, 10], [(1, 3), (7, 8), (10, 10)]),
+    (np.array([0, 127, 128, 129, 255]), [(0, 0), (127, 129), (255, 255)]),
+])
+def test_cell_ranges(cells, expected):
+    assert cell_ranges(cells) == expected
+
+
+def test_cell_ranges_cover_exactly_the_cells():
+    cells = cap_cells(np.pi - 0.05, 0.2, 0.3, *GRIDS[0])
+    covered = {c for lo, hi in cell_ranges(cells) for c in range(lo, hi + 1)}
+    assert covered == set(cells.tolist())
@@ -0,0 +1,112 @@
+import asyncio
+import fnmatch
+import sys
+
+import pytest
+
+from app.utils import crop_cache as crop_cache_module
+from app.utils.crop_cache import CropCache, DiskBackend, MemoryBackend, RedisBackend, create_backend
+
+
+class LocalRedis:
+    """进程内的 Redis 兼容替身，只实现 RedisBackend 用到的 get / set / scan_iter / delete"""
+
+    def __init__(self):
+        self.data = {}
+        self.expiry = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+        self.expiry[key] = ex
+
+    def scan_iter(self, match="*"):
+        return [key for key in list(self.data) if fnmatch.fnmatchcase(key, match)]
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+            self.expiry.pop(key, None)
+
+
+def _key(image_id, theta=0.0):
+    return CropCache.make_key(image_id, "hash", theta, 0.0, 90.0, 512, 512, "jpg", 90)
+
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryBackend(max_bytes=10)
+    backend.set("a", b"1234")
+    backend.set("b", b"1234")
+    assert backend.get("a") == b"1234"
+    backend.set("c", b"1234")
+    assert backend.get("b") is None
+    assert backend.get("a") == b"1234"
+    assert backend.stats()["bytes"] == 8
+
+
+def test_disk_backend_roundtrip_and_invalidation(tmp_path):
+    backend = DiskBackend(str(tmp_path), max_bytes=1 << 20)
+    backend.set(_key(1), b"first")
+    backend.set(_key(2), b"second")
+    assert backend.get(_key(1)) == b"first"
+    backend.delete_prefix("crop:1:")
+    assert backend.get(_key(1)) is None
+    assert backend.get(_key(2)) == b"second"
+    assert backend.stats()["bytes"] == len(b"second")
+
+
+def test_disk_backend_overwrite_keeps_byte_count(tmp_path):
+    backend = DiskBackend(str(tmp_path), max_bytes=1 << 20)
+    for _ in range(5):
+        backend.set(_key(1), b"x" * 100)
+    assert backend.stats()["bytes"] == 100
+    # 重新扫描目录得到的大小与计数一致
+    assert DiskBackend(str(tmp_path), max_bytes=1 << 20).stats()["bytes"] == 100
+
+
+def test_disk_backend_evicts_over_budget(tmp_path):
+    backend = DiskBackend(str(tmp_path), max_bytes=250)
+    for k in range(5):
+        backend.set(_key(1, theta=k), b"x" * 100)
+    assert backend.stats()["bytes"] <= 250
+    assert backend.get(_key(1, theta=4)) == b"x" * 100
+
+
+def test_redis_backend_with_local_client():
+    client = LocalRedis()
+    backend = RedisBackend(client=client, ttl=60)
+    backend.set(_key(1), b"a")
+    backend.set(_key(2), b"b")
+    assert backend.get(_key(1)) == b"a"
+    assert client.expiry[_key(1)] == 60
+    backend.delete_prefix("crop:1:")
+    assert backend.get(_key(1)) is None
+    assert backend.get(_key(2)) == b"b"
+
+
+@pytest.mark.parametrize("kind", ["memory", "disk", "redis"])
+def test_crop_cache_hits_and_invalidate(kind, tmp_path):
+    backend = {
+        "memory": lambda: MemoryBackend(1 << 20),
+        "disk": lambda: DiskBackend(str(tmp_path), 1 << 20),
+        "redis": lambda: RedisBackend(client=LocalRedis()),
+    }[kind]()
+    cache = CropCache(backend)
+
+    async def scenario():
+        assert await cache.get(_key(7)) is None
+        await cache.set(_key(7), b"jpeg")
+        assert await cache.get(_key(7)) == b"jpeg"
+        await cache.invalidate(7)
+        assert await cache.get(_key(7)) is None
+
+    asyncio.run(scenario())
+    assert (cache.hits, cache.misses, cache.errors) == (1, 2, 0)
+
+
+def test_redis_backend_falls_back_without_package(monkeypatch):
+    monkeypatch.setitem(sys.modules, "redis", None)
+    monkeypatch.setattr(crop_cache_module.settings, "CROP_CACHE_MAX_BYTES", 1024)
+    assert isinstance(create_backend("redis"), MemoryBackend)
@@ -0,0 +1,176 @@
+"""
+ERP 外接框 (ImageRecorder.erp_bboxes) 与按像素区域检索 (ImageController.get_region_annotations) 的 SQL 条件
+"""
+import asyncio
+
+import numpy as np
+import pytest
+from tortoise import Tortoise
+
+from app.controllers.image import ImageController
+from app.models.image import Annotation, Image360
+from app.models.project import Label, Project
+from app.utils import imaging
+from app.utils.boundary import boundary_key, pack_boundary
+from app.utils.ImageRecorder import erp_bboxes, fill_spherical_box
+
+W, H = 512, 256
+
+
+def _ring(theta, phi, fov_w, fov_h, gamma=0.0):
+    return imaging.annotation_boundaries(W, H, [theta], [phi], [fov_w], [fov_h], [gamma])[0]
+
+
+def _covers(box, seam, x, y):
+    x0, y0, x1, y1 = box
+    in_x = (x >= x0) | (x <= x1) if seam else (x >= x0) & (x <= x1)
+    return bool((in_x & (y >= y0) & (y <= y1)).all())
+
+
+@pytest.mark.parametrize("theta, phi, fov_w, fov_h, gamma, kind", [
+    (0.3, 0.2, 40, 30, 0.4, "plain"),
+    (np.pi - 0.05, 0.1, 40, 30, 0.0, "seam"),
+    (-np.pi + 0.02, -0.3, 20, 50, 1.0, "seam"),
+    (0.5, 1.45, 60, 60, 0.0, "north"),
+    (-1.0, -1.45, 60, 60, 0.5, "south"),
+    (0.0, 1.0, 30, 30, 0.0, "plain"),
+])
+def test_erp_bboxes_cover_filled_box(theta, phi, fov_w, fov_h, gamma, kind):
+    ring = _ring(theta, phi, fov_w, fov_h, gamma)
+    boxes, seam = erp_bboxes([ring], W, H)
+    box = boxes[0].tolist()
+    assert bool(seam[0]) == (kind == "seam")
+    if kind == "seam":
+        assert box[0] > box[2]
+    elif kind in ("north", "south"):
+        assert (box[0], box[2]) == (0.0, W)
+        assert box[1] == 0.0 if kind == "north" else box[3] == H
+    else:
+        assert box[0] < box[2]
+    # 暴力对照: 边缘点与填充后的全部像素 (像素中心，与点阵同一坐标) 都在外接框内 (允许 1 像素的栅格化误差)
+    assert _covers(box, seam[0], np.mod(ring[:, 0], W), ring[:, 1])
+    mask = fill_spherical_box(np.zeros((H, W), np.uint8), ring[:, 0], ring[:, 1], 255)
+    ys, xs = np.nonzero(mask)
+    grown = [box[0] - 1, box[1] - 1, box[2] + 1, box[3] + 1]
+    assert _covers(grown, seam[0], xs + 0.5, ys + 0.5)
+
+
+def test_erp_bboxes_empty_ring_is_nan():
+    ring = _ring(0.0, 0.0, 40, 30)
+    boxes, seam = erp_bboxes([np.empty((0, 2), np.float32), ring, np.empty((0, 2))], W, H)
+    assert np.isnan(boxes[[0, 2]]).all()
+    assert not np.isnan(boxes[1]).any()
+    assert not seam.any()
+    boxes, seam = erp_bboxes([], W, H)
+    assert boxes.shape == (0, 4) and seam.shape == (0,)
+
+
+def _brute_force(rows, x0, y0, x1, y1):
+    # 外接框与区域 (都可能跨越接缝) 按像素区间逐个判断
+    regions = [(x0, x1)] if x0 <= x1 else [(x0, W), (0, x1)]
+    out = []
+    for anno_id, box, seam in rows:
+        if box is None or not (box[1] <= y1 and box[3] >= y0):
+            continue
+        spans = [(box[0], W), (0, box[2])] if seam else [(box[0], box[2])]
+        if any(a <= r1 and b >= r0 for a, b in spans for r0, r1 in regions):
+            out.append(anno_id)
+    return out
+
+
+def _run(scenario):
+    async def wrapper():
+        await Tortoise.init(db_url="sqlite://:memory:", modules={"models": ["app.models"]})
+        await Tortoise.generate_schemas()
+        try:
+            await scenario()
+        finally:
+            await Tortoise.close_connections()
+
+    asyncio.run(wrapper())
+
+
+async def _image():
+    project = await Project.create(name="p")
+    label = await Label.create(project=project, name="chair")
+    img = await Image360.create(project=project, filename="a.jpg", file_path="unused.jpg", url="/x", width=W,
+                                height=H)
+    return img, label
+
+
+async def _insert(img, label, box, seam, boundary=b"\0" * 8):
+    # 点阵摘要与当前尺寸一致，检索前不会重算，外接框即测试给定的值
+    geometry = dict(center_theta=0.0, center_phi=0.0, fov_w=10.0, fov_h=10.0, gamma=0.0)
+    x0, y0, x1, y1 = box if box is not None else (None,) * 4
+    anno = await Annotation.create(image=img, label=label, boundary=boundary,
+                                   boundary_key=boundary_key(W, H, *geometry.values()), erp_x0=x0, erp_y0=y0,
+                                   erp_x1=x1, erp_y1=y1, erp_seam=seam, **geometry)
+    return anno.id
+
+
+def test_region_query_matches_brute_force():
+    rng = np.random.default_rng(0)
+
+    async def scenario():
+        img, label = await _image()
+        rows = []
+        for _ in range(150):
+            kind = rng.choice(["plain", "seam", "pole"], p=[0.6, 0.25, 0.15])
+            y0 = float(rng.uniform(0, H - 20))
+            y1 = min(float(H), y0 + float(rng.uniform(1, 80)))
+            if kind == "pole":
+                box, seam = (0.0, 0.0 if rng.random() < 0.5 else y0, float(W), y1), False
+            elif kind == "seam":
+                box, seam = (float(rng.uniform(W - 60, W)), y0, float(rng.uniform(0, 60)), y1), True
+            else:
+                x0 = float(rng.uniform(0, W - 10))
+                box, seam = (x0, y0, min(float(W), x0 + float(rng.uniform(1, 100))), y1), False
+            rows.append((await _insert(img, label, box, seam), box, seam))
+        rows.append((await _insert(img, label, None, False, boundary=b""), None, False))
+
+        regions = [(0, 0, W, H), (100, 50, 300, 120), (W - 30, 0, 20, H), (W - 5, 100, W - 1, 140), (0, 0, 1, 1),
+                   (250, 200, 251, 255)]
+        regions += [(float(rng.uniform(0, W)), 0.0, float(rng.uniform(0, W)), float(H)) for _ in range(20)]
+        for x0, y0, x1, y1 in regions:
+            got = [a["id"] for a in await ImageController.get_region_annotations(img.id, x0, y0, x1, y1)]
+            assert got == _brute_force(rows, x0, y0, x1, y1), (x0, y0, x1, y1)
+
+    _run(scenario)
+
+
+def test_empty_boundary_is_not_recomputed(monkeypatch):
+    ring = _ring(0.0, 0.0, 40, 30)
+    boxes, seam = erp_bboxes([ring], W, H)
+    calls = []
+    original = imaging.annotation_boundaries
+
+    def counting(*args, **kwargs):
+        calls.append(len(args[2]))
+        return original(*args, **kwargs)
+
+    ensured = []
+    ensure = ImageController._ensure_boundaries.__func__
+
+    async def recording(cls, img_obj, annos):
+        ensured.extend(anno.id for anno in annos)
+        return await ensure(cls, img_obj, annos)
+
+    monkeypatch.setattr(imaging, "annotation_boundaries", counting)
+    monkeypatch.setattr(ImageController, "_ensure_boundaries", classmethod(recording))
+
+    async def scenario():
+        img, label = await _image()
+        empty_id = await _insert(img, label, None, False, boundary=b"")
+        anno_id = await _insert(img, label, boxes[0].tolist(), bool(seam[0]), boundary=pack_boundary(ring))
+        for _ in range(3):
+            got = await ImageController.get_region_annotations(img.id, 0, 0, W, H)
+            assert [a["id"] for a in got] == [anno_id]
+        # 点阵为空 (外接框为空) 但摘要一致的标注不会在每次检索前被重新读取 / 重算
+        assert empty_id not in ensured
+        assert calls == []
+        # 图片尺寸变化后摘要过期，全部重算一次
+        await Image360.filter(id=img.id).update(width=2 * W, height=2 * H)
+        await ImageController.get_region_annotations(img.id, 0, 0, 2 * W, 2 * H)
+        assert calls == [2]
+
+    _run(scenario)
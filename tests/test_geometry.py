@@ -0,0 +1,102 @@
+"""
+app.geometry 与重构前各处投影实现的等价性校验 (小尺寸)，参考实现见 app.geometry.benchmark
+"""
+import numpy as np
+import pytest
+
+from app.geometry import (box_corners, erp_maps, perspective_to_sphere, project_boxes, rays_to_angles, spherical_iou,
+                          spherical_nms, sphere_to_perspective)
+from app.geometry.benchmark import (_legacy_direct_camera, _legacy_erp_maps, _legacy_rbfov_center, _random_boxes,
+                                    VIEWS)
+from app.utils.ImageRecorder import ImageRecorder
+
+W, H = 1024, 512
+OUT_W, OUT_H = 96, 64
+# remap 坐标 (像素) 的容差: float32 在高纬度处 arcsin 的舍入误差
+MAP_TOL = 5e-2
+ANGLE_TOL = 1e-9
+# 球面交并比 (默认采样点数) 相对于高密度采样参考值的最大误差
+IOU_TOL = 0.08
+
+
+def _wrapped_diff(a, b, period):
+    d = np.abs(a - b)
+    return np.minimum(d, period - d)
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+
+def test_erp_maps_match_legacy():
+    # 逐视角 float64 旧实现 vs 批量 float32 新实现
+    thetas, phis = np.array([v[0] for v in VIEWS]), np.array([v[1] for v in VIEWS])
+    for fov in sorted({v[2] for v in VIEWS}):
+        idx = [i for i, v in enumerate(VIEWS) if v[2] == fov]
+        map_x, map_y = erp_maps(thetas[idx], phis[idx], fov, OUT_W, OUT_H, W, H)
+        for k, i in enumerate(idx):
+            ref_x, ref_y = _legacy_erp_maps(VIEWS[i][0], VIEWS[i][1], fov, OUT_W, OUT_H, W, H)
+            assert _wrapped_diff(map_x[k], ref_x, W).max() <= MAP_TOL
+            assert np.abs(map_y[k] - ref_y).max() <= MAP_TOL
+
+
+def test_perspective_to_sphere_matches_legacy_and_round_trips(rng):
+    thetas, phis = np.array([v[0] for v in VIEWS]), np.array([v[1] for v in VIEWS])
+    fovs = np.array([v[2] for v in VIEWS])
+    px, py = rng.uniform(0, OUT_W, 16), rng.uniform(0, OUT_H, 16)
+    new_theta, new_phi = perspective_to_sphere(px, py, thetas, phis, fovs, OUT_W, OUT_H)
+    for i, (theta, phi, fov) in enumerate(VIEWS):
+        for j in range(len(px)):
+            ref_theta, ref_phi = _legacy_rbfov_center(theta, phi, fov, px[j], py[j], OUT_W, OUT_H)
+            assert _wrapped_diff(new_theta[i, j], ref_theta, 2 * np.pi) <= ANGLE_TOL
+            assert abs(new_phi[i, j] - ref_phi) <= ANGLE_TOL
+
+    back_x, back_y, in_front = sphere_to_perspective(new_theta, new_phi, thetas, phis, fovs, OUT_W, OUT_H)
+    assert in_front.all()
+    assert np.abs(back_x - px).max() <= 1e-6
+    assert np.abs(back_y - py).max() <= 1e-6
+
+
+@pytest.mark.parametrize("fov_w, fov_h", [(64, 64), (90, 45), (30, 80)])
+def test_recorder_direct_camera_matches_legacy(fov_w, fov_h):
+    recorder = ImageRecorder(W, H, view_angle_w=fov_w, view_angle_h=fov_h, long_side=64)
+    for theta, phi, _ in VIEWS:
+        new_x, new_y = recorder._direct_camera(theta, phi)
+        ref_x, ref_y = _legacy_direct_camera(recorder, fov_w, theta, phi)
+        assert _wrapped_diff(new_x, ref_x, 2 * np.pi).max() <= ANGLE_TOL
+        assert np.abs(new_y - ref_y).max() <= ANGLE_TOL
+
+
+def test_spherical_iou_accuracy(rng):
+    boxes = _random_boxes(rng, 60, 5.0, 60.0)
+    moved = boxes + np.column_stack([rng.normal(0, 0.05, (60, 2)), np.zeros((60, 2)), rng.normal(0, 0.2, 60)])
+    assert np.abs(np.diag(spherical_iou(boxes, boxes)) - 1).max() <= 1e-9
+    ref = np.diag(spherical_iou(boxes, moved, samples=4096))
+    assert np.abs(np.diag(spherical_iou(boxes, moved)) - ref).max() <= IOU_TOL
+
+
+def test_spherical_nms_suppresses_duplicates(rng):
+    boxes = _random_boxes(rng, 20, 5.0, 20.0)
+    boxes[:, 0] = np.linspace(-3, 3, 20)
+    duplicated = np.vstack([boxes, boxes[:5]])
+    keep = spherical_nms(duplicated, threshold=0.5)
+    assert sorted(keep.tolist()) == list(range(20))
+
+
+def test_project_boxes_matches_corner_projection(rng):
+    # 完全位于画面内的框，裁剪后的多边形即为四个角点的正映射
+    boxes = _random_boxes(rng, 200, 5.0, 60.0)
+    corner_theta, corner_phi = rays_to_angles(box_corners(boxes))
+    checked = 0
+    for theta, phi, fov in VIEWS:
+        polygons = project_boxes(boxes, theta, phi, fov, OUT_W, OUT_H)
+        cx, cy, front = sphere_to_perspective(corner_theta, corner_phi, theta, phi, fov, OUT_W, OUT_H)
+        inside = (front & (cx >= 0) & (cx <= OUT_W) & (cy >= 0) & (cy <= OUT_H)).all(axis=-1)
+        for k in np.flatnonzero(inside):
+            assert np.abs(polygons[k] - np.column_stack([cx[k], cy[k]])).max() <= 1e-6
+            checked += 1
+        # 与画面无交集的框 (全部角点位于相机后方) 为空
+        for k in np.flatnonzero(~front.any(axis=-1)):
+            assert len(polygons[k]) == 0
+    assert checked > 0
@@ -0,0 +1,51 @@
+import asyncio
+
+from app.core import render_service
+from app.utils import prefetch as prefetch_module
+from app.utils.crop_cache import CropCache, MemoryBackend
+from app.utils.prefetch import ViewPrefetcher
+
+SOURCE = {"image_id": 1, "file_path": "unused.jpg"}
+POSE = ("hash", 0.0, 0.0, 90.0, 64, 64, "jpg", 90)
+
+
+def _prefetcher(monkeypatch, render):
+    monkeypatch.setattr(prefetch_module, "crop_cache", CropCache(MemoryBackend(1 << 20)))
+    monkeypatch.setattr(render_service, "render_perspective", render)
+    return ViewPrefetcher(yaw_step=10, pitch_step=10, fov_step=10, max_images=4, track_size=16)
+
+
+def test_hit_on_same_pose_is_not_rescheduled(monkeypatch):
+    async def render(*args):
+        return b"jpeg"
+
+    prefetcher = _prefetcher(monkeypatch, render)
+
+    async def scenario():
+        prefetcher.schedule(SOURCE, *POSE)
+        await asyncio.gather(*prefetcher._tasks.values())
+        prefetcher.schedule(SOURCE, *POSE, hit=True)
+        # 位姿变化后即使命中缓存也要重新调度
+        prefetcher.schedule(SOURCE, "hash", 0.5, 0.0, 90.0, 64, 64, "jpg", 90, hit=True)
+        await asyncio.gather(*prefetcher._tasks.values())
+
+    asyncio.run(scenario())
+    assert prefetcher.scheduled == 2
+    assert prefetcher.skipped_repeat == 1
+
+
+def test_cancelled_image_results_are_not_cached(monkeypatch):
+    async def render(*args):
+        # 渲染期间图片被替换 / 删除
+        prefetcher.cancel_image(SOURCE["image_id"])
+        return b"jpeg"
+
+    prefetcher = _prefetcher(monkeypatch, render)
+
+    async def scenario():
+        # 直接运行预取协程，模拟取消信号到达时渲染已在执行器中完成的情况
+        await prefetcher._run(SOURCE, "hash", prefetcher.neighbors(0.0, 0.0, 90.0), 64, 64, "jpg", 90, "erp", 0)
+
+    asyncio.run(scenario())
+    assert prefetcher.rendered == 0
+    assert prefetch_module.crop_cache.backend.stats()["bytes"] == 0
@@ -0,0 +1,32 @@
+import subprocess
+import sys
+
+from app.settings import settings
+
+# 在独立的解释器中运行: spawn 出的 worker 会重新导入父进程的 __main__ (如 pytest)，在测试进程内测得的 RSS 偏大
+WORKER_RSS = """
+from app.core.render_service import RenderClient, RenderService
+service = RenderService(workers=1, address={address!r}, authkey=b"test")
+client = RenderClient(workers=1, address={address!r}, authkey=b"test", connections=1, enabled=True)
+service.start()
+try:
+    print(client._call(0, {{"op": "stats"}})["stats"]["rss"])
+finally:
+    client.close()
+    service.stop()
+"""
+
+
+def _run(code):
+    return subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+
+
+def test_worker_module_does_not_build_the_app():
+    # worker 只导入渲染服务模块，不应连带导入路由 / 中间件并创建 FastAPI 应用
+    out = _run("import sys, app.core.render_service; print('app.core.init_app' in sys.modules, 'fastapi' in sys.modules)")
+    assert out.split() == ["False", "False"]
+
+
+def test_worker_rss_stays_small_after_startup(tmp_path):
+    rss = int(_run(WORKER_RSS.format(address=str(tmp_path / "render"))))
+    assert rss <= settings.RENDER_SERVICE_WORKER_RSS_MB * 1024 * 1024
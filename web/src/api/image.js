@@ -10,6 +10,9 @@ export default {
   getImages: (projectId) => request.get('/image/list', { params: { project_id: projectId } }),
   // 获取透视切片
   getPerspective: (data) => request.post('/image/crop', data),
+  // 获取透视切片二进制图像 (theta/phi/fov/w/h/fmt/quality，支持 ETag 缓存)
+  getPerspectiveView: (imageId, params) =>
+    request.get(`/image/${imageId}/view`, { params, responseType: 'blob' }),
   // 保存标注
   saveAnnotation: (imageId, data) => request.post(`/image/${imageId}/annotate`, data),
 }